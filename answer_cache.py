@@ -0,0 +1,87 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+
+
+class SemanticAnswerCache:
+    '''
+    Cache câu trả lời theo (tập PDF đã chọn, câu hỏi đã chuẩn hóa).
+    Câu hỏi gần giống (cosine >= similarity_threshold) cũng dùng lại câu trả lời cũ.
+    '''
+    def __init__(self, similarity_threshold=0.95, ttl_seconds=3600, max_entries=1000):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def normalize_question(self, question):
+        question = unicodedata.normalize('NFC', question).lower()
+        question = re.sub(r'\s+', ' ', question)
+        return question.strip(' ?.!')
+
+    def unit_vector(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, doc_ids, question, question_vector=None):
+        key = frozenset(doc_ids)
+        normalized = self.normalize_question(question)
+        now = time.time()
+        with self.lock:
+            entries = self.entries.get(key, [])
+            entries[:] = [entry for entry in entries if now - entry["created"] < self.ttl_seconds]
+
+            match = next((entry for entry in entries if entry["question"] == normalized), None)
+            if match is None and question_vector is not None and entries:
+                matrix = np.stack([entry["vector"] for entry in entries])
+                similarities = matrix @ self.unit_vector(question_vector)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    match = entries[best]
+
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return match["answer"], match["context"]
+
+    def put(self, doc_ids, question, question_vector, answer, context):
+        key = frozenset(doc_ids)
+        entry = {
+            "question": self.normalize_question(question),
+            "vector": self.unit_vector(question_vector),
+            "answer": answer,
+            "context": context,
+            "created": time.time(),
+        }
+        with self.lock:
+            entries = self.entries.setdefault(key, [])
+            entries[:] = [e for e in entries if e["question"] != entry["question"]]
+            entries.append(entry)
+            del entries[:-self.max_entries]
+
+    def invalidate(self, doc_id):
+        with self.lock:
+            for key in [key for key in self.entries if doc_id in key]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            size = sum(len(entries) for entries in self.entries.values())
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+answer_cache = SemanticAnswerCache(
+    similarity_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+)
@@ -1,19 +1,67 @@
+import time
+_import_start = time.perf_counter()
 import streamlit as st
-import tempfile
+import hashlib
 import os
+import threading
+import uuid
 from pdf_processor import PDFDatabaseManager
-import time
 from pdf_processor import ContextRetriever
 from botMode import chatBotMode
 from text_processor import TextProcessor
-from chat import gemini_bot
+from llm_backend import get_llm_client
+from llm_client import LLMError
+from answer_cache import answer_cache
+from embedding import warm_up
+from reranker import get_reranker
+from jobs import ACTIVE_STATUSES, JobQueue
+from index_registry import index_registry
+import tracing
+
+import_seconds = time.perf_counter() - _import_start
 
 vector_db_path = "vectorstores/db_faiss"
-hash_store_path = "vectorstores/hashes.json"
+catalog_path = "vectorstores/catalog.sqlite3"
 pdf_data_path = ''
+# PDF upload được giữ lại để job chạy nền (và retry) còn đọc được
+upload_dir = "uploads"
 
 text_processor = TextProcessor()
-manager = PDFDatabaseManager(pdf_data_path, vector_db_path, hash_store_path)
+
+
+@st.cache_resource
+def get_manager():
+    # Một index chung cho cả process (index_registry), không tải lại sau mỗi lần rerun hay theo từng session
+    return PDFDatabaseManager.open(pdf_data_path, vector_db_path, catalog_path).value
+
+
+@st.cache_resource
+def get_job_queue():
+    # Worker ingest chạy nền trong process, dùng chung manager với các session
+    return JobQueue(get_manager()).start()
+
+
+@st.cache_resource
+def get_startup_metrics():
+    # Chỉ lần chạy đầu của process mới thực sự import các module, các lần rerun dùng lại kết quả này
+    metrics = {"import_seconds": import_seconds}
+    print(f"Startup: importing app modules took {import_seconds:.2f}s")
+    if os.getenv("METRICS_PORT"):
+        tracing.serve_metrics(int(os.getenv("METRICS_PORT")), os.getenv("METRICS_HOST", "127.0.0.1"))
+    if os.getenv("WARM_UP", "0") == "1":
+        def run_warm_up():
+            metrics["warm_up_seconds"] = warm_up()
+            get_llm_client()
+            if os.getenv("RERANK", "0") == "1":
+                get_reranker().warm_up()
+            print(f"Startup: warm-up took {metrics['warm_up_seconds']:.2f}s")
+        threading.Thread(target=run_warm_up, daemon=True).start()
+    return metrics
+
+
+startup_metrics = get_startup_metrics()
+manager = get_manager()
+job_queue = get_job_queue()
 retriever = ContextRetriever("original_text")
 
 def hide_elements():
@@ -35,6 +83,58 @@ def hide_elements():
     """
     st.markdown(hide_elements_style, unsafe_allow_html=True)
 
+def save_upload(uploaded_file):
+    '''
+    Ghi file upload vào uploads/<hash nội dung>/<tên file>: hai session upload hai file cùng tên
+    không ghi đè lên nhau (hay lên file worker đang đọc), cùng nội dung thì dùng chung một đường dẫn.
+    '''
+    data = uploaded_file.getbuffer()
+    file_dir = os.path.join(upload_dir, hashlib.sha256(data).hexdigest()[:16])
+    os.makedirs(file_dir, exist_ok=True)
+    file_path = os.path.join(file_dir, os.path.basename(uploaded_file.name))
+    if not os.path.exists(file_path):
+        # ghi ra file tạm riêng rồi os.replace, worker không đọc phải file ghi dở
+        part_path = f"{file_path}.{uuid.uuid4().hex}.part"
+        with open(part_path, "wb") as f:
+            f.write(data)
+        os.replace(part_path, file_path)
+    return file_path
+
+
+@st.fragment(run_every=1)
+def show_jobs():
+    '''Tiến độ các job ingest của session này, tự cập nhật mỗi giây mà không chạy lại cả trang.'''
+    jobs = job_queue.list_jobs(limit=20, job_ids=st.session_state.job_ids)
+    finished = [job for job in jobs if job["status"] == "done" and job["job_id"] not in st.session_state.seen_jobs]
+    if finished:
+        # tài liệu vừa xong: thêm vào danh sách query rồi chạy lại cả trang để sidebar cập nhật
+        for job in finished:
+            st.session_state.seen_jobs.add(job["job_id"])
+            if manager.has_document(job["doc_id"]):
+                st.session_state.vector_db[job["file_name"]] = job["doc_id"]
+                st.session_state.selected_pdfs.add(job["file_name"])
+        st.rerun()
+
+    for job in jobs:
+        if job["status"] == "done" or (job["status"] == "cancelled" and job["job_id"] in st.session_state.seen_jobs):
+            continue
+        if job["status"] in ACTIVE_STATUSES:
+            total = job["total_pages"] or 0
+            label = (f"{job['file_name']}: {job['pages_done']}/{total} pages, {job['chunks_done']} chunks embedded"
+                     if job["status"] == "running" else f"{job['file_name']}: queued")
+            st.progress(job["pages_done"] / total if total else 0.0, text=label)
+            if st.button("Cancel", key=f"cancel_{job['job_id']}"):
+                job_queue.cancel(job["job_id"])
+        else:
+            st.caption(f"{job['file_name']}: {job['status']}" + (f" ({job['error']})" if job["error"] else ""))
+            col_retry, col_dismiss = st.columns(2)
+            if col_retry.button("Retry", key=f"retry_{job['job_id']}"):
+                job_queue.retry(job["job_id"])
+            if col_dismiss.button("Dismiss", key=f"dismiss_{job['job_id']}"):
+                st.session_state.seen_jobs.add(job["job_id"])
+                st.rerun(scope="fragment")
+
+
 def main():
     st.set_page_config(page_title="ChatPDF", page_icon='🤖')
     col1, col2 = st.columns([0.6, 0.4])
@@ -61,12 +161,25 @@ def main():
     if "selected_pdfs" not in st.session_state:
         st.session_state.selected_pdfs = set()
     if "vector_db" not in st.session_state:
+        # chỉ tài liệu do session này upload, không hiện tài liệu của người dùng khác
         st.session_state.vector_db = {}
+        # job ingest do session này tạo
+        st.session_state.job_ids = []
+        st.session_state.seen_jobs = set()
 
     st.session_state.chat_bot.vector_db = st.session_state.vector_db
+    st.session_state.chat_bot.manager = manager
 
     with st.sidebar:
         st.title("Settings")
+        startup_info = f"Import: {startup_metrics['import_seconds']:.2f}s"
+        if "first_query_seconds" in startup_metrics:
+            startup_info += f" · First query: {startup_metrics['first_query_seconds']:.2f}s"
+        st.caption(startup_info)
+        registry_stats = index_registry.stats()
+        st.caption(f"Indexes: {registry_stats['entries']} loaded, {registry_stats['bytes'] / 2 ** 20:.0f}/"
+                   f"{registry_stats['memory_budget'] / 2 ** 20:.0f} MB · hit rate {registry_stats['hit_rate']:.0%} · "
+                   f"load {registry_stats['load_seconds']:.2f}s")
 
         mode = st.radio("Choose mode: ", ("Chat", "PDF Query"))
         st.session_state.chat_bot.set_mode(mode.lower().replace(" ", "_"))
@@ -75,39 +188,25 @@ def main():
         pdf_docs = st.file_uploader("You can upload multiple PDFs", type="pdf", accept_multiple_files=True)
         if st.button("Submit & Process"):
             if pdf_docs:
-                with st.spinner("Processing..."):
-                    status_placeholder = st.empty()
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        manager.pdf_data_path = temp_dir
-                        for uploaded_file in pdf_docs:
-                            file_path = os.path.join(temp_dir, uploaded_file.name)
-                            with open(file_path, "wb") as f:
-                                f.write(uploaded_file.getbuffer())
-
-                        pdf_files = [f for f in os.listdir(temp_dir) if f.lower().endswith('.pdf')]
-                        for pdf_file in pdf_files:
-                            file_path = os.path.join(temp_dir, pdf_file)
-                            if not manager.is_pdf_exists(file_path):
-                                status_placeholder.write(f"Processing {pdf_file}...")
-                                db = manager.update_db(file_path)
-                                if db is not None:
-                                    st.session_state.vector_db[pdf_file] = db
-                                st.session_state.processed_pdfs.append(pdf_file)
-                                st.session_state.selected_pdfs.add(pdf_file)
-                            else:
-                                status_placeholder.write(f"{pdf_file} already exists in the database.")
-
-                    for pdf_file in st.session_state.processed_pdfs:
-                        db = manager.load_existing_db(pdf_file)
-                        if db is not None:
-                            st.session_state.vector_db[pdf_file] = db
-
-                    st.success("PDFs processed and vector database created!")
-                    time.sleep(2)
-                    status_placeholder.empty()
+                os.makedirs(upload_dir, exist_ok=True)
+                manager.pdf_data_path = upload_dir
+                for uploaded_file in pdf_docs:
+                    file_path = save_upload(uploaded_file)
+                    document = manager.catalog.find_by_hash(manager.calculate_file_hash(file_path))
+                    if document is not None:
+                        st.write(f"{uploaded_file.name} already exists in the database.")
+                        if manager.has_document(document["doc_id"]):
+                            st.session_state.vector_db[uploaded_file.name] = document["doc_id"]
+                    else:
+                        job_id = job_queue.submit(file_path)
+                        if job_id not in st.session_state.job_ids:
+                            st.session_state.job_ids.append(job_id)
+                        st.session_state.processed_pdfs.append(uploaded_file.name)
             else:
                 st.warning("No file selected")
 
+        show_jobs()
+
         st.title("Manage PDFs")
         if st.session_state.chat_bot.mode == "pdf_query":
             if not st.session_state.vector_db:
@@ -133,10 +232,11 @@ def main():
             st.markdown(message["content"])
 
     if user_question:
+        query_start = time.perf_counter()
         with st.chat_message("user"):
             st.markdown(user_question)
 
-        response = None
+        response_stream = None
         context = None
 
 
@@ -154,7 +254,7 @@ def main():
                                 temp_vector_db = st.session_state.chat_bot.vector_db
                                 st.session_state.chat_bot.vector_db = selected_dbs
 
-                                response, context = st.session_state.chat_bot.process_question(user_question)
+                                response_stream, context = st.session_state.chat_bot.process_question_stream(user_question)
 
                                 st.session_state.chat_bot.vector_db = temp_vector_db
                                 st.session_state.current_context = context
@@ -164,24 +264,30 @@ def main():
                             st.warning("Please upload your files first, we will use them to answer.")
                     else:
                         st.session_state.current_context = ""
-                        response = st.session_state.chat_bot.process_question(user_question)
+                        response_stream = st.session_state.chat_bot.process_question_stream(user_question)
 
-        if response:
-            display_response = text_processor.remove_markdown(response)
+                    # Spinner chờ đến khi có token đầu tiên
+                    first_delta = next(response_stream, "") if response_stream is not None else ""
+
+        if first_delta:
             with st.chat_message('assistant'):
                 message_placeholder = st.empty()
-                full_response = ""
-                for chunk in display_response.split():
-                    full_response += chunk + " "
-                    time.sleep(0.04)
-                    message_placeholder.write(full_response + "▌")
-                time.sleep(0.1)
+                response = first_delta
+                message_placeholder.write(text_processor.remove_markdown(response) + "▌")
+                for delta in response_stream:
+                    response += delta
+                    message_placeholder.write(text_processor.remove_markdown(response) + "▌")
                 if st.session_state.chat_bot.mode == "pdf_query":
                     final_message = "**Answer extracted from the document:**\n\n" + response
                 else:
+                    response = response.strip()
                     final_message = response
                 message_placeholder.markdown(final_message)
 
+            if "first_query_seconds" not in startup_metrics:
+                startup_metrics["first_query_seconds"] = time.perf_counter() - query_start
+                print(f"Startup: first query took {startup_metrics['first_query_seconds']:.2f}s")
+
             if context:
                 with st.expander("Show Context", expanded=False):
                     formatted_context = text_processor.format_context(context)
@@ -216,19 +322,19 @@ def main():
                                             Nếu không có yêu cầu về số từ, hãy dừng lại khi câu trả lời đầy đủ.
                                             Nếu có yêu cầu về số từ, số từ = số từ trong câu trả lời trước + số từ trong câu trả lời mới:
                                         """
-                continuation = gemini_bot.response(continue_prompt)
-                display_continuation = text_processor.remove_markdown(continuation)
-
                 with st.container():
                     left_spacer, right_content = st.columns([0.06, 0.94])
                     with right_content:
                         message_placeholder = st.empty()
-                        full_continuation = ""
-                        for chunk in display_continuation.split():
-                            full_continuation += chunk + " "
-                            time.sleep(0.05)
-                            message_placeholder.write(full_continuation + "▌", unsafe_allow_html=True)
-                        time.sleep(0.1)
+                        continuation = ""
+                        try:
+                            for delta in get_llm_client().stream_response(continue_prompt):
+                                continuation += delta
+                                message_placeholder.write(text_processor.remove_markdown(continuation) + "▌",
+                                                          unsafe_allow_html=True)
+                        except LLMError as e:
+                            print(f"LLM error: {e}")
+                            st.error("Hệ thống đang quá tải hoặc mất kết nối, vui lòng thử lại sau.")
                         message_placeholder.markdown(continuation + "\n", unsafe_allow_html=True)
 
                 st.session_state.messages.append({"role": "assistant", "content": continuation})
@@ -236,12 +342,32 @@ def main():
 import shutil
 def clean_data():
     try:
+        # dừng worker ingest trước khi xóa, tránh job đang chạy ghi vào thư mục vừa bị xóa
+        job_queue = get_job_queue()
+        if not job_queue.stop(timeout=30, cancel_running=True):
+            job_queue.start()
+            st.error("Đang có tài liệu được xử lý, vui lòng thử lại sau.")
+            return
+        # xóa các job và danh mục tài liệu trong SQLite, job "done" cũ không còn trỏ tới tài liệu đã xóa
+        for job in job_queue.list_jobs(statuses=ACTIVE_STATUSES, limit=1000):
+            job_queue.cancel(job["job_id"])
+        job_queue.clear_finished()
+        manager.catalog.clear()
+        get_job_queue.clear()
+
         if os.path.exists("vectorstores"):
             shutil.rmtree("vectorstores")
             
         if os.path.exists("original_text"):
             shutil.rmtree("original_text")
 
+        if os.path.exists(upload_dir):
+            shutil.rmtree(upload_dir)
+
+        get_manager.clear()
+        index_registry.clear()
+        answer_cache.clear()
+
         for key in list(st.session_state.keys()):
             del st.session_state[key]
 
@@ -0,0 +1,122 @@
+"""
+So sánh các backend embedding (torch float32, int8, onnx) trên "Chat with PDF.pdf":
+tốc độ encode (chunks/sec), RSS sau khi encode và recall@k so với float32.
+
+    python benchmarks/bench_embedding_backends.py [--backends torch int8 onnx] [--k 2 5] [--queries 100]
+
+Mỗi backend chạy trong một process riêng để số RSS không bị lẫn.
+Câu hỏi thử là một đoạn ~20 từ lấy từ giữa các chunk; recall@k là tỉ lệ top-k
+của backend trùng với top-k của float32 (tìm kiếm chính xác).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def current_rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except ImportError:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def load_corpus(pdf_path, num_queries):
+    from pdf_processor import make_text_splitter, extract_page_texts
+
+    chunks = [chunk[0] for chunk in make_text_splitter().split_pages(extract_page_texts(pdf_path))]
+    rng = np.random.default_rng(0)
+    queries = []
+    for i in rng.choice(len(chunks), size=min(num_queries, len(chunks)), replace=False):
+        words = chunks[i].split()
+        middle = len(words) // 2
+        queries.append(" ".join(words[max(0, middle - 10):middle + 10]))
+    return chunks, queries
+
+
+def run_backend(backend, pdf_path, num_queries, out_dir, batch_size):
+    from embedding import EmbeddingEngine, load_model
+
+    chunks, queries = load_corpus(pdf_path, num_queries)
+    start = time.perf_counter()
+    engine = EmbeddingEngine(load_model(backend), batch_size=batch_size)
+    load_seconds = time.perf_counter() - start
+    engine.encode(chunks[:8])  # warm-up
+
+    doc_vectors = engine.encode(chunks)
+    chunks_per_sec = engine.throughput()
+    query_vectors = engine.encode(queries)
+    np.save(os.path.join(out_dir, f"{backend}_docs.npy"), doc_vectors)
+    np.save(os.path.join(out_dir, f"{backend}_queries.npy"), query_vectors)
+    print(json.dumps({
+        "backend": backend,
+        "chunks": len(chunks),
+        "load_seconds": load_seconds,
+        "chunks_per_sec": chunks_per_sec,
+        "rss_mb": current_rss_mb(),
+    }))
+
+
+def top_k(doc_vectors, query_vectors, k):
+    # cùng khoảng cách L2 như IndexFlatL2 của FAISS
+    distances = ((query_vectors[:, None, :] - doc_vectors[None, :, :]) ** 2).sum(-1)
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf", nargs="?", default=os.path.join(ROOT, "Chat with PDF.pdf"))
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8", "onnx"])
+    parser.add_argument("--k", type=int, nargs="+", default=[2, 5])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--run-backend", help=argparse.SUPPRESS)
+    parser.add_argument("--out-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_backend:
+        run_backend(args.run_backend, args.pdf, args.queries, args.out_dir, args.batch_size)
+        return
+
+    backends = ["torch"] + [backend for backend in args.backends if backend != "torch"]
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for backend in backends:
+            command = [sys.executable, os.path.abspath(__file__), args.pdf, "--run-backend", backend,
+                       "--out-dir", out_dir, "--queries", str(args.queries), "--batch-size", str(args.batch_size)]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"{backend:>6}: failed\n{completed.stderr.strip().splitlines()[-1:]}")
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+
+            baseline_docs = np.load(os.path.join(out_dir, "torch_docs.npy")).astype(np.float32)
+            baseline_queries = np.load(os.path.join(out_dir, "torch_queries.npy")).astype(np.float32)
+            docs = np.load(os.path.join(out_dir, f"{backend}_docs.npy")).astype(np.float32)
+            queries = np.load(os.path.join(out_dir, f"{backend}_queries.npy")).astype(np.float32)
+            for k in args.k:
+                expected = top_k(baseline_docs, baseline_queries, k)
+                found = top_k(docs, queries, k)
+                overlap = [len(set(e) & set(f)) / k for e, f in zip(expected, found)]
+                result[f"recall@{k}"] = float(np.mean(overlap))
+            results.append(result)
+
+            recalls = ", ".join(f"recall@{k} {result[f'recall@{k}']:.3f}" for k in args.k)
+            print(f"{backend:>6}: {result['chunks_per_sec']:.1f} chunks/sec, RSS {result['rss_mb']:.0f} MB, "
+                  f"load {result['load_seconds']:.1f}s, {recalls}")
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Benchmark end-to-end, chạy offline (không gọi Gemini):
+ingest bằng PDFDatabaseManager.update_db, query qua chatBotMode.process_question
+với LLM giả, và chi phí ContextRetriever.expand_context.
+
+    python benchmarks/bench_end_to_end.py [--sizes 1 10 100 1000] [--queries 200] [--output bench.json]
+    python benchmarks/bench_end_to_end.py --compare old.json new.json
+
+Size 1 là "Chat with PDF.pdf"; size lớn hơn là corpus tổng hợp, mỗi PDF ghép ngẫu nhiên
+--pages-per-pdf trang của file gốc. Mỗi size chạy trong một process và thư mục tạm riêng
+để peak RSS, cache và index không lẫn giữa các lần đo. Embedding cache và answer cache
+bị tắt (trừ khi truyền --cache) để đo đúng chi phí encode và retrieval.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def summarize(seconds):
+    values = np.asarray(seconds, dtype=np.float64) * 1000
+    if len(values) == 0:
+        return {"n": 0}
+    return {
+        "n": int(len(values)),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def peak_rss_mb():
+    # Linux: ru_maxrss tính bằng KB
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def make_corpus(pdf_path, size, out_dir, pages_per_pdf, seed=0):
+    if size == 1:
+        path = os.path.join(out_dir, os.path.basename(pdf_path))
+        shutil.copy(pdf_path, path)
+        return [path]
+
+    from pypdf import PdfReader, PdfWriter
+    reader = PdfReader(pdf_path)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(size):
+        writer = PdfWriter()
+        for page in rng.choice(len(reader.pages), size=pages_per_pdf, replace=True):
+            writer.add_page(reader.pages[int(page)])
+        # tiêu đề khác nhau để hash file không trùng dù chọn trùng trang
+        writer.add_metadata({"/Title": f"synthetic {i}"})
+        path = os.path.join(out_dir, f"synthetic_{i:04d}.pdf")
+        with open(path, "wb") as f:
+            writer.write(f)
+        paths.append(path)
+    return paths
+
+
+def sample_queries(manager, num_queries, seed=0):
+    '''Câu hỏi thử: ~12 từ ở giữa các chunk ngẫu nhiên.'''
+    docstore_ids = list(manager.db.index_to_docstore_id.values())
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.choice(len(docstore_ids), size=min(num_queries, len(docstore_ids)), replace=False):
+        words = manager.db.docstore.search(docstore_ids[i]).page_content.split()
+        middle = len(words) // 2
+        queries.append(" ".join(words[max(0, middle - 6):middle + 6]))
+    return queries
+
+
+def bench_ingest(manager, paths, batch):
+    from pdf_processor import count_pages
+
+    total_pages = sum(count_pages(path) for path in paths)
+    embed_seconds = 0.0
+    start = time.perf_counter()
+    if batch:
+        manager.update_many(paths)
+        embed_seconds += manager.last_ingest_stats.get("embed_seconds", 0.0)
+    else:
+        for path in paths:
+            manager.update_db(path)
+            embed_seconds += manager.last_ingest_stats.get("embed_seconds", 0.0)
+    seconds = time.perf_counter() - start
+    chunks = manager.db.index.ntotal if manager.db is not None else 0
+    return {
+        "files": len(paths),
+        "pages": total_pages,
+        "chunks": chunks,
+        "seconds": seconds,
+        "embed_seconds": embed_seconds,
+        "pages_per_sec": total_pages / seconds if seconds else 0.0,
+        "chunks_per_sec": chunks / seconds if seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_queries(manager, paths, queries, llm_latency):
+    from botMode import chatBotMode
+    from llm_backend import StubLLM
+    from llm_client import LLMClient
+
+    names = {os.path.basename(path): manager.get_doc_id(path) for path in paths}
+    session = SimpleNamespace(selected_pdfs=list(names), history_global=[])
+    bot = chatBotMode(llm=LLMClient(StubLLM(llm_latency)), session_state=session)
+    bot.manager = manager
+    bot.vector_db = names
+    bot.set_mode("pdf_query")
+
+    bot.process_question(queries[0])  # warm-up: tải model, mmap index
+    stages = {}
+    walls = []
+    for query in queries:
+        session.history_global = []
+        start = time.perf_counter()
+        bot.process_question(query)
+        walls.append(time.perf_counter() - start)
+        for stage, seconds in bot.last_timings.items():
+            stages.setdefault(stage, []).append(seconds)
+    result = {stage: summarize(values) for stage, values in stages.items()}
+    result["wall"] = summarize(walls)
+    return result
+
+
+def bench_expand_context(manager, num_samples, seed=0):
+    from pdf_processor import ContextRetriever
+    from text_processor import TextProcessor
+
+    retriever = ContextRetriever("original_text")
+    text_processor = TextProcessor()
+    docstore_ids = list(manager.db.index_to_docstore_id.values())
+    rng = np.random.default_rng(seed)
+    docs = [manager.db.docstore.search(docstore_ids[i])
+            for i in rng.choice(len(docstore_ids), size=min(num_samples, len(docstore_ids)), replace=False)]
+
+    result = {}
+    for name, use_offsets in (("offsets", True), ("search", False)):
+        timings = []
+        for doc in docs:
+            file_name = text_processor.remove_accents(retriever.get_file_name(doc.metadata))
+            start = time.perf_counter()
+            retriever.expand_context(file_name, doc.page_content, metadata=doc.metadata if use_offsets else None)
+            timings.append(time.perf_counter() - start)
+        result[name] = summarize(timings)
+    return result
+
+
+def run_size(args, size):
+    from pdf_processor import PDFDatabaseManager
+
+    corpus_dir = os.path.join(os.getcwd(), "corpus")
+    os.makedirs(corpus_dir, exist_ok=True)
+    paths = make_corpus(os.path.abspath(args.pdf), size, corpus_dir, args.pages_per_pdf)
+    manager = PDFDatabaseManager("data", "vectorstores/db_faiss", "vectorstores/catalog.sqlite3")
+
+    result = {"size": size, "ingest": bench_ingest(manager, paths, args.batch)}
+    queries = sample_queries(manager, args.queries)
+    result["query"] = bench_queries(manager, paths, queries, args.llm_latency_ms / 1000)
+    result["expand_context"] = bench_expand_context(manager, args.queries)
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = {result["size"]: result for result in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {result["size"]: result for result in json.load(f)["results"]}
+
+    def change(before, after):
+        return f"{before:10.2f} -> {after:10.2f} ({(after - before) / before * 100 if before else 0:+6.1f}%)"
+
+    for size in sorted(set(old) & set(new)):
+        print(f"size {size}")
+        for key in ("pages_per_sec", "chunks_per_sec"):
+            print(f"  ingest {key:<20} {change(old[size]['ingest'][key], new[size]['ingest'][key])}")
+        for stage in sorted(set(old[size]["query"]) & set(new[size]["query"])):
+            for q in ("p50_ms", "p95_ms"):
+                if q in old[size]["query"][stage] and q in new[size]["query"][stage]:
+                    print(f"  query {stage + ' ' + q:<21} "
+                          f"{change(old[size]['query'][stage][q], new[size]['query'][stage][q])}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf", nargs="?", default=os.path.join(ROOT, "Chat with PDF.pdf"))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--pages-per-pdf", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--batch", action="store_true", help="ingest bằng update_many thay vì update_db từng file")
+    parser.add_argument("--cache", action="store_true", help="giữ embedding cache và answer cache")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.run_size:
+        run_size(args, args.run_size)
+        return
+
+    env = dict(os.environ)
+    if not args.cache:
+        env["EMBEDDING_CACHE"] = "0"
+        env["ANSWER_CACHE_TTL"] = "0"
+    forwarded = ["--pages-per-pdf", str(args.pages_per_pdf), "--queries", str(args.queries),
+                 "--llm-latency-ms", str(args.llm_latency_ms)] + (["--batch"] if args.batch else [])
+
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            command = [sys.executable, os.path.abspath(__file__), os.path.abspath(args.pdf),
+                       "--run-size", str(size)] + forwarded
+            completed = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"size {size}: failed\n{completed.stderr.strip()[-2000:]}")
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append(result)
+        ingest, query = result["ingest"], result["query"]
+        print(f"size {size:>5}: {ingest['pages_per_sec']:.1f} pages/sec, {ingest['chunks_per_sec']:.1f} chunks/sec, "
+              f"peak RSS {ingest['peak_rss_mb']['self']:.0f} MB | query p50 {query['wall']['p50_ms']:.1f} ms, "
+              f"p95 {query['wall']['p95_ms']:.1f} ms | expand_context p50 "
+              f"{result['expand_context']['offsets']['p50_ms']:.2f} ms (search "
+              f"{result['expand_context']['search']['p50_ms']:.2f} ms)")
+
+    settings = ("VECTOR_INDEX_TYPE", "HYBRID_SEARCH", "RERANK", "EMBEDDING_BACKEND", "EMBEDDING_BATCH_SIZE",
+                "INGEST_WORKERS", "PDF_TEXT_BACKEND", "STREAMING_PAGES")
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pdf": os.path.basename(args.pdf),
+            "pages_per_pdf": args.pages_per_pdf,
+            "queries": args.queries,
+            "batch": args.batch,
+            "cache": args.cache,
+            "settings": {name: env[name] for name in settings if name in env},
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
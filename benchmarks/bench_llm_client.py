@@ -0,0 +1,107 @@
+"""
+Load test LLMClient với backend giả lập (StubLLM) trong process, không cần mạng hay API key:
+throughput và p50/p95/p99 độ trễ khi backend thỉnh thoảng chậm (tail) hoặc trả lỗi 429,
+so sánh không retry, retry có backoff, và retry + hedge.
+
+    python benchmarks/bench_llm_client.py [--requests 2000] [--concurrency 32] [--latency-ms 50]
+        [--tail-ms 1000 --tail-rate 0.05] [--error-rate 0.02] [--hedge-ms 150] [--rate 0]
+
+Mỗi worker gửi request nối tiếp nhau (closed loop), độ trễ tính cả thời gian chờ rate limit / retry.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from llm_backend import StubLLM
+from llm_client import LLMClient, LLMError
+
+
+async def run(client, requests, concurrency, timeout):
+    latencies, errors = [], []
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                await client.generate(f"question {i}", timeout=timeout)
+            except LLMError as e:
+                errors.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def bench(name, args, max_retries, hedge_after):
+    backend = StubLLM(latency_seconds=args.latency_ms / 1000, token_seconds=args.token_ms / 1000,
+                      tail_seconds=args.tail_ms / 1000, tail_rate=args.tail_rate, error_rate=args.error_rate,
+                      seed=args.seed)
+    client = LLMClient(backend, max_concurrency=args.concurrency, rate=args.rate, timeout=args.timeout,
+                       max_retries=max_retries, backoff=args.backoff_ms / 1000, hedge_after=hedge_after)
+    # bỏ log từng lần retry của client
+    with contextlib.redirect_stdout(io.StringIO()):
+        latencies, errors, elapsed = asyncio.run(run(client, args.requests, args.concurrency, args.timeout))
+    values = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "client": name,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_sec": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "backend_calls": backend.calls,
+        "peak_in_flight": backend.peak_in_flight,
+        "retries": client.stats["retries"],
+        "hedges": client.stats["hedges"],
+        "hedge_wins": client.stats["hedge_wins"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--token-ms", type=float, default=0)
+    parser.add_argument("--tail-ms", type=float, default=1000)
+    parser.add_argument("--tail-rate", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--hedge-ms", type=float, default=150)
+    parser.add_argument("--rate", type=float, default=0, help="giới hạn request/giây của client, 0 = không giới hạn")
+    parser.add_argument("--backoff-ms", type=float, default=50)
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configs = (("no retry", 0, None), ("retry", 3, None), ("retry+hedge", 3, args.hedge_ms / 1000))
+    results = []
+    for name, max_retries, hedge_after in configs:
+        result = bench(name, args, max_retries, hedge_after)
+        results.append(result)
+        print(f"{name:>12}: {result['requests_per_sec']:.0f} req/s, {result['errors']} errors, "
+              f"p50 {result['p50_ms']:.0f} ms, p95 {result['p95_ms']:.0f} ms, p99 {result['p99_ms']:.0f} ms, "
+              f"{result['backend_calls']} backend calls ({result['retries']} retries, {result['hedges']} hedges, "
+              f"{result['hedge_wins']} won), peak {result['peak_in_flight']} in flight")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
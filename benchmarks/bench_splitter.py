@@ -0,0 +1,82 @@
+"""
+So sánh SentenceSplitter (chia một lần trên cả tài liệu, theo câu tiếng Việt) với
+RecursiveCharacterTextSplitter chạy riêng từng trang như trước (kể cả tính vị trí byte
+của chunk): chunks/sec, số chunk, độ dài chunk và số chunk vắt qua hai trang.
+
+    python benchmarks/bench_splitter.py ["Chat with PDF.pdf"] [--repeat 20]
+
+Text được đọc một lần trước khi đo, nên chỉ đo thời gian chia chunk.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from pdf_processor import extract_page_texts, make_text_splitter
+
+
+def recursive_split(texts):
+    # cấu hình cũ của pdf_processor: mỗi trang một splitter mới
+    chunks = []
+    for page, text in enumerate(texts):
+        text_splitter = RecursiveCharacterTextSplitter(
+            separators=["\n\n", "\n", " ", ".", "!", "?", ""],
+            chunk_size=512,
+            chunk_overlap=256,
+            length_function=len,
+            add_start_index=True
+        )
+        for chunk in text_splitter.create_documents([text]):
+            # vị trí byte trong trang như split_page cũ
+            start = len(text[:chunk.metadata["start_index"]].encode('utf-8'))
+            chunks.append((chunk.page_content, page, page, start, start + len(chunk.page_content.encode('utf-8'))))
+    return chunks
+
+
+def sentence_split(texts):
+    return make_text_splitter().split_pages(texts)
+
+
+def bench(name, split, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        chunks = split(texts)
+    seconds = (time.perf_counter() - start) / repeat
+    lengths = [len(chunk[0]) for chunk in chunks]
+    return {
+        "splitter": name,
+        "chunks": len(chunks),
+        "chunks_per_sec": len(chunks) / seconds,
+        "pages_per_sec": len(texts) / seconds,
+        "avg_chars": sum(lengths) / len(lengths) if lengths else 0.0,
+        "total_chars": sum(lengths),
+        "cross_page": sum(1 for chunk in chunks if chunk[1] != chunk[2]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf", nargs="?", default=os.path.join(ROOT, "Chat with PDF.pdf"))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    # SentenceSplitter đọc end_tokens.txt theo thư mục hiện tại
+    os.chdir(ROOT)
+    texts = extract_page_texts(args.pdf)
+    document_chars = sum(len(text) for text in texts)
+    print(f"{os.path.basename(args.pdf)}: {len(texts)} pages, {document_chars} chars")
+    for name, split in (("recursive", recursive_split), ("sentence", sentence_split)):
+        result = bench(name, split, texts, args.repeat)
+        print(f"{name:>10}: {result['chunks']} chunks, {result['chunks_per_sec']:.0f} chunks/sec, "
+              f"{result['pages_per_sec']:.0f} pages/sec, avg {result['avg_chars']:.0f} chars, "
+              f"{result['total_chars'] / max(document_chars, 1):.2f}x text indexed, "
+              f"{result['cross_page']} cross-page")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+So sánh tốc độ trích xuất text (pages/sec) giữa các backend của pdf_processor,
+và tốc độ đọc song song theo số worker.
+
+    python benchmarks/bench_text_backends.py ["Chat with PDF.pdf"] [--copies 8] [--workers 1 4]
+
+Backend pymupdf cần cài thêm: pip install pymupdf
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_processor import TEXT_BACKENDS, PDFDatabaseManager, count_pages, extract_page_texts
+
+
+def bench_backend(file_path, backend, repeat):
+    num_pages = count_pages(file_path, backend)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        texts = extract_page_texts(file_path, backend)
+    seconds = time.perf_counter() - start
+    return {
+        "backend": backend,
+        "pages": num_pages,
+        "chars": sum(len(text) for text in texts),
+        "pages_per_sec": num_pages * repeat / seconds,
+    }
+
+
+def bench_parallel(manager, file_path, backend, copies, workers):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_paths = []
+        for i in range(copies):
+            copy_path = os.path.join(temp_dir, f"copy_{i}.pdf")
+            shutil.copy(file_path, copy_path)
+            file_paths.append(copy_path)
+        start = time.perf_counter()
+        parsed = manager.parse_pdfs(file_paths, backend, workers)
+        seconds = time.perf_counter() - start
+    num_pages = sum(len(pages) for pages in parsed.values())
+    return num_pages / seconds
+
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf", nargs="?", default=os.path.join(root, "Chat with PDF.pdf"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--copies", type=int, default=8)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    available = []
+    for backend in TEXT_BACKENDS:
+        try:
+            result = bench_backend(args.pdf, backend, args.repeat)
+        except ImportError as e:
+            print(f"{backend:>8}: skipped ({e})")
+            continue
+        available.append(backend)
+        print(f"{backend:>8}: {result['pages']} pages, {result['chars']} chars, "
+              f"{result['pages_per_sec']:.1f} pages/sec")
+
+    manager = PDFDatabaseManager("", os.path.join(root, "vectorstores", "db_faiss"),
+                                 os.path.join(root, "vectorstores", "catalog.sqlite3"))
+    for backend in available:
+        for workers in args.workers:
+            pages_per_sec = bench_parallel(manager, args.pdf, backend, args.copies, workers)
+            print(f"{backend:>8}: parse {args.copies} copies, {workers} workers: {pages_per_sec:.1f} pages/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Load test cho server.py: nhiều client đồng thời gửi POST /query trong một khoảng thời gian.
+
+    LLM_BACKEND=stub ANSWER_CACHE_TTL=0 python server.py --port 8000 &
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 32 --duration 30 [--ingest "Chat with PDF.pdf"]
+
+Mặc định dùng vài câu hỏi về tài liệu mẫu, hoặc --questions file.txt (mỗi dòng một câu).
+Mỗi câu hỏi được gắn thêm số thứ tự để không trúng cache câu hỏi / câu trả lời của server
+(--repeat để gửi nguyên câu, đo cả hiệu quả cache).
+In ra throughput, tỉ lệ lỗi, p50/p95/p99 độ trễ; --output ghi kết quả JSON.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_QUESTIONS = [
+    "Chat with PDF là gì?",
+    "FAISS được dùng để làm gì?",
+    "Embedding model nào được sử dụng?",
+    "Retrieval-Augmented Generation hoạt động như thế nào?",
+    "Cách chia chunk văn bản ra sao?",
+    "Product Quantization là gì?",
+    "Hệ thống xử lý tiếng Việt như thế nào?",
+    "Gemini được dùng trong bước nào?",
+]
+
+
+def post_json(url, payload, timeout=120):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def worker(url, questions, deadline, offset, latencies, errors, lock, repeat):
+    i = offset
+    run_id = uuid.uuid4().hex[:8]
+    while time.perf_counter() < deadline:
+        question = questions[i % len(questions)]
+        if not repeat:
+            question = f"{question} ({run_id}-{i})"
+        i += 1
+        start = time.perf_counter()
+        try:
+            post_json(url + "/query", {"question": question})
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            with lock:
+                errors.append(str(e))
+            continue
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--ingest", nargs="*", help="ingest các PDF này trước khi chạy (đường dẫn trên máy chủ)")
+    parser.add_argument("--questions", help="file, mỗi dòng một câu hỏi")
+    parser.add_argument("--repeat", action="store_true", help="gửi lặp lại đúng các câu hỏi, không gắn số")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    if args.ingest:
+        print(post_json(args.url + "/ingest", {"paths": [os.path.abspath(path) for path in args.ingest]}, 3600))
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    results = []
+    for concurrency in args.concurrency:
+        latencies, errors, lock = [], [], threading.Lock()
+        deadline = time.perf_counter() + args.duration
+        threads = [threading.Thread(target=worker, args=(args.url, questions, deadline, i, latencies, errors, lock,
+                                                     args.repeat))
+                   for i in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        values = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+        result = {
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "errors": len(errors),
+            "requests_per_sec": len(latencies) / elapsed,
+            "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)),
+            "p99_ms": float(np.percentile(values, 99)),
+        }
+        results.append(result)
+        print(f"concurrency {concurrency:>4}: {result['requests_per_sec']:.1f} req/s, {result['errors']} errors, "
+              f"p50 {result['p50_ms']:.0f} ms, p95 {result['p95_ms']:.0f} ms, p99 {result['p99_ms']:.0f} ms")
+        if errors:
+            print(f"  first error: {errors[0]}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import json
+import math
+import os
+from collections import Counter
+import numpy as np
+from text_processor import TextProcessor
+
+
+class BM25Index:
+    '''
+    Inverted index BM25 cho các chunk của collection, lưu bằng npz + json (không dùng pickle).
+    Postings xếp theo term kiểu CSR: chunk chứa term t là rows[indptr[t]:indptr[t+1]].
+    Chunk thêm/xóa được gom lại, postings chỉ build lại một lần trước khi search hoặc lưu.
+    '''
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.text_processor = TextProcessor()
+        self.vocab = {}
+        self.chunk_ids = []
+        self.doc_ids = []
+        self.row_of = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.float32)
+        self.lengths = np.zeros(0, dtype=np.float32)
+        self.row_docs = np.zeros(0, dtype=np.int32)
+        self.doc_codes = {}
+        self.pending = []
+        self.deleted = set()
+
+    def __len__(self):
+        return len(self.chunk_ids) - len(self.deleted)
+
+    def add(self, chunk_ids, doc_ids, texts):
+        for chunk_id, doc_id, text in zip(chunk_ids, doc_ids, texts):
+            counts = Counter(self.text_processor.tokenize(text))
+            term_ids = [self.vocab.setdefault(term, len(self.vocab)) for term in counts]
+            row = len(self.chunk_ids)
+            self.chunk_ids.append(chunk_id)
+            self.doc_ids.append(doc_id)
+            self.row_of[chunk_id] = row
+            self.pending.append((np.array(term_ids, dtype=np.int64), row,
+                                 np.array(list(counts.values()), dtype=np.float32), sum(counts.values())))
+
+    def remove(self, chunk_ids):
+        for chunk_id in chunk_ids:
+            row = self.row_of.pop(chunk_id, None)
+            if row is not None:
+                self.deleted.add(row)
+
+    def build(self):
+        if not self.pending and not self.deleted:
+            return
+        term_ids = [np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))]
+        rows = [self.rows.astype(np.int64)]
+        tfs = [self.tfs]
+        lengths = [self.lengths]
+        for pending_terms, row, pending_tfs, length in self.pending:
+            term_ids.append(pending_terms)
+            rows.append(np.full(len(pending_terms), row, dtype=np.int64))
+            tfs.append(pending_tfs)
+            lengths.append(np.array([length], dtype=np.float32))
+        term_ids, rows, tfs, lengths = (np.concatenate(parts) for parts in (term_ids, rows, tfs, lengths))
+
+        if self.deleted:
+            keep = np.ones(len(self.chunk_ids), dtype=bool)
+            keep[list(self.deleted)] = False
+            new_rows = np.cumsum(keep) - 1
+            alive = keep[rows]
+            term_ids, rows, tfs = term_ids[alive], new_rows[rows[alive]], tfs[alive]
+            lengths = lengths[keep]
+            self.chunk_ids = [chunk_id for chunk_id, kept in zip(self.chunk_ids, keep) if kept]
+            self.doc_ids = [doc_id for doc_id, kept in zip(self.doc_ids, keep) if kept]
+            self.row_of = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+
+        order = np.argsort(term_ids, kind='stable')
+        self.rows = rows[order].astype(np.int32)
+        self.tfs = tfs[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(self.vocab)))])
+        self.lengths = lengths
+        self.update_row_docs()
+        self.pending = []
+        self.deleted = set()
+
+    def update_row_docs(self):
+        self.doc_codes = {}
+        self.row_docs = np.array([self.doc_codes.setdefault(doc_id, len(self.doc_codes)) for doc_id in self.doc_ids],
+                                 dtype=np.int32)
+
+    def search(self, query, doc_ids=None, k=20, extra_chunk_ids=()):
+        '''
+        :param extra_chunk_ids: chunk được giữ lại khi lọc theo doc_ids dù thuộc tài liệu khác
+        :return: list (chunk_id, điểm BM25), điểm cao nhất trước
+        '''
+        self.build()
+        query = self.text_processor.remove_stopwords(query)
+        term_ids = {self.vocab[term] for term in self.text_processor.tokenize(query, query=True)
+                    if term in self.vocab}
+        num_chunks = len(self.chunk_ids)
+        if not term_ids or num_chunks == 0:
+            return []
+
+        scores = np.zeros(num_chunks, dtype=np.float32)
+        norms = self.k1 * (1 - self.b + self.b * self.lengths / max(float(self.lengths.mean()), 1.0))
+        for term_id in term_ids:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            if start == end:
+                continue
+            rows = self.rows[start:end]
+            tfs = self.tfs[start:end]
+            idf = math.log(1 + (num_chunks - (end - start) + 0.5) / (end - start + 0.5))
+            # mỗi chunk xuất hiện một lần trong postings của một term nên cộng trực tiếp được
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norms[rows])
+
+        if doc_ids is not None:
+            codes = [self.doc_codes[doc_id] for doc_id in doc_ids if doc_id in self.doc_codes]
+            allowed = np.isin(self.row_docs, codes)
+            allowed[[self.row_of[chunk_id] for chunk_id in extra_chunk_ids if chunk_id in self.row_of]] = True
+            scores[~allowed] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(self.chunk_ids[row], float(scores[row])) for row in candidates]
+
+    def save(self):
+        self.build()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # ghi file tạm rồi đổi tên để không bao giờ có index ghi dở
+        with open(self.path + ".tmp.npz", "wb") as f:
+            np.savez(f, indptr=self.indptr, rows=self.rows, tfs=self.tfs, lengths=self.lengths)
+        with open(self.path + ".tmp.json", "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "vocab": list(self.vocab),
+                       "chunk_ids": self.chunk_ids, "doc_ids": self.doc_ids}, f, ensure_ascii=False)
+        os.replace(self.path + ".tmp.npz", self.path + ".npz")
+        os.replace(self.path + ".tmp.json", self.path + ".json")
+
+    def load(self):
+        if not (os.path.exists(self.path + ".npz") and os.path.exists(self.path + ".json")):
+            return False
+        try:
+            with open(self.path + ".json", encoding="utf-8") as f:
+                meta = json.load(f)
+            with np.load(self.path + ".npz") as arrays:
+                self.indptr, self.rows = arrays["indptr"], arrays["rows"]
+                self.tfs, self.lengths = arrays["tfs"], arrays["lengths"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading BM25 index {self.path}: {e}")
+            return False
+        self.k1, self.b = meta["k1"], meta["b"]
+        self.vocab = {term: i for i, term in enumerate(meta["vocab"])}
+        self.chunk_ids = meta["chunk_ids"]
+        self.doc_ids = meta["doc_ids"]
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+        self.pending = []
+        self.deleted = set()
+        self.update_row_docs()
+        return True
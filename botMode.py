@@ -1,72 +1,203 @@
-from chat import gemini_bot
-from chat import set_custom_prompt
+from prompts import set_custom_prompt
+from llm_backend import get_llm_client
+from llm_client import LLMError
 import streamlit as st
 import time
 from pdf_processor import ContextRetriever
 from text_processor import TextProcessor
 
 from pdf_processor import PDFDatabaseManager
-from langchain_community.vectorstores import FAISS
-from operator import itemgetter
+from embedding import custom_embeddings
+from answer_cache import answer_cache
+from reranker import get_reranker
+from context_assembler import ContextAssembler, estimate_tokens
+import tracing
+import os
 
 retriever = ContextRetriever("original_text")
 text_processor = TextProcessor()
 
 
 class chatBotMode:
-    def __init__(self):
+    def __init__(self, llm=None, session_state=None):
+        '''
+        :param llm: đối tượng có stream_response(prompt) và last_timings, mặc định là LLMClient dùng chung của process
+        :param session_state: mặc định là st.session_state; benchmark truyền đối tượng có selected_pdfs, history_global
+        '''
         self.mode = "chat"  # Mặc định là chế độ chat thông thường
+        self.llm = llm
+        self._session_state = session_state
+        self.manager = None
+        self.vector_db = {}
+        self.last_timings = {}
+        # RERANK=1: lấy RERANK_CANDIDATES ứng viên rồi chấm lại bằng cross-encoder
+        self.rerank = os.getenv("RERANK", "0") == "1"
+        self.rerank_candidates = int(os.getenv("RERANK_CANDIDATES", "20"))
+        if self.rerank:
+            # tải cross-encoder ở nền ngay từ đầu, câu hỏi đầu tiên không phải chờ trong budget
+            get_reranker().load_async()
+        # context gộp các đoạn trùng nhau, giới hạn CONTEXT_MAX_TOKENS token
+        self.context_assembler = ContextAssembler(retriever)
+        # lịch sử chỉ giữ vài lượt hỏi / trả lời gần nhất để prompt không lớn dần theo phiên chat
+        self.history_turns = int(os.getenv("HISTORY_TURNS", "3"))
+        self.history_max_tokens = int(os.getenv("HISTORY_MAX_TOKENS", "500"))
+        # câu trả lời trong lịch sử chỉ giữ phần đầu
+        self.history_answer_words = int(os.getenv("HISTORY_ANSWER_WORDS", "80"))
+        self.last_prompt_stats = {}
+
+    @property
+    def session_state(self):
+        return self._session_state if self._session_state is not None else st.session_state
 
     def set_mode(self, mode):
         self.mode = mode
 
     def process_question(self, user_question):
         if self.mode == "chat":
-            return gemini_bot.response(user_question).strip()
+            return "".join(self.process_question_stream(user_question)).strip()
+        if self.mode == "pdf_query":
+            response_stream, context = self.process_question_stream(user_question)
+            return "".join(response_stream), context
+
+    def build_history(self):
+        '''Các lượt hỏi / trả lời trước (cũ đến mới) trong giới hạn history_max_tokens.'''
+        entries = []
+        tokens = 0
+        for entry in reversed(self.session_state.history_global):
+            tokens += estimate_tokens(entry)
+            if tokens > self.history_max_tokens:
+                break
+            entries.append(entry)
+        return "\n".join(reversed(entries))
+
+    def remember(self, text, role="user"):
+        '''Ghi một lượt vào lịch sử: role "user" (câu hỏi) hoặc "assistant" (câu trả lời).'''
+        if role == "assistant":
+            words = text.split()
+            if len(words) > self.history_answer_words:
+                text = " ".join(words[:self.history_answer_words]) + " ..."
+            entry = f"Trợ lý: {text.strip()}"
+        else:
+            entry = f"Người dùng: {text}"
+        history = self.session_state.history_global
+        history.append(entry)
+        # mỗi lượt gồm câu hỏi và câu trả lời
+        del history[:max(0, len(history) - 2 * self.history_turns)]
+
+    def stream_answer(self, prompt, prefix="", on_complete=None, timings=None):
+        '''
+        Chuyển tiếp từng đoạn text từ LLM, ghi thời gian của request vào last_timings.
+        :param on_complete: gọi với câu trả lời đầy đủ sau khi stream xong (không gọi nếu LLM lỗi)
+        :param timings: thời gian các bước trước khi gọi LLM (retrieval, search, expand...)
+        '''
+        parts = [prefix] if prefix else []
+        if prefix:
+            yield prefix
+        llm = self.llm or get_llm_client()
+        failed = False
+        try:
+            for delta in llm.stream_response(prompt):
+                parts.append(delta)
+                yield delta
+        except LLMError as e:
+            # hết giờ hoặc hết lượt retry: báo cho người dùng thay vì làm hỏng cả trang
+            print(f"LLM error: {e}")
+            failed = True
+            message = "\n\nXin lỗi, hệ thống đang quá tải hoặc mất kết nối, vui lòng thử lại sau."
+            parts.append(message)
+            yield message
+        self.last_timings = dict(timings or {}, **llm.last_timings)
+        usage = getattr(llm, "last_usage", {})
+        self.last_prompt_stats = {"prompt_chars": len(prompt), "estimated_tokens": estimate_tokens(prompt),
+                                  "prompt_tokens": usage.get("prompt_tokens")}
+        tracing.record_span("llm", llm.last_timings.get("total", 0.0), ttft=llm.last_timings.get("ttft"),
+                            prompt_chars=len(prompt), output_chars=sum(len(part) for part in parts),
+                            **getattr(llm, "last_request", {}), **usage)
+        reported = f", {usage['prompt_tokens']} reported" if usage.get("prompt_tokens") else ""
+        print(f"Prompt: {len(prompt)} chars, ~{self.last_prompt_stats['estimated_tokens']} tokens{reported} | "
+              f"LLM ttft {llm.last_timings.get('ttft', 0.0):.2f}s, "
+              f"total {llm.last_timings.get('total', 0.0):.2f}s")
+        if failed:
+            return
+        self.remember("".join(parts[1:] if prefix else parts), role="assistant")
+        if on_complete is not None:
+            on_complete("".join(parts))
+
+    def process_question_stream(self, user_question):
+        '''
+        Như process_question nhưng câu trả lời là generator các đoạn text.
+        :return: chế độ chat: generator; chế độ pdf_query: (generator, context)
+        '''
+        start = time.perf_counter()
+        tracing.new_request()
+        if self.mode == "chat":
+            # mỗi request tới LLM là độc lập: đưa các lượt hỏi / trả lời trước vào prompt thay cho chat session
+            history = self.build_history()
+            self.remember(user_question)
+            if history:
+                return self.stream_answer(f"History: {history}\n\nQuestion: {user_question}")
+            return self.stream_answer(user_question)
         if self.mode == "pdf_query":
             # Chỉ tìm kiếm trong các vector_db đã được chọn
-            selected_dbs = {name: db for name, db in self.vector_db.items() if name in st.session_state.selected_pdfs}
+            selected_dbs = {name: db for name, db in self.vector_db.items()
+                            if name in self.session_state.selected_pdfs}
 
             if not selected_dbs:
-                return "Vui lòng chọn ít nhất một tài liệu PDF để truy vấn.", ""
-
-            # Tìm trong các vector đã chọn (chưa song song)
-            results = []
-            for db_name, db in selected_dbs.items():
-                docs_scores = db.similarity_search_with_score(user_question, k=2)
-                results.extend([(doc, score, db_name) for doc, score in docs_scores])
+                return iter(["Vui lòng chọn ít nhất một tài liệu PDF để truy vấn."]), ""
+
+            # Câu hỏi đã trả lời (hoặc gần giống) trên cùng tập PDF thì không gọi LLM
+            question_vector = custom_embeddings.embed_query(user_question)
+            timings = {"embed": time.perf_counter() - start}
+            tracing.record_span("embed_query", timings["embed"], chars=len(user_question))
+            cached = answer_cache.get(selected_dbs.values(), user_question, question_vector)
+            if cached is not None:
+                tracing.record_span("answer_cache_hit", time.perf_counter() - start)
+                response_with_sources, context = cached
+                self.remember(user_question)
+                self.remember(response_with_sources, role="assistant")
+                self.last_timings = dict(timings, retrieval=time.perf_counter() - start, ttft=0.0, total=0.0)
+                return iter([response_with_sources]), context
+
+            # Một lần search trên index chung (vector + BM25), lọc theo doc_id của các PDF đã chọn
+            db_names = {doc_id: name for name, doc_id in selected_dbs.items()}
+            stage_start = time.perf_counter()
+            if self.rerank:
+                candidates = self.manager.hybrid_search(user_question, doc_ids=list(db_names),
+                                                        k=self.rerank_candidates)
+                timings["search"] = time.perf_counter() - stage_start
+                reranker = get_reranker()
+                docs_scores = reranker.rerank(user_question, candidates, k=2)
+                timings["rerank"] = reranker.last_stats.get("seconds")
+            else:
+                docs_scores = self.manager.hybrid_search(user_question, doc_ids=list(db_names), k=2)
+                timings["search"] = time.perf_counter() - stage_start
+            tracing.record_span("search", timings["search"], documents=len(db_names), hits=len(docs_scores))
+            # chunk không thuộc tài liệu đã chọn (bản giữ lại của chunk trùng chưa đổi được metadata,
+            # tài liệu vừa bị xóa) thì bỏ, không gán nhầm nguồn
+            top_docs = [(doc, score, db_names.get(doc.metadata.get('doc_id'))) for doc, score in docs_scores]
+            top_docs = [(doc, score, db_name) for doc, score, db_name in top_docs if db_name is not None]
 
-            # rank by score, lấy 2 best
-            top_docs = sorted(results, key=itemgetter(1))[:2]
-
-            contexts = []
             metadatas = []
-            expanded_contexts = []
+            stage_start = time.perf_counter()
 
             for doc, score, db_name in top_docs:
-                file_name = retriever.get_file_name(doc.metadata)
-                print(f"Tên file là: {file_name}, Điểm số: {score}")
-
+                print(f"Tên file là: {retriever.get_file_name(doc.metadata)}, Điểm số: {score}")
                 doc.metadata['source_db'] = db_name
-                contexts.append(doc.page_content)
                 metadatas.append(doc.metadata)
 
-                # Vì file name.txt đã xóa dấu nên remove cả ở expander
-
-                file_name_remove_accents = text_processor.remove_accents(file_name)
-
-                expanded_context = retriever.expand_context(file_name_remove_accents, doc.page_content)
-                expanded_contexts.append(expanded_context)
-
-            context = "\n SEPARATED \n".join(expanded_contexts)
+            # mở rộng từng chunk, gộp đoạn chồng nhau và cắt theo ngân sách token
+            context = self.context_assembler.assemble([doc for doc, _, _ in top_docs])
+            timings["expand"] = time.perf_counter() - stage_start
+            assembly_stats = self.context_assembler.last_stats
+            tracing.record_span("expand_context", timings["expand"], chunks=len(top_docs), chars=len(context),
+                                spans=assembly_stats["spans"], merged=assembly_stats["merged"],
+                                truncated=assembly_stats["truncated"], estimated_tokens=assembly_stats["tokens"])
 
+            stage_start = time.perf_counter()
             prompt = set_custom_prompt()
 
-            # Giới hạn lịch sử để tránh quá tải
-            # st.session_state.history_global = st.session_state.history_global[-5:]
-
-            st.session_state.history_global.append(user_question + context)
-            history_global_str = "\n".join(st.session_state.history_global[-1])
+            history_global_str = self.build_history()
+            self.remember(user_question)
 
             prompt_with_context = prompt.format(
                 history_global=history_global_str,
@@ -74,10 +205,17 @@ class chatBotMode:
                 question=user_question
             )
 
-            response = gemini_bot.response(prompt_with_context)
+            timings["prompt"] = time.perf_counter() - stage_start
+            tracing.record_span("prompt_build", timings["prompt"], prompt_chars=len(prompt_with_context),
+                                estimated_tokens=estimate_tokens(prompt_with_context))
 
             # Thêm thông tin về nguồn
             sources = [f"{meta['source_db']} " for meta in metadatas]
-            response_with_sources = f"Nguồn: {', '.join(set(sources))}. \n\n {response}"
+            sources_prefix = f"Nguồn: {', '.join(set(sources))}. \n\n "
+
+            def cache_answer(response_with_sources):
+                answer_cache.put(selected_dbs.values(), user_question, question_vector, response_with_sources, context)
 
-            return response_with_sources, context
\ No newline at end of file
+            timings["retrieval"] = time.perf_counter() - start
+            response_stream = self.stream_answer(prompt_with_context, sources_prefix, cache_answer, timings)
+            return response_stream, context
\ No newline at end of file
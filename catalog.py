@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DocumentCatalog:
+    '''
+    Danh mục tài liệu đã ingest, lưu trong SQLite thay cho hashes.json.
+    Mọi thao tác ghi nằm trong transaction nên nhiều session/process dùng chung vẫn an toàn.
+    '''
+    block_size = 1 << 20
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.local = threading.local()
+        with self.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_id TEXT PRIMARY KEY,
+                    file_hash TEXT NOT NULL UNIQUE,
+                    file_name TEXT NOT NULL,
+                    size INTEGER,
+                    mtime REAL,
+                    page_count INTEGER,
+                    chunk_count INTEGER,
+                    index_location TEXT,
+                    model_name TEXT,
+                    added_at REAL NOT NULL
+                )""")
+            # Cache hash theo (path, size, mtime): không phải đọc lại file đã hash
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS file_hashes (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    file_hash TEXT NOT NULL,
+                    checked_at REAL NOT NULL
+                )""")
+            # Id các chunk của từng trang: bản sửa đổi dùng lại vector của chunk cũ còn nguyên text
+            if "page_hash" in {row["name"] for row in conn.execute("PRAGMA table_info(pages)")}:
+                # bảng pages cũ có cột page_hash không dùng đến
+                conn.execute("ALTER TABLE pages RENAME TO pages_old")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    doc_id TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    chunk_ids TEXT NOT NULL,
+                    PRIMARY KEY (doc_id, page)
+                )""")
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pages_old'").fetchone():
+                conn.execute("INSERT INTO pages SELECT doc_id, page, chunk_ids FROM pages_old")
+                conn.execute("DROP TABLE pages_old")
+            conn.execute("DELETE FROM file_hashes WHERE checked_at < ?", (time.time() - 86400,))
+
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def hash_file(self, file_path):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        row = self.connect().execute(
+            "SELECT file_hash FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row is not None:
+            return row["file_hash"]
+
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(self.block_size), b""):
+                hasher.update(block)
+        file_hash = hasher.hexdigest()
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?)",
+                         (path, stat.st_size, stat.st_mtime_ns, file_hash, time.time()))
+        return file_hash
+
+    def has_hash(self, file_hash):
+        row = self.connect().execute("SELECT 1 FROM documents WHERE file_hash = ?", (file_hash,)).fetchone()
+        return row is not None
+
+    def add_document(self, doc_id, file_hash, file_path, page_count, chunk_count, index_location, model_name):
+        stat = os.stat(file_path) if os.path.exists(file_path) else None
+        with self.transaction() as conn:
+            # Cùng doc_id là phiên bản mới của tài liệu cũ, ghi đè
+            conn.execute("DELETE FROM documents WHERE doc_id = ? OR file_hash = ?", (doc_id, file_hash))
+            conn.execute(
+                "INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (doc_id, file_hash, os.path.basename(file_path),
+                 stat.st_size if stat else None, stat.st_mtime if stat else None,
+                 page_count, chunk_count, index_location, model_name, time.time()))
+
+    def get_document(self, doc_id):
+        row = self.connect().execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def find_by_hash(self, file_hash):
+        row = self.connect().execute("SELECT * FROM documents WHERE file_hash = ?", (file_hash,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list_documents(self):
+        rows = self.connect().execute("SELECT * FROM documents ORDER BY added_at").fetchall()
+        return [dict(row) for row in rows]
+
+    def remove_document(self, doc_id):
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+        return cursor.rowcount > 0
+
+    def get_pages(self, doc_id):
+        rows = self.connect().execute(
+            "SELECT page, chunk_ids FROM pages WHERE doc_id = ? ORDER BY page", (doc_id,)).fetchall()
+        return [{"page": row["page"], "chunk_ids": json.loads(row["chunk_ids"])} for row in rows]
+
+    def set_pages(self, doc_id, page_rows):
+        ''':param page_rows: list (page, chunk_ids)'''
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+            conn.executemany("INSERT INTO pages VALUES (?, ?, ?)",
+                             [(doc_id, page, json.dumps(chunk_ids)) for page, chunk_ids in page_rows])
+
+    def clear(self):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM documents")
+            conn.execute("DELETE FROM file_hashes")
+            conn.execute("DELETE FROM pages")
+
+    def migrate_from_json(self, hash_store_path, get_doc_id, index_location, model_name):
+        '''Chuyển hashes.json cũ (hash -> đường dẫn file) vào catalog rồi đổi tên file json.'''
+        if not os.path.exists(hash_store_path):
+            return
+        try:
+            with open(hash_store_path, 'r') as f:
+                hashes = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON from {hash_store_path}. Skipping migration.")
+            return
+        with self.transaction() as conn:
+            for file_hash, file_path in hashes.items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO documents (doc_id, file_hash, file_name, index_location, model_name, added_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (get_doc_id(file_path), file_hash, os.path.basename(file_path), index_location, model_name,
+                     time.time()))
+        os.replace(hash_store_path, hash_store_path + ".migrated")
+        print(f"Migrated {len(hashes)} entries from {hash_store_path} into {self.db_path}")
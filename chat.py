@@ -1,7 +1,8 @@
 import google.generativeai as genai
 import os
+import threading
 import streamlit as st
-from langchain_core.prompts import PromptTemplate
+from llm_client import LLMError
 from dotenv import load_dotenv
 
 # Chạy Local
@@ -10,9 +11,8 @@ from dotenv import load_dotenv
 # GOOGLE_API_KEY = os.getenv("API_KEY")
 # MODEL_NAME =  os.getenv("MODEL_NAME")
 
-# # Chạy trên Streamlit: thêm 2 trường ở config
-GOOGLE_API_KEY = st.secrets["GOOGLE_API_KEY"]
-MODEL_NAME = st.secrets["MODEL_NAME"]
+# # Chạy trên Streamlit: thêm 2 trường ở config (GOOGLE_API_KEY, MODEL_NAME),
+# đọc khi tạo GeminiBot để import module này (server.py, benchmark với LLM stub) không cần secrets
 
 generation_config = {
   "temperature": 0.05,
@@ -40,46 +40,20 @@ safety_settings = [
   },
 ]
 
-custom_prompt_template = """
-Yêu cầu cụ thể là tổng hợp thông tin trong các đoạn Context để trả lời câu hỏi. 
-Các chỉ mục đánh số dưới đây là các mô tả nhiệm vụ:
-
-1. Nếu câu trả lời không có trong Context hoặc bạn không chắc chắn, hãy trả lời: 
-   "Tôi không có đủ thông tin để trả lời câu hỏi này. Vui lòng cung cấp thêm thông tin liên quan đến câu hỏi."
-
-2. Không suy đoán và bịa đặt nội dung ngoài.
-
-3. Chỉ trả lời thông tin theo Context tìm được. Trả lời đầy đủ thông tin liên quan đến câu hỏi, 
-   bao gồm cả việc liệt kê các ý nhỏ nếu cần.
-
-4. Thông tin thường chỉ nằm trong một đoạn context. Các đoạn context được chia cách bởi chuỗi "SEPARATED".
-
-5. Chỉ sử dụng History khi người dùng hỏi về câu hỏi trước đó:
-
-History: {history_global}
-
-Context: {context}
-
-Question: {question}
-
-Câu trả lời:
-"""
-
-def set_custom_prompt():
-  prompt = PromptTemplate(template=custom_prompt_template,
-                          input_variables=['history_global','context', 'question'])
-  return prompt
 
 class GeminiBot:
+  '''
+  Backend Gemini cho LLMClient. Mỗi request là một generate_content độc lập (lịch sử hội thoại
+  đã nằm trong prompt), nên gọi lại / gửi song song cùng prompt không làm lẫn lịch sử giữa các
+  session như khi dùng chung một chat session. Model (và kết nối tới API) được tạo một lần, dùng lại.
+  '''
   def __init__(self):
-    self.model_name = MODEL_NAME
-    self.token_count = None
+    self.model_name = st.secrets["MODEL_NAME"]
     self.model = None
-    self.chat = None
     self._setup()
 
   def _setup(self):
-    genai.configure(api_key=GOOGLE_API_KEY)
+    genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
     INSTRUCTION = ('Bạn là một công cụ hỏi đáp, hãy trả lời các câu hỏi của người dùng bằng tiếng Việt.'
               'Khi kết thúc trả lời hãy hỏi "\n\n Nếu bạn cần thêm điều gì, hãy cho tôi biết!" hoặc những câu tương tự.'
               'Người dùng sẽ có thêm những mô tả cụ thể, hãy làm theo những yêu cầu đó.')
@@ -87,13 +61,49 @@ class GeminiBot:
                                        generation_config=generation_config,
                                        safety_settings=safety_settings,
                                        system_instruction=INSTRUCTION)
-    self.chat = self.model.start_chat()
-
-
-  def response(self, user_input):
-    user_input = user_input
-    response = self.chat.send_message(user_input)
-    return response.text
-
 
-gemini_bot = GeminiBot()
+  def stream(self, prompt, usage, timeout=None):
+    '''
+    Generator trả về từng đoạn text ngay khi Gemini sinh ra; số token Gemini báo về được ghi vào usage.
+    Lỗi của API được đổi thành LLMError, lỗi tạm thời (429, 5xx, hết giờ) có retryable=True.
+    '''
+    try:
+      request_options = {"timeout": timeout} if timeout else None
+      response = self.model.generate_content(prompt, stream=True, request_options=request_options)
+      for chunk in response:
+        if chunk.text:
+          yield chunk.text
+    except LLMError:
+      raise
+    except Exception as e:
+      raise as_llm_error(e) from e
+    # số token Gemini báo về ở chunk cuối của stream
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata:
+      usage.update(prompt_tokens=getattr(metadata, "prompt_token_count", None),
+                   output_tokens=getattr(metadata, "candidates_token_count", None))
+
+
+def as_llm_error(error):
+  try:
+    from google.api_core import exceptions
+  except ImportError:
+    return LLMError(str(error))
+  transient = tuple(getattr(exceptions, name) for name in
+                    ("TooManyRequests", "ResourceExhausted", "InternalServerError", "ServiceUnavailable",
+                     "GatewayTimeout", "DeadlineExceeded") if hasattr(exceptions, name))
+  return LLMError(f"{type(error).__name__}: {error}", retryable=isinstance(error, transient))
+
+
+_gemini_bot = None
+_gemini_bot_lock = threading.Lock()
+
+
+def get_gemini_bot():
+  '''Tạo GeminiBot một lần cho cả process, ở lần gọi đầu tiên thay vì lúc import.'''
+  global _gemini_bot
+  if _gemini_bot is None:
+    with _gemini_bot_lock:
+      if _gemini_bot is None:
+        _gemini_bot = GeminiBot()
+  return _gemini_bot
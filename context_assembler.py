@@ -0,0 +1,132 @@
+import math
+import os
+
+from text_processor import TextProcessor
+
+text_processor = TextProcessor()
+
+# Gemini tách một âm tiết tiếng Việt thành khoảng 1-2 token
+tokens_per_word = float(os.getenv("CONTEXT_TOKENS_PER_WORD", "1.5"))
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text.split()) * tokens_per_word)
+
+
+class ContextAssembler:
+    '''
+    Ghép context cho prompt từ các chunk tìm được. Mỗi chunk được mở rộng thêm
+    words_before / words_after từ; các đoạn cùng file chồng lên nhau hoặc liền kề
+    (theo vị trí từ trong original_text) được gộp làm một, nên hai chunk của cùng
+    một đoạn văn không bị lặp trong prompt. Các đoạn chia nhau max_tokens theo thứ hạng;
+    đoạn không vừa thì cắt bớt phần mở rộng quanh chunk tốt nhất.
+    '''
+    separator = "\n SEPARATED \n"
+
+    def __init__(self, retriever, max_tokens=None, words_before=200, words_after=200):
+        self.retriever = retriever
+        self.max_tokens = max_tokens or int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+        self.words_before = words_before
+        self.words_after = words_after
+        self.last_stats = {}
+
+    def collect_spans(self, docs, handles):
+        spans = []
+        legacy = []
+        for rank, doc in enumerate(docs):
+            file_name = text_processor.remove_accents(self.retriever.get_file_name(doc.metadata))
+            index = None
+            if "offset_start" in doc.metadata:
+                if file_name not in handles:
+                    handles[file_name] = self.retriever.acquire_index(file_name)
+                index = handles[file_name].value if handles[file_name] is not None else None
+            if index is None or len(index["words"]) == 0:
+                # chunk cũ không có offset: chỉ bỏ được đoạn trùng hoàn toàn
+                text = self.retriever.expand_context(file_name, doc.page_content,
+                                                     self.words_before, self.words_after)
+                if all(span["text"] != text for span in legacy):
+                    legacy.append({"rank": rank, "text": text})
+                continue
+            first, last = self.retriever.chunk_words(index, doc.metadata)
+            spans.append({"rank": rank, "file_name": file_name, "index": index, "core": (first, last),
+                          "lo": max(0, first - self.words_before),
+                          "hi": min(len(index["words"]), last + self.words_after)})
+        return spans, legacy
+
+    def merge_spans(self, spans):
+        '''Gộp các đoạn cùng file có vị trí chồng lên nhau hoặc liền kề, giữ thứ hạng và chunk tốt nhất.'''
+        merged = []
+        for span in sorted(spans, key=lambda span: (span["file_name"], span["lo"])):
+            previous = merged[-1] if merged else None
+            if previous is not None and previous["file_name"] == span["file_name"] and span["lo"] <= previous["hi"]:
+                previous["hi"] = max(previous["hi"], span["hi"])
+                if span["rank"] < previous["rank"]:
+                    previous["rank"], previous["core"] = span["rank"], span["core"]
+            else:
+                merged.append(dict(span))
+        return merged
+
+    def fit(self, span, budget):
+        '''Cắt đoạn còn tối đa budget từ, lấy chunk tốt nhất làm tâm.'''
+        lo, hi = span["lo"], span["hi"]
+        if hi - lo <= budget:
+            return lo, hi
+        first, last = span["core"]
+        if last - first >= budget:
+            return first, first + budget
+        lo = max(lo, first - (budget - (last - first)) // 2)
+        hi = min(hi, lo + budget)
+        return max(span["lo"], hi - budget), hi
+
+    def assemble(self, docs):
+        '''
+        :param docs: list Document theo thứ hạng của bước retrieval
+        :return: context, các đoạn nối bằng separator
+        '''
+        # giữ handle các index đang đọc để registry không bỏ chúng giữa chừng
+        handles = {}
+        try:
+            return self.build(docs, handles)
+        finally:
+            for handle in handles.values():
+                if handle is not None:
+                    handle.release()
+
+    def build(self, docs, handles):
+        spans, legacy = self.collect_spans(docs, handles)
+        merged = self.merge_spans(spans)
+        ordered = sorted(merged + legacy, key=lambda span: span["rank"])
+        # mỗi separator cũng là một từ trong prompt
+        budget = max(1, int(self.max_tokens / tokens_per_word) - max(0, len(ordered) - 1))
+        parts = []
+        truncated = 0
+        for i, span in enumerate(ordered):
+            # chia đều phần ngân sách còn lại cho các đoạn chưa lấy, đoạn ngắn thì nhường phần dư cho đoạn sau
+            allowance = budget // (len(ordered) - i)
+            if allowance <= 0:
+                truncated += 1
+                continue
+            if "text" in span:
+                words = span["text"].split()
+                if len(words) > allowance:
+                    cut = len(words) - allowance
+                    words = words[cut // 2:len(words) - (cut - cut // 2)]
+                    truncated += 1
+                parts.append(" ".join(words))
+                budget -= len(words)
+                continue
+            lo, hi = self.fit(span, allowance)
+            if (lo, hi) != (span["lo"], span["hi"]):
+                truncated += 1
+            parts.append(self.retriever.words_text(span["index"], lo, hi))
+            budget -= hi - lo
+
+        context = self.separator.join(parts)
+        self.last_stats = {
+            "chunks": len(docs),
+            "spans": len(parts),
+            "merged": len(spans) - len(merged),
+            "truncated": truncated,
+            "tokens": estimate_tokens(context),
+        }
+        return context
@@ -0,0 +1,275 @@
+import json
+import os
+import zlib
+import numpy as np
+
+# số nguyên tố Mersenne 2^31 - 1: a * h + b với a, h, b < 2^31 không tràn uint64
+PRIME = (1 << 31) - 1
+
+
+def choose_bands(threshold, num_perm):
+    '''
+    Chọn (bands, rows) với bands * rows <= num_perm sao cho ngưỡng của LSH,
+    khoảng (1 / bands) ^ (1 / rows), gần threshold nhất.
+    '''
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class MinHashBatch:
+    '''Chữ ký và alias của một batch chunk chờ MinHashLSH.commit().'''
+    def __init__(self, bands):
+        self.chunk_ids = []
+        self.signatures = []
+        self.buckets = [{} for _ in range(bands)]
+        self.aliases = []
+
+    def add(self, chunk_id, signature, keys):
+        for bucket, key in zip(self.buckets, keys):
+            bucket.setdefault(key, []).append(len(self.chunk_ids))
+        self.chunk_ids.append(chunk_id)
+        self.signatures.append(signature)
+
+    def candidates(self, keys):
+        rows = set()
+        for bucket, key in zip(self.buckets, keys):
+            rows.update(bucket.get(key, ()))
+        return [(self.chunk_ids[row], self.signatures[row]) for row in rows]
+
+
+class MinHashLSH:
+    '''
+    Phát hiện chunk gần trùng trên cả collection. Mỗi chunk có chữ ký MinHash của tập
+    shingle (shingle_size từ liên tiếp); chữ ký chia thành bands, chunk chung ít nhất một
+    band là ứng viên, ứng viên được giữ nếu độ tương đồng Jaccard ước lượng >= threshold.
+    Chunk bị bỏ không vào index mà thành alias: giữ text và metadata của chính nó (doc_id,
+    trang, offset) và trỏ tới chunk được giữ (canonical). Lưu bằng npz + json như BM25Index.
+    '''
+    def __init__(self, path, threshold=0.85, num_perm=128, shingle_size=5, seed=1):
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.band_rows = choose_bands(threshold, num_perm)
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, PRIME, size=num_perm).astype(np.uint64)
+        self.chunk_ids = []
+        self.row_of = {}
+        # signatures[:len(chunk_ids)] là chữ ký theo dòng, cấp phát dư để thêm từng chunk không phải chép lại
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.buckets = None
+        # alias_id -> {"target": chunk_id canonical, "metadata": metadata, "text": text của chunk bị bỏ}
+        self.aliases = {}
+        self.aliases_of = {}
+        self.doc_aliases = {}
+
+    def __len__(self):
+        return len(self.row_of)
+
+    def signature(self, text):
+        words = text.lower().split()
+        size = self.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64) % PRIME
+        values = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % PRIME
+        return values.min(axis=1).astype(np.uint32)
+
+    def band_keys(self, signature):
+        rows = self.band_rows
+        return [signature[i * rows:(i + 1) * rows].tobytes() for i in range(self.bands)]
+
+    def build(self):
+        if self.buckets is None:
+            # dựng bucket khi cần lần đầu: collection chỉ search không phải trả chi phí này
+            self.buckets = [{} for _ in range(self.bands)]
+            for chunk_id, row in self.row_of.items():
+                self.insert(row, self.signatures[row])
+
+    def insert(self, row, signature):
+        for bucket, key in zip(self.buckets, self.band_keys(signature)):
+            bucket.setdefault(key, []).append(row)
+
+    def query(self, signature, batch=None, exclude=()):
+        '''
+        :param batch: MinHashBatch các chunk chưa ghi vào index, cũng được so sánh
+        :param exclude: chunk_id không được chọn làm chunk canonical
+        :return: chunk_id canonical giống signature nhất nếu đạt threshold, ngược lại None
+        '''
+        self.build()
+        keys = self.band_keys(signature)
+        candidates = set()
+        for bucket, key in zip(self.buckets, keys):
+            candidates.update(bucket.get(key, ()))
+        best, best_score = None, self.threshold
+        for row in candidates:
+            chunk_id = self.chunk_ids[row]
+            if self.row_of.get(chunk_id) != row or chunk_id in exclude:
+                continue
+            score = float(np.mean(self.signatures[row] == signature))
+            if score >= best_score:
+                best, best_score = chunk_id, score
+        if batch is not None:
+            for chunk_id, other in batch.candidates(keys):
+                score = float(np.mean(other == signature))
+                if score >= best_score:
+                    best, best_score = chunk_id, score
+        return best
+
+    def add(self, chunk_id, signature):
+        self.build()
+        row = len(self.chunk_ids)
+        if row == len(self.signatures):
+            grown = np.zeros((max(1024, 2 * row), self.num_perm), dtype=np.uint32)
+            grown[:row] = self.signatures[:row]
+            self.signatures = grown
+        self.signatures[row] = signature
+        self.chunk_ids.append(chunk_id)
+        self.row_of[chunk_id] = row
+        self.insert(row, signature)
+
+    def add_alias(self, alias_id, target, metadata, text=None):
+        self.aliases[alias_id] = {"target": target, "metadata": metadata, "text": text}
+        self.aliases_of.setdefault(target, set()).add(alias_id)
+        self.doc_aliases.setdefault(metadata.get("doc_id", ""), set()).add(alias_id)
+
+    def drop_alias(self, alias_id):
+        alias = self.aliases.pop(alias_id)
+        self.aliases_of.get(alias["target"], set()).discard(alias_id)
+        self.doc_aliases.get(alias["metadata"].get("doc_id", ""), set()).discard(alias_id)
+        return alias
+
+    def deduplicate(self, chunks, exclude=()):
+        '''
+        Tìm chunk gần trùng với chunk đã có (kể cả chunk trước nó trong cùng batch), chưa ghi gì vào
+        index LSH: gọi commit() sau khi vector của các chunk được giữ đã vào index, để ingest lỗi giữa
+        chừng không để lại chữ ký trỏ tới chunk không tồn tại.
+        :return: (chunk được giữ, list (chunk bị bỏ, chunk_id canonical), MinHashBatch cho commit)
+        '''
+        batch = MinHashBatch(self.bands)
+        kept = []
+        dropped = []
+        for chunk in chunks:
+            signature = self.signature(chunk.page_content)
+            keys = self.band_keys(signature)
+            target = self.query(signature, batch, exclude)
+            if target is None:
+                batch.add(chunk.metadata["chunk_id"], signature, keys)
+                kept.append(chunk)
+            else:
+                batch.aliases.append((chunk, target))
+                dropped.append((chunk, target))
+        return kept, dropped, batch
+
+    def commit(self, batch):
+        ''':return: chunk bị bỏ có chunk canonical đã bị xóa trong lúc embed, cần thêm lại như chunk thường'''
+        for chunk_id, signature in zip(batch.chunk_ids, batch.signatures):
+            self.add(chunk_id, signature)
+        stale = []
+        for chunk, target in batch.aliases:
+            if target not in self.row_of:
+                stale.append(chunk)
+                continue
+            self.add_alias(chunk.metadata["chunk_id"], target, dict(chunk.metadata), chunk.page_content)
+        return stale
+
+    def remove(self, chunk_ids):
+        '''
+        Xóa chunk canonical và alias trong chunk_ids.
+        :return: dict chunk_id canonical đã xóa -> list alias ({"target", "metadata", "text"}) còn trỏ tới nó
+        '''
+        for chunk_id in chunk_ids:
+            if chunk_id in self.aliases:
+                self.drop_alias(chunk_id)
+        orphans = {}
+        for chunk_id in chunk_ids:
+            self.row_of.pop(chunk_id, None)
+            alias_ids = sorted(self.aliases_of.pop(chunk_id, ()))
+            if alias_ids:
+                orphans[chunk_id] = [self.drop_alias(alias_id) for alias_id in alias_ids]
+        return orphans
+
+    def alias_ids_of_doc(self, doc_id):
+        return list(self.doc_aliases.get(doc_id, ()))
+
+    def alias_count(self, doc_id):
+        return len(self.doc_aliases.get(doc_id, ()))
+
+    def alias_doc_ids(self):
+        return [doc_id for doc_id, alias_ids in self.doc_aliases.items() if alias_ids]
+
+    def targets_for(self, doc_ids):
+        '''chunk_id canonical có alias thuộc một trong doc_ids.'''
+        return {self.aliases[alias_id]["target"] for doc_id in doc_ids
+                for alias_id in self.doc_aliases.get(doc_id, ())}
+
+    def reset_signatures(self):
+        '''Bỏ mọi chữ ký (giữ alias), để tính lại từ docstore.'''
+        self.chunk_ids = []
+        self.row_of = {}
+        self.signatures = np.zeros((0, self.num_perm), dtype=np.uint32)
+        self.buckets = None
+
+    def resolve(self, chunk_id, doc_ids):
+        ''':return: metadata của một alias của chunk_id thuộc doc_ids, hoặc None'''
+        for alias_id in sorted(self.aliases_of.get(chunk_id, ())):
+            metadata = self.aliases[alias_id]["metadata"]
+            if metadata.get("doc_id") in doc_ids:
+                return metadata
+        return None
+
+    def update_alias_metadata(self, chunk_ids, **values):
+        for chunk_id in chunk_ids:
+            if chunk_id in self.aliases:
+                self.aliases[chunk_id]["metadata"].update(values)
+
+    def save(self):
+        if len(self.row_of) < len(self.chunk_ids):
+            # bỏ các dòng đã xóa, đánh lại số dòng
+            rows = sorted(self.row_of.values())
+            self.signatures = self.signatures[rows]
+            self.chunk_ids = [self.chunk_ids[row] for row in rows]
+            self.row_of = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+            self.buckets = None
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp.npz", "wb") as f:
+            np.savez(f, signatures=self.signatures[:len(self.chunk_ids)])
+        with open(self.path + ".tmp.json", "w", encoding="utf-8") as f:
+            json.dump({"threshold": self.threshold, "num_perm": self.num_perm, "shingle_size": self.shingle_size,
+                       "chunk_ids": self.chunk_ids, "aliases": self.aliases}, f, ensure_ascii=False)
+        os.replace(self.path + ".tmp.npz", self.path + ".npz")
+        os.replace(self.path + ".tmp.json", self.path + ".json")
+
+    def load(self):
+        '''
+        Alias luôn được đọc lại; chữ ký tạo với num_perm / shingle_size khác thì bị bỏ.
+        :return: False nếu chưa có file hoặc phải tính lại chữ ký
+        '''
+        if not (os.path.exists(self.path + ".npz") and os.path.exists(self.path + ".json")):
+            return False
+        try:
+            with open(self.path + ".json", encoding="utf-8") as f:
+                meta = json.load(f)
+            with np.load(self.path + ".npz") as arrays:
+                signatures = arrays["signatures"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading dedup index {self.path}: {e}")
+            return False
+        self.aliases = {}
+        self.aliases_of = {}
+        self.doc_aliases = {}
+        for alias_id, alias in meta["aliases"].items():
+            self.add_alias(alias_id, alias["target"], alias["metadata"], alias.get("text"))
+        # đổi threshold chỉ đổi cách chia band, bucket được dựng lại khi cần nên không phải tính lại chữ ký
+        if (meta["num_perm"], meta["shingle_size"]) != (self.num_perm, self.shingle_size):
+            return False
+        self.signatures = signatures
+        self.chunk_ids = meta["chunk_ids"]
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+        self.buckets = None
+        return True
@@ -0,0 +1,236 @@
+import json
+import mmap
+import os
+import shutil
+
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+# cột số của mỗi chunk, -1 là không có (chunk cũ không có offset)
+ROW_DTYPE = np.dtype([("text_start", "<i8"), ("text_end", "<i8"), ("doc", "<i4"), ("source", "<i4"),
+                      ("page", "<i4"), ("total_pages", "<i4"), ("offset_start", "<i8"), ("offset_end", "<i8")])
+INT_FIELDS = ("page", "total_pages", "offset_start", "offset_end")
+# các khóa metadata có cột riêng, khóa khác nằm trong extras của meta.json
+COLUMN_KEYS = ("source", "doc_id", "chunk_id") + INT_FIELDS
+
+
+class ColumnarDocstore(Docstore, AddableMixin):
+    '''
+    Docstore dạng cột thay cho InMemoryDocstore + pickle:
+
+        text.bin         text UTF-8 của mọi chunk nối liền
+        rows.npy         (text_start, text_end, doc, source, page, total_pages, offset_start, offset_end)
+        ids.npy          id chunk theo thứ tự vector trong index
+        sorted_ids.npy   id đã sắp xếp + sorted_rows.npy: tra id -> dòng bằng searchsorted
+        meta.json        bảng doc_id, bảng source và metadata ngoài các cột trên
+
+    Tất cả được mmap khi mở, Document chỉ được tạo cho các chunk được search().
+    Chunk thêm/xóa/sửa sau khi mở nằm trong bộ nhớ đến lần save() kế tiếp.
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self.text = b""
+        self.rows = np.zeros(0, dtype=ROW_DTYPE)
+        self.ids = np.zeros(0, dtype="S1")
+        self.sorted_ids = self.ids
+        self.sorted_rows = np.zeros(0, dtype=np.int64)
+        self.doc_table = []
+        self.source_table = []
+        self.extras = {}
+        self.added = {}
+        self.deleted = set()
+        self.overrides = {}
+        if path is not None and self.exists(path):
+            self.open(path)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "meta.json"))
+
+    def open(self, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        text_path = os.path.join(path, "text.bin")
+        if os.path.getsize(text_path):
+            with open(text_path, "rb") as f:
+                self.text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.text = b""
+        self.rows = np.load(os.path.join(path, "rows.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.sorted_ids = np.load(os.path.join(path, "sorted_ids.npy"), mmap_mode="r")
+        self.sorted_rows = np.load(os.path.join(path, "sorted_rows.npy"), mmap_mode="r")
+        self.doc_table = meta["doc_ids"]
+        self.source_table = meta["sources"]
+        self.extras = {int(row): values for row, values in meta["extras"].items()}
+        self.added = {}
+        self.deleted = set()
+        self.overrides = {}
+        self.path = path
+
+    def id_list(self):
+        '''Id các chunk đã lưu, theo thứ tự vector trong index.'''
+        return [chunk_id.decode("ascii") for chunk_id in self.ids.tolist()]
+
+    def find_row(self, chunk_id):
+        key = chunk_id.encode("ascii", errors="replace")
+        if not len(self.sorted_ids) or len(key) > self.sorted_ids.dtype.itemsize:
+            return None
+        i = int(np.searchsorted(self.sorted_ids, key))
+        if i < len(self.sorted_ids) and self.sorted_ids[i] == key:
+            return int(self.sorted_rows[i])
+        return None
+
+    def locate(self, chunk_id):
+        '''
+        :return: ("added", Document), ("row", số dòng) hoặc None nếu không có
+        '''
+        if chunk_id in self.added:
+            return "added", self.added[chunk_id]
+        if chunk_id in self.deleted:
+            return None
+        row = self.find_row(chunk_id)
+        return ("row", row) if row is not None else None
+
+    def row_text(self, row):
+        start, end = self.rows[row][["text_start", "text_end"]].item()
+        return self.text[start:end].decode("utf-8")
+
+    def row_metadata(self, chunk_id, row):
+        _, _, doc, source, *values = self.rows[row].item()
+        metadata = {"source": self.source_table[source], "doc_id": self.doc_table[doc], "chunk_id": chunk_id}
+        for field, value in zip(INT_FIELDS, values):
+            if value >= 0:
+                metadata[field] = value
+        metadata.update(self.extras.get(row, {}))
+        metadata.update(self.overrides.get(chunk_id, {}))
+        return metadata
+
+    def search(self, search):
+        found = self.locate(search)
+        if found is None:
+            return f"ID {search} not found."
+        kind, value = found
+        if kind == "added":
+            return value
+        return Document(page_content=self.row_text(value), metadata=self.row_metadata(search, value))
+
+    def add(self, texts):
+        overlapping = [chunk_id for chunk_id in texts if self.locate(chunk_id) is not None]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        for chunk_id, doc in texts.items():
+            self.deleted.discard(chunk_id)
+            self.overrides.pop(chunk_id, None)
+            self.added[chunk_id] = doc
+
+    def delete(self, ids):
+        missing = [chunk_id for chunk_id in ids if self.locate(chunk_id) is None]
+        if missing:
+            raise ValueError(f"Tried to delete ids that do not exist: {missing}")
+        for chunk_id in ids:
+            if self.added.pop(chunk_id, None) is None:
+                self.deleted.add(chunk_id)
+                self.overrides.pop(chunk_id, None)
+
+    def update_metadata(self, ids, **values):
+        for chunk_id in ids:
+            found = self.locate(chunk_id)
+            if found is None:
+                continue
+            kind, value = found
+            if kind == "added":
+                value.metadata.update(values)
+            else:
+                self.overrides.setdefault(chunk_id, {}).update(values)
+
+    def doc_ids_for(self, ids):
+        '''doc_id của các chunk, không tạo Document.'''
+        result = []
+        for chunk_id in ids:
+            kind, value = self.locate(chunk_id)
+            if kind == "added":
+                result.append(value.metadata.get("doc_id", ""))
+            else:
+                result.append(self.overrides.get(chunk_id, {}).get("doc_id", self.doc_table[self.rows[value]["doc"]]))
+        return result
+
+    def doc_column(self):
+        '''
+        :return: (bảng doc_id, mã doc_id của từng dòng theo thứ tự index) nếu chưa có thay đổi
+                 nào từ lần save() trước, ngược lại None
+        '''
+        if self.added or self.deleted or self.overrides:
+            return None
+        return self.doc_table, np.asarray(self.rows["doc"])
+
+    def texts_for(self, ids):
+        for chunk_id in ids:
+            kind, value = self.locate(chunk_id)
+            yield value.page_content if kind == "added" else self.row_text(value)
+
+    def __len__(self):
+        return len(self.ids) - len(self.deleted) + len(self.added)
+
+    def save(self, path, order):
+        '''
+        Ghi lại toàn bộ docstore theo thứ tự order (id theo vị trí vector trong index)
+        vào thư mục path, rồi mở lại bản mới bằng mmap.
+        '''
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        rows = np.full(len(order), -1, dtype=ROW_DTYPE)
+        doc_codes = {}
+        source_codes = {}
+        extras = {}
+        position = 0
+        with open(os.path.join(tmp_path, "text.bin"), "wb") as text_file:
+            for row, chunk_id in enumerate(order):
+                kind, value = self.locate(chunk_id)
+                if kind == "added":
+                    data = value.page_content.encode("utf-8")
+                    metadata = value.metadata
+                else:
+                    data = self.text[int(self.rows[value]["text_start"]):int(self.rows[value]["text_end"])]
+                    metadata = self.row_metadata(chunk_id, value)
+                text_file.write(data)
+                rows[row]["text_start"] = position
+                position += len(data)
+                rows[row]["text_end"] = position
+                rows[row]["doc"] = doc_codes.setdefault(metadata.get("doc_id", ""), len(doc_codes))
+                rows[row]["source"] = source_codes.setdefault(metadata.get("source", ""), len(source_codes))
+                extra = {key: metadata[key] for key in metadata if key not in COLUMN_KEYS}
+                for field in INT_FIELDS:
+                    if isinstance(metadata.get(field), int) and metadata[field] >= 0:
+                        rows[row][field] = metadata[field]
+                    elif field in metadata:
+                        extra[field] = metadata[field]
+                if extra:
+                    extras[row] = extra
+
+        ids = np.array([chunk_id.encode("ascii") for chunk_id in order] or [b""])[:len(order)]
+        sorted_rows = np.argsort(ids, kind="stable").astype(np.int64)
+        np.save(os.path.join(tmp_path, "rows.npy"), rows)
+        np.save(os.path.join(tmp_path, "ids.npy"), ids)
+        np.save(os.path.join(tmp_path, "sorted_ids.npy"), ids[sorted_rows])
+        np.save(os.path.join(tmp_path, "sorted_rows.npy"), sorted_rows)
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"doc_ids": list(doc_codes), "sources": list(source_codes),
+                       "extras": {str(row): extra for row, extra in extras.items()}}, f, ensure_ascii=False)
+
+        # đổi thư mục: bản cũ đang được mmap vẫn đọc được đến khi đóng
+        old_path = path + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self.open(path)
+
+    @classmethod
+    def recover(cls, path):
+        '''Lần save trước bị ngắt giữa hai lần đổi tên thư mục: dùng lại bản cũ.'''
+        if not cls.exists(path) and cls.exists(path + ".old"):
+            os.replace(path + ".old", path)
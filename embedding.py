@@ -1,26 +1,270 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
+import os
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from langchain.embeddings.base import Embeddings
+from embedding_cache import EmbeddingCache
 
 model_name = 'hiieu/halong_embedding'  # Thay đổi nếu cần sử dụng mô hình khác
-model = SentenceTransformer(model_name)
 
-texts = [
-    "Deep Learning là một nhánh của học máy, sử dụng các mạng nơ-ron sâu để mô hình hóa và giải quyết các vấn đề phức tạp. "
-    "Nó có nhiều ứng dụng trong thực tế như nhận diện hình ảnh, xử lý ngôn ngữ tự nhiên, và chẩn đoán y tế.",
-    
-    "Món ăn hôm nay rất ngon",
-    "Mạng Neural học sâu học rất sâu nên được gọi là Deep Learning"
-]
+# torch: model gốc float32; int8: torch dynamic quantization các lớp Linear;
+# onnx: chạy bằng onnxruntime (cần sentence-transformers>=3.2 và pip install optimum[onnxruntime])
+EMBEDDING_BACKENDS = ("torch", "int8", "onnx")
+embedding_backend = os.getenv("EMBEDDING_BACKEND", "torch")
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def load_model(backend="torch"):
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}. Choose one of {EMBEDDING_BACKENDS}")
+    # import torch/sentence_transformers cũng tốn vài giây nên để đến lúc cần
+    from sentence_transformers import SentenceTransformer
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+    model = SentenceTransformer(model_name, device="cpu" if backend == "int8" else None)
+    if backend == "int8":
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def get_model():
+    '''Tải model một lần cho cả process, ở lần dùng đầu tiên thay vì lúc import.'''
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model(embedding_backend)
+    return _model
+
+
+class EmbeddingEngine:
+    '''
+    Encode theo batch, sắp xếp theo độ dài để giảm padding,
+    có thể chạy nhiều process trên CPU và trả về float16 đã chuẩn hóa.
+    '''
+    def __init__(self, model=None, batch_size=32, sort_by_length=True, num_workers=0,
+                 normalize=False, fp16=False, min_pool_size=256):
+        self._model = model
+        self.batch_size = batch_size
+        self.sort_by_length = sort_by_length
+        self.num_workers = num_workers
+        self.normalize = normalize
+        self.fp16 = fp16
+        # Ít câu thì chạy một process, tránh chi phí chia việc cho pool
+        self.min_pool_size = min_pool_size
+        self.pool = None
+        # last_count / last_seconds theo từng thread: MicroBatcher encode câu hỏi trong thread riêng,
+        # không ghi đè số liệu của lần embed chunk đang chạy ở thread ingest
+        self.local = threading.local()
+
+    @property
+    def last_count(self):
+        ''':return: số text của lần encode gần nhất trong thread hiện tại'''
+        return getattr(self.local, "count", 0)
+
+    @last_count.setter
+    def last_count(self, value):
+        self.local.count = value
+
+    @property
+    def last_seconds(self):
+        return getattr(self.local, "seconds", 0.0)
+
+    @last_seconds.setter
+    def last_seconds(self, value):
+        self.local.seconds = value
+
+    @property
+    def model(self):
+        return self._model if self._model is not None else get_model()
+
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def start_pool(self):
+        if self.pool is None and self.num_workers > 1:
+            self.pool = self.model.start_multi_process_pool(target_devices=['cpu'] * self.num_workers)
+        return self.pool
+
+    def stop_pool(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+    def encode(self, texts):
+        start = time.perf_counter()
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dimension()), dtype=np.float32)
+
+        order = np.argsort([-len(text) for text in texts]) if self.sort_by_length else np.arange(len(texts))
+        sorted_texts = [texts[i] for i in order]
+
+        if self.num_workers > 1 and len(texts) >= self.min_pool_size:
+            vectors = self.model.encode_multi_process(sorted_texts, self.start_pool(), batch_size=self.batch_size)
+        else:
+            vectors = self.model.encode(sorted_texts, batch_size=self.batch_size, convert_to_numpy=True)
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+
+        result = np.empty_like(vectors)
+        result[order] = vectors
+        if self.fp16:
+            result = result.astype(np.float16)
+
+        self.last_count = len(texts)
+        self.last_seconds = time.perf_counter() - start
+        return result
+
+    def throughput(self):
+        if self.last_seconds == 0:
+            return 0.0
+        return self.last_count / self.last_seconds
+
+
+class MicroBatcher:
+    '''
+    Gom câu hỏi từ nhiều thread gửi đến trong cùng một cửa sổ max_wait_seconds
+    thành một lần engine.encode, thay vì mỗi request encode một câu.
+    '''
+    def __init__(self, engine, max_batch_size=32, max_wait_seconds=0.005):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.requests = queue.Queue()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def encode(self, text):
+        if self.thread is None:
+            with self.thread_lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, daemon=True)
+                    self.thread.start()
+        future = Future()
+        self.requests.put((text, future))
+        return future.result()
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self.engine.encode([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector.copy())
+
+    def stats(self):
+        return {"batches": self.batches, "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0}
+
 
 class CustomEmbeddings(Embeddings):
-    def __init__(self, model):
-        self.model = model
-    
+    def __init__(self, engine=None, cache_factory=None, query_cache_size=1024):
+        self.engine = engine or EmbeddingEngine()
+        # cache cần số chiều của model nên chỉ tạo khi embed lần đầu
+        self.cache_factory = cache_factory
+        self._cache = None
+        self.cache_lock = threading.Lock()
+        # LRU cho câu hỏi: người dùng hay hỏi lại cùng một câu
+        self.encode_query = functools.lru_cache(maxsize=query_cache_size)(self.encode_query_uncached)
+        self.batcher = None
+
+    def enable_batching(self, max_batch_size=32, max_wait_seconds=0.005):
+        '''Dùng khi nhiều thread cùng hỏi (server): câu hỏi được encode theo micro-batch.'''
+        if self.batcher is None:
+            self.batcher = MicroBatcher(self.engine, max_batch_size, max_wait_seconds)
+        return self.batcher
+
+    @property
+    def cache(self):
+        if self._cache is None and self.cache_factory is not None:
+            with self.cache_lock:
+                if self._cache is None:
+                    self._cache = self.cache_factory(self.engine.dimension())
+        return self._cache
+
     def embed_documents(self, texts):
-        return self.model.encode(texts)
-    
+        if self.cache is None:
+            return self.engine.encode(texts)
+
+        # Chỉ encode các chunk chưa có trong cache
+        found, missing = self.cache.get_many(texts)
+        vectors = np.empty((len(texts), self.engine.dimension()), dtype=np.float32)
+        for i, vector in found.items():
+            vectors[i] = vector
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_vectors = self.engine.encode(missing_texts)
+            vectors[missing] = new_vectors
+            self.cache.put_many(missing_texts, new_vectors)
+        else:
+            self.engine.last_count = 0
+            self.engine.last_seconds = 0.0
+        return vectors
+
+    def encode_query_uncached(self, text):
+        vector = self.batcher.encode(text) if self.batcher is not None else self.engine.encode([text])[0]
+        vector.setflags(write=False)
+        return vector
+
     def embed_query(self, text):
-        return self.model.encode([text])[0]
+        return self.encode_query(text)
+
+
+embedding_engine = EmbeddingEngine(
+    batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
+    num_workers=int(os.getenv("EMBEDDING_WORKERS", "0")),
+    normalize=os.getenv("EMBEDDING_NORMALIZE", "0") == "1",
+    fp16=os.getenv("EMBEDDING_FP16", "0") == "1",
+)
+
+
+def make_embedding_cache(dimension):
+    return EmbeddingCache(
+        os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache"),
+        # vector của backend khác / đã chuẩn hóa khác vector gốc nên tách khóa cache
+        model_name
+        + (f":{embedding_backend}" if embedding_backend != "torch" else "")
+        + (":normalized" if embedding_engine.normalize else ""),
+        dimension,
+        capacity=int(os.getenv("EMBEDDING_CACHE_SIZE", "100000")),
+    )
+
+
+custom_embeddings = CustomEmbeddings(
+    embedding_engine,
+    make_embedding_cache if os.getenv("EMBEDDING_CACHE", "1") == "1" else None,
+)
+
 
-custom_embeddings = CustomEmbeddings(model)
+def warm_up():
+    '''Tải model và chạy thử một lần encode để request đầu tiên không phải chờ.'''
+    start = time.perf_counter()
+    custom_embeddings.embed_query("khởi động")
+    return time.perf_counter() - start
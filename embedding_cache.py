@@ -0,0 +1,159 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+
+class EmbeddingCache:
+    '''
+    Cache vector của chunk trên đĩa, khóa theo (tên model, hash nội dung chunk).
+    Vector nằm trong một mảng memory-mapped cố định `capacity` dòng,
+    SQLite giữ vị trí (slot) của từng khóa; khi đầy thì bỏ các khóa lâu không dùng nhất.
+    Nhiều process (app Streamlit, server.py) dùng chung được: slot trống được tính từ SQLite
+    trong một transaction BEGIN IMMEDIATE, không giữ trong bộ nhớ của từng process.
+    '''
+    def __init__(self, cache_dir, model_name, dim, capacity=200000):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.dim = dim
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        safe_name = model_name.replace("/", "__")
+        self.vectors_path = os.path.join(cache_dir, f"{safe_name}.npy")
+        self.index_path = os.path.join(cache_dir, f"{safe_name}.sqlite3")
+
+        self.conn = sqlite3.connect(self.index_path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+        self.vectors = self.open_vectors()
+
+    def open_vectors(self):
+        if os.path.exists(self.vectors_path):
+            vectors = np.lib.format.open_memmap(self.vectors_path, mode='r+')
+            if vectors.shape == (self.capacity, self.dim) and vectors.dtype == np.float32:
+                return vectors
+            # Kích thước thay đổi thì cache cũ không dùng được nữa
+            del vectors
+            self.conn.execute("DELETE FROM entries")
+            self.conn.commit()
+        return np.lib.format.open_memmap(self.vectors_path, mode='w+', dtype=np.float32,
+                                         shape=(self.capacity, self.dim))
+
+    def make_key(self, text):
+        hasher = hashlib.sha256()
+        hasher.update(self.model_name.encode('utf-8'))
+        hasher.update(b"\0")
+        hasher.update(text.encode('utf-8'))
+        return hasher.hexdigest()
+
+    def existing_keys(self, keys):
+        ''':return: dict key -> slot của các khóa đã có, truy vấn theo lô 500 khóa (giới hạn biến của SQLite)'''
+        slots = {}
+        for start in range(0, len(keys), 500):
+            batch = list(set(keys[start:start + 500]))
+            placeholders = ",".join("?" * len(batch))
+            for key, slot in self.conn.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", batch):
+                slots[key] = slot
+        return slots
+
+    def get_many(self, texts):
+        '''
+        :return: (dict vị trí -> vector cho các text đã có, list vị trí còn thiếu)
+        '''
+        keys = [self.make_key(text) for text in texts]
+        with self.lock:
+            # đọc vector trong cùng transaction ghi: process khác không evict và ghi đè slot giữa chừng
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                slots = self.existing_keys(keys)
+                found = {}
+                missing = []
+                for i, key in enumerate(keys):
+                    if key in slots:
+                        found[i] = np.array(self.vectors[slots[key]])
+                    else:
+                        missing.append(i)
+                if slots:
+                    now = time.time()
+                    self.conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                          [(now, key) for key in slots])
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, texts, vectors):
+        entries = {}
+        for text, vector in zip(texts, vectors):
+            entries[self.make_key(text)] = vector
+        # Không giữ được nhiều hơn capacity, giữ các vector mới nhất
+        entries = dict(list(entries.items())[-self.capacity:])
+        if not entries:
+            return
+
+        with self.lock:
+            # khóa ghi của SQLite: process khác không cấp trùng slot giữa lúc tìm slot trống và lúc ghi
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = self.existing_keys(list(entries))
+                new_keys = [key for key in entries if key not in existing]
+                free_slots = self.free_slots(len(new_keys))
+                if len(free_slots) < len(new_keys):
+                    free_slots += self.evict(len(new_keys) - len(free_slots))
+
+                now = time.time()
+                rows = []
+                for key in new_keys:
+                    slot = free_slots.pop()
+                    self.vectors[slot] = np.asarray(entries[key], dtype=np.float32)
+                    rows.append((key, slot, now))
+                self.vectors.flush()
+                self.conn.executemany("INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)", rows)
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+    def free_slots(self, count):
+        ''':return: tối đa count slot chưa có khóa nào, slot nhỏ nhất ở cuối list'''
+        used = np.zeros(self.capacity, dtype=bool)
+        slots = np.fromiter((slot for (slot,) in self.conn.execute("SELECT slot FROM entries")), dtype=np.int64)
+        used[slots] = True
+        return np.flatnonzero(~used)[:count][::-1].tolist()
+
+    def evict(self, count):
+        ''':return: slot của các khóa bị bỏ'''
+        # Bỏ thêm 10% để không phải evict lại ở mỗi lần ghi
+        count = min(self.capacity, count + self.capacity // 10)
+        victims = self.conn.execute(
+            "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (count,)).fetchall()
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+        return [slot for _, slot in victims]
+
+    def size(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": self.size(),
+            "capacity": self.capacity,
+        }
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import tracing
+
+
+class RegistryEntry:
+    __slots__ = ("key", "value", "size", "version", "refs", "load_seconds")
+
+    def __init__(self, key, value, size, version, load_seconds):
+        self.key = key
+        self.value = value
+        self.size = size
+        self.version = version
+        self.refs = 0
+        self.load_seconds = load_seconds
+
+
+class IndexHandle:
+    '''
+    Tham chiếu nhẹ tới một index trong registry. Khi còn handle chưa release,
+    registry không bỏ index đó khỏi bộ nhớ.
+    '''
+    def __init__(self, registry, entry):
+        self.registry = registry
+        self.entry = entry
+        self.released = False
+
+    @property
+    def value(self):
+        return self.entry.value
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.registry.release(self.entry)
+
+    def __enter__(self):
+        return self.value
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class IndexRegistry:
+    '''
+    Các index đã tải dùng chung cho cả process: mỗi key chỉ tải một lần, người dùng
+    giữ handle có đếm tham chiếu. Tổng kích thước vượt memory_budget thì bỏ các index
+    không còn handle nào, lâu chưa dùng nhất trước.
+    '''
+    def __init__(self, memory_budget):
+        self.memory_budget = memory_budget
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # mỗi key một lock: hai thread cùng cần một index thì chỉ một thread tải
+        self.key_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def acquire(self, key, loader, version=None):
+        '''
+        :param loader: hàm không tham số trả về (index, kích thước byte), hoặc None nếu không tải được
+        :param version: giá trị khác với lần tải trước (vd. mtime của file) thì tải lại
+        :return: IndexHandle, hoặc None nếu loader trả về None
+        '''
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry.version == version:
+                    entry.refs += 1
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    tracing.registry.inc("rag_index_registry_hits_total", kind=key[0])
+                    return IndexHandle(self, entry)
+                if entry is not None:
+                    # bản cũ: handle đang giữ vẫn dùng được, registry không tính nó nữa
+                    del self.entries[key]
+
+            start = time.perf_counter()
+            loaded = loader()
+            if loaded is None:
+                return None
+            value, size = loaded
+            seconds = time.perf_counter() - start
+            entry = RegistryEntry(key, value, size, version, seconds)
+            entry.refs = 1
+            with self.lock:
+                self.entries[key] = entry
+                self.misses += 1
+                self.load_seconds += seconds
+                self.evict()
+            tracing.registry.inc("rag_index_registry_misses_total", kind=key[0])
+            tracing.registry.observe("rag_index_load_seconds", seconds, description="Index load time", kind=key[0])
+            return IndexHandle(self, entry)
+
+    def release(self, entry):
+        with self.lock:
+            entry.refs -= 1
+            if entry.refs == 0:
+                self.evict()
+
+    def resize(self, key, size):
+        '''Cập nhật kích thước của index đã thay đổi trong bộ nhớ (vd. sau khi thêm vector).'''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry.size = size
+                self.evict()
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def evict(self):
+        # gọi khi đang giữ self.lock
+        total = sum(entry.size for entry in self.entries.values())
+        for key in list(self.entries):
+            if total <= self.memory_budget:
+                break
+            entry = self.entries[key]
+            if entry.refs > 0:
+                continue
+            del self.entries[key]
+            total -= entry.size
+            self.evictions += 1
+            tracing.registry.inc("rag_index_registry_evictions_total", kind=key[0])
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "pinned": sum(1 for entry in self.entries.values() if entry.refs > 0),
+                "bytes": sum(entry.size for entry in self.entries.values()),
+                "memory_budget": self.memory_budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "load_seconds": self.load_seconds,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def file_sizes(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+# INDEX_MEMORY_BUDGET_MB: tổng kích thước các index giữ trong bộ nhớ của process
+index_registry = IndexRegistry(int(float(os.getenv("INDEX_MEMORY_BUDGET_MB", "1024")) * 2 ** 20))
@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+import uuid
+
+# queued -> running -> done / failed / cancelled; failed và cancelled có thể retry
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueue:
+    '''
+    Hàng đợi ingest chạy nền: mỗi job là một file PDF, worker gọi manager.update_many
+    và ghi tiến độ (trang đã đọc, chunk đã embed) vào bảng jobs trong catalog SQLite,
+    nên tải lại trang hay khởi động lại process vẫn thấy và chạy tiếp các job.
+    '''
+    # ghi tiến độ vào SQLite tối đa mỗi progress_interval giây
+    progress_interval = 0.5
+
+    def __init__(self, manager, workers=None, poll_seconds=1.0):
+        self.manager = manager
+        self.catalog = manager.catalog
+        self.workers = workers or int(os.getenv("INGEST_JOB_WORKERS", "1"))
+        self.poll_seconds = poll_seconds
+        self.threads = []
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.claim_lock = threading.Lock()
+        with self.catalog.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    file_path TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    file_hash TEXT,
+                    doc_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    pages_done INTEGER NOT NULL DEFAULT 0,
+                    total_pages INTEGER,
+                    chunks_done INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            if "file_hash" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                # bảng jobs tạo trước khi có cột file_hash
+                conn.execute("ALTER TABLE jobs ADD COLUMN file_hash TEXT")
+            # job đang chạy khi process trước bị tắt: đưa lại vào hàng đợi
+            conn.execute("UPDATE jobs SET status = 'queued', pages_done = 0, chunks_done = 0 "
+                         "WHERE status = 'running'")
+
+    def start(self):
+        '''Chạy các worker; gọi lại sau stop() không thành công thì chạy tiếp hàng đợi.'''
+        self.stopped.clear()
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        for i in range(len(self.threads), self.workers):
+            thread = threading.Thread(target=self.run_worker, name=f"ingest-job-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self, timeout=None, cancel_running=False):
+        '''
+        Dừng các worker, chờ tối đa timeout giây.
+        :param cancel_running: hủy các job đang chạy (dừng ở lần báo tiến độ kế tiếp) thay vì chờ chúng xong
+        :return: True nếu mọi worker đã dừng, không còn ghi gì vào thư mục dữ liệu
+        '''
+        self.stopped.set()
+        self.wake.set()
+        if cancel_running:
+            with self.catalog.transaction() as conn:
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE status = 'running'")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        return not self.threads
+
+    def submit(self, file_path):
+        '''Thêm job cho file; file cùng nội dung đang chờ/đang chạy thì trả về job cũ.'''
+        file_path = os.path.abspath(file_path)
+        file_hash = self.manager.calculate_file_hash(file_path) if os.path.exists(file_path) else None
+        now = time.time()
+        with self.catalog.transaction() as conn:
+            row = conn.execute("SELECT job_id FROM jobs WHERE (file_hash = ? OR file_path = ?) "
+                               "AND status IN ('queued', 'running')", (file_hash, file_path)).fetchone()
+            if row is not None:
+                return row["job_id"]
+            job_id = uuid.uuid4().hex
+            conn.execute("INSERT INTO jobs (job_id, file_path, file_name, file_hash, doc_id, status, created_at, "
+                         "updated_at) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                         (job_id, file_path, os.path.basename(file_path), file_hash,
+                          self.manager.get_doc_id(file_path), now, now))
+        self.wake.set()
+        return job_id
+
+    def get(self, job_id):
+        row = self.catalog.connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list_jobs(self, statuses=None, limit=50, job_ids=None):
+        ''':param job_ids: chỉ lấy các job này (job của một session)'''
+        conditions = []
+        params = []
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if job_ids is not None:
+            job_ids = list(job_ids)
+            conditions.append(f"job_id IN ({', '.join('?' * len(job_ids))})")
+            params.extend(job_ids)
+        query = "SELECT * FROM jobs"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        rows = self.catalog.connect().execute(query, (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def cancel(self, job_id):
+        '''Job đang chờ bị hủy ngay; job đang chạy dừng ở lần báo tiến độ kế tiếp.'''
+        with self.catalog.transaction() as conn:
+            conn.execute("UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE job_id = ? AND status = 'queued'",
+                         (time.time(), job_id))
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = 'running'", (job_id,))
+            row = conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is not None and row["status"] in ("running", "cancelled")
+
+    def retry(self, job_id):
+        with self.catalog.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', pages_done = 0, chunks_done = 0, cancel_requested = 0, "
+                "error = NULL, updated_at = ? WHERE job_id = ? AND status IN ('failed', 'cancelled')",
+                (time.time(), job_id))
+        self.wake.set()
+        return cursor.rowcount > 0
+
+    def clear_finished(self):
+        with self.catalog.transaction() as conn:
+            conn.execute("DELETE FROM jobs WHERE status NOT IN ('queued', 'running')")
+
+    def claim(self):
+        '''Lấy job chờ lâu nhất, bỏ qua tài liệu đang có job khác chạy.'''
+        with self.claim_lock, self.catalog.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND doc_id NOT IN "
+                "(SELECT doc_id FROM jobs WHERE status = 'running') ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? "
+                         "WHERE job_id = ?", (time.time(), row["job_id"]))
+        return dict(row)
+
+    def update(self, job_id, **values):
+        values["updated_at"] = time.time()
+        with self.catalog.transaction() as conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in values)} WHERE job_id = ?",
+                         (*values.values(), job_id))
+
+    def run_worker(self):
+        while not self.stopped.is_set():
+            try:
+                job = self.claim()
+            except Exception as e:
+                print(f"Error claiming ingest job: {e}")
+                job = None
+            if job is None:
+                self.wake.wait(self.poll_seconds)
+                self.wake.clear()
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        job_id, file_path, doc_id = job["job_id"], job["file_path"], job["doc_id"]
+        last_update = 0.0
+
+        def report_progress(_, pages_done, total_pages, chunks_done):
+            nonlocal last_update
+            now = time.monotonic()
+            if now - last_update < self.progress_interval and pages_done < total_pages:
+                return
+            last_update = now
+            self.update(job_id, pages_done=pages_done, total_pages=total_pages, chunks_done=chunks_done)
+            if self.get(job_id)["cancel_requested"]:
+                raise JobCancelled(job_id)
+
+        # tài liệu chưa có trong catalog: hủy/lỗi thì xóa hết phần đã ghi
+        existed = self.catalog.get_document(doc_id) is not None
+        # chia CPU đọc PDF cho các worker
+        workers = max(1, self.manager.ingest_workers // self.workers)
+        start = time.perf_counter()
+        try:
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"File not found: {file_path}")
+            results = self.manager.update_many([file_path], workers=workers, progress_callback=report_progress)
+        except JobCancelled:
+            self.discard(doc_id, existed)
+            self.update(job_id, status="cancelled", cancel_requested=0)
+            print(f"Ingest job {job_id} ({job['file_name']}) cancelled")
+            return
+        except Exception as e:
+            self.discard(doc_id, existed)
+            self.update(job_id, status="failed", error=str(e))
+            print(f"Ingest job {job_id} ({job['file_name']}) failed: {e}")
+            return
+
+        # file trùng nội dung với tài liệu đã có thì update_many bỏ qua, dùng lại tài liệu đó
+        document = self.catalog.find_by_hash(self.manager.calculate_file_hash(file_path))
+        if document is None:
+            self.update(job_id, status="failed", error="No text could be extracted from this PDF")
+            return
+        doc_id = results.get(file_path, document["doc_id"])
+        self.update(job_id, status="done", doc_id=doc_id, cancel_requested=0,
+                    pages_done=document.get("page_count") or 0, total_pages=document.get("page_count"),
+                    chunks_done=self.manager.count_chunks(doc_id))
+        print(f"Ingest job {job_id} ({job['file_name']}) done in {time.perf_counter() - start:.2f}s")
+
+    def discard(self, doc_id, existed):
+        if existed:
+            # bản sửa đổi: ingest_streaming đã tự trả về trạng thái cũ
+            return
+        try:
+            self.manager.remove_document(doc_id)
+        except Exception as e:
+            print(f"Error discarding partial ingest of {doc_id}: {e}")
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+from llm_client import LLMClient, LLMError, LLMTimeout
+
+# gemini: GeminiBot thật; stub: backend giả lập trong process, dùng cho benchmark / load test không cần mạng
+LLM_BACKENDS = ("gemini", "stub")
+
+
+class StubLLM:
+    '''
+    Backend giả lập thay Gemini: trả về câu trả lời cố định theo từng từ.
+    Độ trễ token đầu là latency_seconds, thêm tail_seconds với xác suất tail_rate (giả lập request
+    chậm bất thường), mỗi từ sau đó cách nhau token_seconds; error_rate là xác suất trả về lỗi 429
+    trước token đầu. Có cả stream (chạy trong thread) và astream (asyncio, không tốn thread khi
+    load test với nhiều request đồng thời).
+    '''
+    def __init__(self, latency_seconds=0.0, answer="Đây là câu trả lời giả lập cho benchmark.", token_seconds=0.0,
+                 tail_seconds=0.0, tail_rate=0.0, error_rate=0.0, seed=None):
+        self.latency_seconds = latency_seconds
+        self.answer = answer
+        self.token_seconds = token_seconds
+        self.tail_seconds = tail_seconds
+        self.tail_rate = tail_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def begin(self, usage):
+        '''Đếm request, bốc thăm độ trễ và lỗi. :return: (độ trễ token đầu, có lỗi không)'''
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            slow = self.random.random() < self.tail_rate
+            failed = self.random.random() < self.error_rate
+        usage.update(prompt_tokens=None, output_tokens=len(self.answer.split()))
+        return self.latency_seconds + (self.tail_seconds if slow else 0.0), failed
+
+    def end(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def stream(self, prompt, usage, timeout=None):
+        latency, failed = self.begin(usage)
+        try:
+            if timeout and latency > timeout:
+                time.sleep(timeout)
+                raise LLMTimeout("stub response exceeded the request deadline")
+            time.sleep(latency)
+            if failed:
+                raise LLMError("429 stub rate limit", retryable=True)
+            for i, word in enumerate(self.answer.split()):
+                if i and self.token_seconds:
+                    time.sleep(self.token_seconds)
+                yield word + " "
+        finally:
+            self.end()
+
+    async def astream(self, prompt, usage, timeout=None):
+        latency, failed = self.begin(usage)
+        try:
+            await asyncio.sleep(latency)
+            if failed:
+                raise LLMError("429 stub rate limit", retryable=True)
+            for i, word in enumerate(self.answer.split()):
+                if i and self.token_seconds:
+                    await asyncio.sleep(self.token_seconds)
+                yield word + " "
+        finally:
+            self.end()
+
+
+def stub_from_env():
+    return StubLLM(latency_seconds=float(os.getenv("STUB_LLM_LATENCY_MS", "0")) / 1000,
+                   token_seconds=float(os.getenv("STUB_LLM_TOKEN_MS", "0")) / 1000,
+                   tail_seconds=float(os.getenv("STUB_LLM_TAIL_MS", "0")) / 1000,
+                   tail_rate=float(os.getenv("STUB_LLM_TAIL_RATE", "0")),
+                   error_rate=float(os.getenv("STUB_LLM_ERROR_RATE", "0")))
+
+
+def get_llm(backend=None):
+    '''
+    :return: LLMClient mới bọc backend (concurrency, rate limit, retry, hedge cấu hình qua biến môi trường LLM_*)
+    '''
+    backend = backend or os.getenv("LLM_BACKEND", "gemini")
+    if backend not in LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM backend: {backend}. Choose one of {LLM_BACKENDS}")
+    if backend == "stub":
+        return LLMClient(stub_from_env())
+    from chat import get_gemini_bot
+    return LLMClient(get_gemini_bot())
+
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    '''LLMClient dùng chung cho cả process (mọi session Streamlit), backend theo LLM_BACKEND.'''
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                _llm_client = get_llm()
+    return _llm_client
@@ -0,0 +1,329 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+
+class LLMError(Exception):
+    '''
+    Lỗi của backend LLM. retryable: lỗi tạm thời (429, 5xx, mất kết nối), gọi lại có thể thành công;
+    retry_after: số giây server yêu cầu chờ trước khi gọi lại, nếu có.
+    '''
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class LLMTimeout(LLMError):
+    pass
+
+
+class TokenBucket:
+    '''Giới hạn số request mỗi giây: rate token được thêm mỗi giây, tối đa burst token. Chỉ dùng trong event loop của client.'''
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self, deadline):
+        while not self.try_acquire():
+            wait = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                raise LLMTimeout("rate limit wait exceeds the request deadline")
+            await asyncio.sleep(wait)
+
+
+class Attempt:
+    '''
+    Một lần gọi backend. Backend đồng bộ chạy trong thread pool, backend có astream chạy ngay trong
+    event loop; các đoạn text được đưa vào queue dạng ("delta", text), ("done", None) hoặc ("error", lỗi).
+    '''
+    def __init__(self, client, prompt, timeout):
+        self.queue = asyncio.Queue()
+        self.usage = {}
+        self.cancelled = threading.Event()
+        self.loop = client.loop
+        backend = client.backend
+        if hasattr(backend, "astream"):
+            self.task = self.loop.create_task(self.pump(backend.astream(prompt, self.usage, timeout)))
+        else:
+            self.task = self.loop.run_in_executor(client.executor, self.run, backend, prompt, timeout)
+        self.next_item = None
+
+    def put(self, kind, value=None):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (kind, value))
+
+    def run(self, backend, prompt, timeout):
+        try:
+            for delta in backend.stream(prompt, self.usage, timeout):
+                if self.cancelled.is_set():
+                    return
+                self.put("delta", delta)
+            self.put("done")
+        except Exception as e:
+            self.put("error", e)
+
+    async def pump(self, stream):
+        try:
+            async for delta in stream:
+                self.queue.put_nowait(("delta", delta))
+            self.queue.put_nowait(("done", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.queue.put_nowait(("error", e))
+
+    def get(self):
+        if self.next_item is None:
+            self.next_item = asyncio.ensure_future(self.queue.get())
+        return self.next_item
+
+    def take(self):
+        item, self.next_item = self.next_item.result(), None
+        return item
+
+    def cancel(self):
+        # backend đồng bộ dừng ở đoạn text kế tiếp, request HTTP đang chờ không hủy được
+        self.cancelled.set()
+        if self.next_item is not None:
+            self.next_item.cancel()
+        if isinstance(self.task, asyncio.Task):
+            self.task.cancel()
+
+
+class LLMClient:
+    '''
+    Lớp gọi LLM dùng chung cho mọi session, bọc một backend (GeminiBot, StubLLM...):
+
+        - tối đa max_concurrency request cùng lúc, request sau chờ đến lượt
+        - token bucket: tối đa rate request mỗi giây (0 = không giới hạn)
+        - mỗi request có deadline (timeout giây); lỗi tạm thời được gọi lại với backoff
+          lũy thừa có jitter, chỉ khi thời gian chờ còn nằm trong deadline
+        - hedge_after: chưa có token đầu sau ngần ấy giây thì gửi thêm một request giống hệt,
+          dùng request nào trả token đầu trước (giảm độ trễ đuôi khi backend lúc chậm lúc nhanh)
+
+    Retry và hedge chỉ xảy ra trước token đầu tiên; câu trả lời đã stream một phần thì lỗi
+    được trả về cho người gọi, tránh lặp lại text.
+    Giao diện async: await generate(prompt) từ event loop bất kỳ, async for delta in astream(prompt)
+    trong event loop của client (self.loop).
+    Giao diện đồng bộ như GeminiBot cũ: stream_response(prompt), response(prompt), last_timings.
+    '''
+    def __init__(self, backend, max_concurrency=None, rate=None, burst=None, timeout=None, max_retries=None,
+                 backoff=None, max_backoff=None, hedge_after=None):
+        self.backend = backend
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+        rate = float(os.getenv("LLM_RATE_PER_SEC", "0")) if rate is None else rate
+        burst = burst or float(os.getenv("LLM_BURST", "0")) or None
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", "60"))
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "3")) if max_retries is None else max_retries
+        self.backoff = backoff or float(os.getenv("LLM_BACKOFF", "0.5"))
+        self.max_backoff = max_backoff or float(os.getenv("LLM_BACKOFF_MAX", "8"))
+        if hedge_after is None:
+            hedge_after = float(os.getenv("LLM_HEDGE_AFTER_MS", "0")) / 1000
+        self.hedge_after = hedge_after or None
+        # mỗi request tối đa 2 lần gọi cùng lúc (request gốc + hedge)
+        self.executor = ThreadPoolExecutor(max_workers=2 * self.max_concurrency, thread_name_prefix="llm")
+        self.loop = None
+        self.loop_lock = threading.Lock()
+        self.semaphore = None
+        self.local = threading.local()
+        self.stats = {"requests": 0, "failures": 0, "timeouts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0}
+
+    def start(self):
+        '''Event loop riêng của client chạy trong một thread nền, tạo ở lần gọi đầu tiên.'''
+        with self.loop_lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-client", daemon=True).start()
+                self.semaphore = asyncio.run_coroutine_threadsafe(self.make_semaphore(), loop).result()
+                self.loop = loop
+        return self.loop
+
+    async def make_semaphore(self):
+        return asyncio.Semaphore(self.max_concurrency)
+
+    def backoff_delay(self, retry, error):
+        # full jitter: ngẫu nhiên trong [0, backoff * 2^(retry-1)], không ít hơn retry_after của server
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (retry - 1)))
+        return max(delay, error.retry_after or 0.0)
+
+    def count(self, name):
+        self.stats[name] += 1
+        tracing.registry.inc(f"rag_llm_{name}_total")
+
+    async def astream(self, prompt, timeout=None, info=None):
+        '''
+        Async generator các đoạn text của câu trả lời.
+        :param timeout: deadline của cả request (chờ lượt, chờ rate limit, retry), mặc định self.timeout
+        :param info: dict nhận thêm số liệu: attempts, retries, hedged, usage
+        '''
+        if self.loop is None:
+            self.start()
+        info = {} if info is None else info
+        info.update(attempts=0, retries=0, hedged=False, usage={})
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self.count("requests")
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.count("timeouts")
+            raise LLMTimeout(f"no free LLM slot within {timeout or self.timeout:.1f}s") from None
+        try:
+            attempt, item = await self.first_item(prompt, deadline, info)
+            try:
+                while item[0] == "delta":
+                    yield item[1]
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = await asyncio.wait_for(attempt.queue.get(), max(0.0, remaining))
+                    except asyncio.TimeoutError:
+                        self.count("timeouts")
+                        raise LLMTimeout("LLM response exceeded the request deadline") from None
+                if item[0] == "error":
+                    self.count("failures")
+                    if isinstance(item[1], LLMError):
+                        raise item[1]
+                    raise LLMError(str(item[1])) from item[1]
+                info["usage"] = attempt.usage
+            finally:
+                attempt.cancel()
+        finally:
+            self.semaphore.release()
+
+    async def first_item(self, prompt, deadline, info):
+        '''Gọi backend (retry, hedge) đến khi có đoạn text đầu tiên. :return: (attempt thắng, item đầu)'''
+        while True:
+            try:
+                if self.bucket is not None:
+                    await self.bucket.acquire(deadline)
+                return await self.race(prompt, deadline, info)
+            except LLMTimeout:
+                self.count("timeouts")
+                raise
+            except Exception as e:
+                error = e if isinstance(e, LLMError) else LLMError(str(e))
+                delay = self.backoff_delay(info["retries"] + 1, error)
+                if (not error.retryable or info["retries"] >= self.max_retries
+                        or time.monotonic() + delay >= deadline):
+                    self.count("failures")
+                    # người gọi chỉ cần bắt LLMError
+                    if error is e:
+                        raise
+                    raise error from e
+                info["retries"] += 1
+                self.count("retries")
+                print(f"LLM request failed ({e}), retry {info['retries']}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def race(self, prompt, deadline, info):
+        original = Attempt(self, prompt, deadline - time.monotonic())
+        attempts = [original]
+        info["attempts"] += 1
+        hedge_at = time.monotonic() + self.hedge_after if self.hedge_after else None
+        error = None
+        try:
+            while attempts:
+                wake_at = min(deadline, hedge_at) if hedge_at is not None else deadline
+                done, _ = await asyncio.wait([attempt.get() for attempt in attempts],
+                                             timeout=max(0.0, wake_at - time.monotonic()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if time.monotonic() >= deadline:
+                        raise LLMTimeout("no response from LLM before the request deadline")
+                    # request gốc chậm: gửi thêm một request nếu rate limit còn cho phép
+                    hedge_at = None
+                    if self.bucket is None or self.bucket.try_acquire():
+                        attempts.append(Attempt(self, prompt, deadline - time.monotonic()))
+                        info["attempts"] += 1
+                        info["hedged"] = True
+                        self.count("hedges")
+                    continue
+                for attempt in list(attempts):
+                    if not attempt.get().done():
+                        continue
+                    item = attempt.take()
+                    if item[0] == "error":
+                        attempts.remove(attempt)
+                        error = item[1]
+                        continue
+                    if attempt is not original:
+                        self.count("hedge_wins")
+                    attempts.remove(attempt)
+                    return attempt, item
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    async def collect(self, prompt, timeout=None, info=None):
+        return "".join([delta async for delta in self.astream(prompt, timeout, info)])
+
+    async def generate(self, prompt, timeout=None, info=None):
+        '''Câu trả lời đầy đủ; gọi được từ event loop bất kỳ (astream chỉ chạy trong event loop của client).'''
+        loop = self.start()
+        if asyncio.get_running_loop() is loop:
+            return await self.collect(prompt, timeout, info)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.collect(prompt, timeout, info), loop))
+
+    @property
+    def last_timings(self):
+        ''':return: thời gian của request gần nhất trong thread hiện tại'''
+        return getattr(self.local, "timings", {})
+
+    @property
+    def last_usage(self):
+        return getattr(self.local, "usage", {})
+
+    @property
+    def last_request(self):
+        ''':return: số lần gọi backend, số lần retry, có hedge không'''
+        return getattr(self.local, "request", {})
+
+    def stream_response(self, prompt, timeout=None):
+        '''Generator đồng bộ các đoạn text (chạy astream trong event loop của client), ghi last_timings, last_request.'''
+        loop = self.start()
+        info = {}
+        stream = self.astream(prompt, timeout, info)
+        start = time.perf_counter()
+        ttft = None
+        finished = False
+        try:
+            while True:
+                try:
+                    delta = asyncio.run_coroutine_threadsafe(stream.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    finished = True
+                    break
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                yield delta
+        finally:
+            if not finished:
+                # người gọi dừng giữa chừng hoặc có lỗi: đóng stream để trả lại lượt cho request khác
+                asyncio.run_coroutine_threadsafe(stream.aclose(), loop).result()
+            total = time.perf_counter() - start
+            self.local.timings = {"ttft": ttft if ttft is not None else total, "total": total}
+            self.local.usage = info.get("usage", {})
+            self.local.request = {key: info.get(key) for key in ("attempts", "retries", "hedged")}
+
+    def response(self, prompt, timeout=None):
+        return "".join(self.stream_response(prompt, timeout))
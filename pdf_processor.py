@@ -1,130 +1,1102 @@
 import hashlib
+import multiprocessing
 import os
-import json
 import re
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import uuid
+import mmap
+import shutil
+import threading
+import time
+import numpy as np
+import faiss
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from embedding import custom_embeddings
+from langchain_core.documents import Document
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pypdf import PdfReader
+from embedding import custom_embeddings, model_name
+from catalog import DocumentCatalog
+from answer_cache import answer_cache
 from text_processor import TextProcessor
+from bm25 import BM25Index
+from dedup import MinHashLSH
+from sentence_splitter import SentenceSplitter
+from docstore import ColumnarDocstore
+from index_registry import file_sizes, index_registry
+import tracing
+from vector_index import INDEX_TYPES, make_index, read_index, reconstruct_all, rebuild_index, search_parameters
 
 text_processor = TextProcessor()
 
+TEXT_BACKENDS = ("pypdf", "pymupdf")
+PAGES_PER_TASK = 16
+# process đọc PDF không fork trực tiếp từ process đang chạy nhiều thread (job worker, server, torch/FAISS):
+# khóa do thread khác giữ lúc fork có thể làm process con treo
+PARSE_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def make_text_splitter():
+    return SentenceSplitter(chunk_size=512, chunk_overlap=256)
+
+
+def count_pages(file_path, backend="pypdf"):
+    if backend == "pymupdf":
+        import fitz
+        with fitz.open(file_path) as pdf:
+            return len(pdf)
+    return len(PdfReader(file_path).pages)
+
+
+def extract_page_texts(file_path, backend="pypdf", start=0, stop=None):
+    if backend not in TEXT_BACKENDS:
+        raise ValueError(f"Unknown text backend: {backend}. Choose one of {TEXT_BACKENDS}")
+    if backend == "pymupdf":
+        # pip install pymupdf
+        import fitz
+        with fitz.open(file_path) as pdf:
+            stop = len(pdf) if stop is None else stop
+            return [pdf[i].get_text() for i in range(start, stop)]
+    reader = PdfReader(file_path)
+    return [page.extract_text() for page in reader.pages[start:stop]]
+
+
+def iter_page_texts(file_path, backend="pypdf"):
+    '''Đọc lần lượt từng trang, không giữ text của cả file trong bộ nhớ.'''
+    if backend not in TEXT_BACKENDS:
+        raise ValueError(f"Unknown text backend: {backend}. Choose one of {TEXT_BACKENDS}")
+    if backend == "pymupdf":
+        import fitz
+        with fitz.open(file_path) as pdf:
+            for page in pdf:
+                yield page.get_text()
+        return
+    reader = PdfReader(file_path)
+    for page in reader.pages:
+        yield page.extract_text()
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def parse_pages(file_path, backend, start, stop):
+    '''
+    Chạy trong process con: đọc text các trang [start, stop) của một file.
+    :return: (list text trang, thời gian đọc)
+    '''
+    load_start = time.perf_counter()
+    texts = extract_page_texts(file_path, backend, start, stop)
+    return texts, time.perf_counter() - load_start
+
 
 class PDFDatabaseManager:
-    def __init__(self, pdf_data_path, vector_db_path, hash_store_path):
+    collection_name = "collection"
+
+    @classmethod
+    def open(cls, pdf_data_path, vector_db_path, catalog_path):
+        '''
+        Manager dùng chung cho cả process theo vector_db_path, qua index_registry:
+        mọi session / service cùng thư mục chỉ giữ một bản index trong bộ nhớ.
+        :return: IndexHandle, handle.value là manager
+        '''
+        def load():
+            manager = cls(pdf_data_path, vector_db_path, catalog_path)
+            return manager, manager.memory_bytes()
+        return index_registry.acquire(("collection", os.path.abspath(vector_db_path)), load)
+
+    def __init__(self, pdf_data_path, vector_db_path, catalog_path):
         self.pdf_data_path = pdf_data_path
         self.vector_db_path = vector_db_path
-        self.hash_store_path = hash_store_path
-        self.pdf_databases = {}
+        self.catalog_path = catalog_path
+        self.collection_path = os.path.join(vector_db_path, self.collection_name)
+        self.registry_key = ("collection", os.path.abspath(vector_db_path))
+        self.catalog = DocumentCatalog(catalog_path)
+        self.catalog.migrate_from_json(os.path.join(os.path.dirname(catalog_path), "hashes.json"),
+                                       self.get_doc_id, self.collection_path, model_name)
+        self.db = None
+        # cột doc_id: doc_codes[i] là mã tài liệu của vector thứ i trong index
+        self.doc_codes = np.zeros(0, dtype=np.int32)
+        self.doc_id_to_code = {}
+        self.lock = threading.RLock()
+        self.last_ingest_stats = {}
+        self.text_backend = os.getenv("PDF_TEXT_BACKEND", "pypdf")
+        self.ingest_workers = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+        # file từ streaming_pages trang trở lên được ingest từng trang, embed theo batch
+        self.streaming_pages = int(os.getenv("STREAMING_PAGES", "300"))
+        self.streaming_batch_size = int(os.getenv("STREAMING_BATCH_SIZE", "256"))
+        # loại index ANN: flat / hnsw / ivfpq, xem vector_index.py
+        self.index_type = os.getenv("VECTOR_INDEX_TYPE", "flat")
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {self.index_type}. Choose one of {INDEX_TYPES}")
+        self.index_options = {
+            "hnsw_m": int(os.getenv("HNSW_M", "32")),
+            "ef_construction": int(os.getenv("HNSW_EF_CONSTRUCTION", "80")),
+            "nlist": int(os.getenv("IVF_NLIST", "0")) or None,
+            "pq_m": int(os.getenv("PQ_M", "64")),
+            "min_train": int(os.getenv("IVF_MIN_TRAIN", "10000")),
+        }
+        # giá trị mặc định khi query không truyền nprobe / ef_search
+        self.nprobe = int(os.getenv("IVF_NPROBE", "16"))
+        self.ef_search = int(os.getenv("HNSW_EF_SEARCH", "64"))
+        self.mmap_index = os.getenv("MMAP_INDEX", "1") == "1"
+        self.index_mmapped = False
+        # BM25 chạy song song với index vector, kết quả gộp bằng reciprocal rank fusion
+        self.bm25 = BM25Index(os.path.join(self.collection_path, "bm25"))
+        self.hybrid_search_enabled = os.getenv("HYBRID_SEARCH", "1") == "1"
+        self.hybrid_candidates = int(os.getenv("HYBRID_CANDIDATES", "20"))
+        # chunk gần trùng với chunk đã có (header/footer, trang lặp giữa các PDF) không được embed, xem dedup.py
+        self.dedup_enabled = os.getenv("DEDUP", "1") == "1"
+        self.dedup = MinHashLSH(os.path.join(self.collection_path, "dedup"),
+                                threshold=float(os.getenv("DEDUP_THRESHOLD", "0.85")))
+        # docstore_id -> vị trí trong index, dựng khi cần để lọc theo alias
+        self.position_of = None
+        # thời gian embed một chunk (không tính cache) của lần embed gần nhất, để ước lượng thời gian dedup tiết kiệm
+        self.embed_seconds_per_chunk = 0.0
+        self.last_search_stats = {}
+        self.migrate_legacy_dbs()
+        self.db = self.load_collection()
+        if self.db is not None and not self.index_matches_type():
+            # đổi VECTOR_INDEX_TYPE thì dựng lại index của collection đang có
+            self.train_index()
+            self.save_collection()
+        self.sync_bm25()
+        self.sync_dedup()
+
+    def get_doc_id(self, file_name):
+        # bỏ dấu đi, vì faiss không nhận có dấu tviet
+        file_name = os.path.basename(file_name)
+        return text_processor.remove_accents(os.path.splitext(file_name)[0])
 
     def calculate_file_hash(self, file_path):
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
-        hasher = hashlib.sha256()
-        with open(file_path, 'rb') as f:
-            for block in iter(lambda: f.read(4096), b""):
-                hasher.update(block)
-        return hasher.hexdigest()
-
-    def load_existing_hashes(self):
-        try:
-            if os.path.exists(self.hash_store_path):
-                with open(self.hash_store_path, 'r') as f:
-                    return json.load(f)
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON from {self.hash_store_path}. Starting with empty hash store.")
-        return {}
-
-    def save_hashes(self, hashes):
-        try:
-            with open(self.hash_store_path, 'w') as f:
-                json.dump(hashes, f)
-        except IOError as e:
-            print(f"Error saving hashes: {e}")
+        return self.catalog.hash_file(file_path)
+
+    def list_documents(self):
+        return self.catalog.list_documents()
+
+    def remove_document(self, doc_id):
+        '''Xóa tài liệu khỏi catalog, index chung và original_text.'''
+        removed = self.catalog.remove_document(doc_id)
+        self.delete_doc_vectors(doc_id)
+        retriever = ContextRetriever('original_text')
+        text_path = os.path.join(retriever.context_dir, f"{doc_id}.txt")
+        for path in (text_path, *retriever.index_paths(f"{doc_id}.txt")):
+            if os.path.exists(path):
+                os.remove(path)
+        answer_cache.invalidate(doc_id)
+        return removed
+
+    def count_chunks(self, doc_id):
+        '''Số chunk của tài liệu, kể cả chunk trùng chỉ lưu dưới dạng alias.'''
+        code = self.doc_id_to_code.get(doc_id)
+        count = int(np.count_nonzero(self.doc_codes == code)) if code is not None else 0
+        return count + self.dedup.alias_count(doc_id)
 
     def process_document(self, document):
-        text_splitter = RecursiveCharacterTextSplitter(
-            separators=["\n\n", "\n", " ", ".", "!", "?", ""],
-            chunk_size=512,
-            chunk_overlap=256,
-            length_function=len
-        )
-        chunks = text_splitter.split_documents([document])
+        chunks = []
+        for content, _, _, offset_start, offset_end in make_text_splitter().split_pages([document.page_content]):
+            chunks.append(Document(page_content=content,
+                                   metadata=dict(document.metadata, offset_start=offset_start, offset_end=offset_end)))
         return chunks
 
-    def load_existing_db(self, file_name):
-        db_path = os.path.join(self.vector_db_path, file_name)
-        if os.path.exists(db_path):
+    def parse_pdfs(self, file_paths, backend=None, workers=None):
+        '''
+        Đọc nhiều PDF song song: mỗi file được cắt thành các đoạn PAGES_PER_TASK trang,
+        các đoạn của mọi file chạy chung một process pool. Chia chunk chạy sau, một lần
+        trên cả tài liệu (save_original_text).
+        :return: dict file_path -> list text trang
+        '''
+        backend = backend or self.text_backend
+        workers = workers or self.ingest_workers
+        tasks = []
+        for file_path in file_paths:
+            num_pages = count_pages(file_path, backend)
+            for start in range(0, num_pages, PAGES_PER_TASK):
+                tasks.append((file_path, start, min(start + PAGES_PER_TASK, num_pages)))
+
+        parts = {}
+        if workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                parts[task] = parse_pages(task[0], backend, task[1], task[2])
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                     mp_context=multiprocessing.get_context(PARSE_START_METHOD)) as executor:
+                futures = {executor.submit(parse_pages, task[0], backend, task[1], task[2]): task for task in tasks}
+                for future in as_completed(futures):
+                    parts[futures[future]] = future.result()
+
+        parsed = {file_path: [] for file_path in file_paths}
+        timings = {file_path: 0.0 for file_path in file_paths}
+        for task in sorted(parts, key=lambda task: (file_paths.index(task[0]), task[1])):
+            texts, load_seconds = parts[task]
+            parsed[task[0]].extend(texts)
+            timings[task[0]] += load_seconds
+        # thời gian cộng dồn trên các process con (CPU time, không phải thời gian thực)
+        for file_path, load_seconds in timings.items():
+            tracing.record_span("pdf_load", load_seconds, file=os.path.basename(file_path),
+                                pages=len(parsed[file_path]), backend=backend)
+        return parsed
+
+    def load_collection(self, use_mmap=None):
+        index_path = os.path.join(self.collection_path, "index.faiss")
+        docstore_path = os.path.join(self.collection_path, "docstore")
+        if not os.path.exists(index_path):
+            return None
+        use_mmap = self.mmap_index if use_mmap is None else use_mmap
+        ColumnarDocstore.recover(docstore_path)
+        try:
+            with tracing.span("index_load") as span:
+                index, mmapped = read_index(index_path, use_mmap)
+                if ColumnarDocstore.exists(docstore_path):
+                    docstore = ColumnarDocstore(docstore_path)
+                    index_to_docstore_id = dict(enumerate(docstore.id_list()))
+                else:
+                    docstore, index_to_docstore_id = self.convert_pickled_docstore()
+                span.set(chunks=index.ntotal, mmap=mmapped, index_type=type(index).__name__)
+        except Exception as e:
+            print(f"Error loading collection {self.collection_path}: {e}")
+            return None
+        db = FAISS(custom_embeddings, index, docstore, index_to_docstore_id)
+        self.index_mmapped = mmapped
+        self.rebuild_doc_column(db)
+        return db
+
+    def convert_pickled_docstore(self):
+        '''Collection cũ lưu docstore bằng pickle (index.pkl): chuyển sang ColumnarDocstore một lần.'''
+        import pickle
+        pkl_path = os.path.join(self.collection_path, "index.pkl")
+        with open(pkl_path, "rb") as f:
+            legacy_docstore, index_to_docstore_id = pickle.load(f)
+        docstore = ColumnarDocstore()
+        docstore.add({docstore_id: legacy_docstore.search(docstore_id)
+                      for docstore_id in index_to_docstore_id.values()})
+        docstore.save(os.path.join(self.collection_path, "docstore"), list(index_to_docstore_id.values()))
+        os.remove(pkl_path)
+        print(f"Converted pickled docstore of {self.collection_path} ({len(docstore)} chunks)")
+        return docstore, dict(enumerate(docstore.id_list()))
+
+    def write_collection(self, db):
+        '''Ghi docstore rồi index ra file tạm và đổi tên: process khác đang mmap file cũ vẫn đọc được.'''
+        os.makedirs(self.collection_path, exist_ok=True)
+        db.docstore.save(os.path.join(self.collection_path, "docstore"), list(db.index_to_docstore_id.values()))
+        index_path = os.path.join(self.collection_path, "index.faiss")
+        faiss.write_index(db.index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+
+    def save_collection(self):
+        if self.db is None:
+            return
+        with self.lock, tracing.span("index_save", chunks=self.db.index.ntotal):
+            self.bm25.save()
+            self.dedup.save()
+            self.write_collection(self.db)
+        index_registry.resize(self.registry_key, self.memory_bytes())
+
+    def memory_bytes(self):
+        '''Ước lượng bộ nhớ của collection bằng kích thước các file index, docstore và BM25.'''
+        return file_sizes(os.path.join(root, name) for root, _, names in os.walk(self.collection_path)
+                          for name in names)
+
+    def sync_bm25(self):
+        '''Dựng lại BM25 từ docstore nếu chưa có hoặc lệch với index (collection cũ, lần lưu bị ngắt).'''
+        if self.db is None:
+            return
+        docstore_ids = list(self.db.index_to_docstore_id.values())
+        if self.bm25.load() and set(self.bm25.chunk_ids) == set(docstore_ids):
+            return
+        self.bm25 = BM25Index(self.bm25.path)
+        self.bm25.add(docstore_ids, self.db.docstore.doc_ids_for(docstore_ids),
+                      list(self.db.docstore.texts_for(docstore_ids)))
+        self.bm25.save()
+        print(f"Built BM25 index for {len(docstore_ids)} chunks")
+
+    def sync_dedup(self):
+        '''Tính lại chữ ký MinHash từ docstore nếu chưa có hoặc lệch với index; alias đã lưu được giữ.'''
+        loaded = self.dedup.load()
+        if self.db is None or not self.dedup_enabled:
+            return
+        docstore_ids = list(self.db.index_to_docstore_id.values())
+        if loaded and set(self.dedup.row_of) == set(docstore_ids):
+            return
+        self.dedup.reset_signatures()
+        for docstore_id, text in zip(docstore_ids, self.db.docstore.texts_for(docstore_ids)):
+            self.dedup.add(docstore_id, self.dedup.signature(text))
+        self.dedup.save()
+        print(f"Built MinHash signatures for {len(docstore_ids)} chunks")
+
+    def ensure_writable(self):
+        '''Index mmap là read-only, đọc lại vào RAM trước lần ghi đầu tiên.'''
+        if self.db is not None and self.index_mmapped:
+            self.db.index, self.index_mmapped = read_index(
+                os.path.join(self.collection_path, "index.faiss"), use_mmap=False)
+
+    def train_index(self):
+        '''
+        Dựng lại index theo index_type từ các vector hiện có.
+        Với ivfpq: chạy khi đã đủ vector để train codebook (tự gọi sau add_chunks),
+        hoặc gọi tay để train lại sau khi collection lớn lên nhiều.
+        '''
+        with self.lock:
+            if self.db is None:
+                return
+            self.ensure_writable()
+            with tracing.span("index_build", index_type=self.index_type) as span:
+                vectors = reconstruct_all(self.db.index)
+                index = make_index(self.index_type, self.db.index.d, vectors, **self.index_options)
+                if len(vectors):
+                    index.add(vectors)
+                span.set(chunks=index.ntotal)
+            self.db.index = index
+            print(f"Built {type(index).__name__} index with {index.ntotal} vectors")
+
+    def index_matches_type(self):
+        index = self.db.index
+        if self.index_type == "hnsw":
+            return isinstance(index, faiss.IndexHNSW)
+        if self.index_type == "ivfpq":
+            # chưa đủ vector để train thì ivfpq vẫn dùng flat
+            return isinstance(index, faiss.IndexIVF) or not self.needs_training()
+        return isinstance(index, faiss.IndexFlat)
+
+    def needs_training(self):
+        return (self.index_type == "ivfpq" and self.db is not None
+                and not isinstance(self.db.index, faiss.IndexIVF)
+                and self.db.index.ntotal >= max(self.index_options["min_train"], 256))
+
+    def rebuild_doc_column(self, db):
+        column = db.docstore.doc_column()
+        if column is not None and len(column[1]) == len(db.index_to_docstore_id):
+            # vừa mở từ file: cột doc của docstore đã theo đúng thứ tự index
+            doc_table, codes = column
+            table = np.array([self.get_doc_code(doc_id) for doc_id in doc_table], dtype=np.int32)
+            self.doc_codes = table[codes] if len(codes) else np.zeros(0, dtype=np.int32)
+            return
+        doc_ids = db.docstore.doc_ids_for(db.index_to_docstore_id.values())
+        self.doc_codes = np.array([self.get_doc_code(doc_id) for doc_id in doc_ids], dtype=np.int32)
+
+    def get_doc_code(self, doc_id):
+        if doc_id not in self.doc_id_to_code:
+            self.doc_id_to_code[doc_id] = len(self.doc_id_to_code)
+        return self.doc_id_to_code[doc_id]
+
+    def embed_chunks(self, chunks):
+        texts = [chunk.page_content for chunk in chunks]
+        with tracing.span("embed", chunks=len(texts), chars=sum(len(text) for text in texts)) as span:
+            vectors = custom_embeddings.embed_documents(texts)
+            span.set(embedded=custom_embeddings.engine.last_count)
+        engine = custom_embeddings.engine
+        # cộng dồn để ingest theo batch vẫn ra số liệu của cả lần ingest
+        stats = self.last_ingest_stats
+        stats["chunks"] = stats.get("chunks", 0) + len(texts)
+        stats["embedded"] = stats.get("embedded", 0) + engine.last_count
+        stats["embed_seconds"] = stats.get("embed_seconds", 0.0) + engine.last_seconds
+        stats["chunks_per_sec"] = stats["embedded"] / stats["embed_seconds"] if stats["embed_seconds"] else 0.0
+        if engine.last_count:
+            self.embed_seconds_per_chunk = engine.last_seconds / engine.last_count
+        print(f"Embedded {engine.last_count}/{len(texts)} chunks in {engine.last_seconds:.2f}s "
+              f"({engine.throughput():.1f} chunks/sec)")
+        if custom_embeddings.cache is not None:
+            cache_stats = custom_embeddings.cache.stats()
+            stats["cache"] = cache_stats
+            print(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                  f"{cache_stats['size']}/{cache_stats['capacity']} entries")
+        return vectors
+
+    def deduplicate(self, chunks, exclude=()):
+        '''
+        Bỏ các chunk gần trùng với chunk đã có trong collection trước khi embed.
+        :param exclude: chunk_id không được làm bản giữ lại (chunk cũ của tài liệu đang ingest lại)
+        :return: (chunk được giữ, batch để dedup.commit() khi vector đã vào index)
+        '''
+        with self.lock, tracing.span("dedup", chunks=len(chunks)) as span:
+            kept, dropped, batch = self.dedup.deduplicate(chunks, exclude)
+            span.set(dropped=len(dropped))
+        stats = self.last_ingest_stats.setdefault("dedup", {"chunks": 0, "dropped": 0})
+        stats["chunks"] += len(chunks)
+        stats["dropped"] += len(dropped)
+        if dropped:
+            tracing.registry.inc("rag_dedup_dropped_chunks_total", len(dropped),
+                                 description="Near-duplicate chunks not embedded")
+        return kept, batch
+
+    def report_dedup(self):
+        stats = self.last_ingest_stats.get("dedup")
+        if not stats or not stats["chunks"]:
+            return
+        stats["ratio"] = stats["dropped"] / stats["chunks"]
+        stats["vector_bytes_saved"] = stats["dropped"] * self.db.index.d * 4 if self.db is not None else 0
+        stats["embed_seconds_saved"] = stats["dropped"] * self.embed_seconds_per_chunk
+        print(f"Dedup: dropped {stats['dropped']}/{stats['chunks']} near-duplicate chunks "
+              f"({stats['ratio']:.1%} smaller index, {stats['vector_bytes_saved'] / 2 ** 20:.2f} MB of vectors), "
+              f"saved ~{stats['embed_seconds_saved']:.2f}s of embedding")
+
+    def add_chunks(self, chunks, save=True, exclude=()):
+        batch = None
+        if self.dedup_enabled:
+            chunks, batch = self.deduplicate(chunks, exclude)
+            if not chunks:
+                with self.lock:
+                    stale = self.dedup.commit(batch)
+                    if stale:
+                        return self.add_chunks(stale, save)
+                    if save:
+                        self.save_collection()
+                return self.db
+        vectors = self.embed_chunks(chunks)
+        text_embeddings = [(chunk.page_content, vector) for chunk, vector in zip(chunks, vectors)]
+        metadatas = [chunk.metadata for chunk in chunks]
+        ids = [chunk.metadata["chunk_id"] for chunk in chunks]
+        with self.lock, tracing.span("index_add", chunks=len(chunks)):
+            if self.db is None:
+                index = make_index(self.index_type, len(vectors[0]), vectors, **self.index_options)
+                self.db = FAISS(custom_embeddings, index, ColumnarDocstore(), {})
+            self.ensure_writable()
+            self.db.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+            self.bm25.add(ids, [chunk.metadata["doc_id"] for chunk in chunks], [chunk.page_content for chunk in chunks])
+            new_codes = np.array([self.get_doc_code(chunk.metadata["doc_id"]) for chunk in chunks], dtype=np.int32)
+            self.doc_codes = np.concatenate([self.doc_codes, new_codes])
+            self.position_of = None
+            if batch is not None:
+                # chỉ ghi chữ ký / alias khi vector đã vào index
+                stale = self.dedup.commit(batch)
+                if stale:
+                    self.add_chunks(stale, save=False)
+            if self.needs_training():
+                self.train_index()
+            if save:
+                self.save_collection()
+            return self.db
+
+    def delete_chunks(self, chunk_ids, save=True):
+        with self.lock:
+            chunk_ids = set(chunk_ids)
+            num_aliases = len(self.dedup.aliases)
+            orphans = self.dedup.remove(chunk_ids)
+            # alias mất bản được giữ lại thì thêm lại thành chunk thường bằng text và metadata của chính nó
+            promoted = []
+            for chunk_id, aliases in orphans.items():
+                text = None
+                if self.db is not None and self.db.docstore.locate(chunk_id) is not None:
+                    text = next(self.db.docstore.texts_for([chunk_id]))
+                promoted.extend(Document(page_content=alias["text"] or text, metadata=dict(alias["metadata"]))
+                                for alias in aliases if alias["text"] or text)
+            removed = self.remove_vectors(chunk_ids)
+            if promoted:
+                print(f"Re-adding {len(promoted)} duplicate chunks whose kept copy was deleted")
+                self.add_chunks(promoted, save=False)
+            if save and (removed or len(self.dedup.aliases) != num_aliases):
+                self.save_collection()
+
+    def remove_vectors(self, chunk_ids):
+        ''':return: số vector đã xóa'''
+        with self.lock:
+            if self.db is None:
+                return 0
+            positions = [position for position, docstore_id in self.db.index_to_docstore_id.items()
+                         if docstore_id in chunk_ids]
+            if not positions:
+                return 0
+            self.ensure_writable()
+            keep = np.ones(self.db.index.ntotal, dtype=bool)
+            keep[positions] = False
+            if isinstance(self.db.index, faiss.IndexFlat):
+                self.db.index.remove_ids(np.array(positions, dtype=np.int64))
+            else:
+                # HNSW không xóa được, IVF xóa không đánh lại số thứ tự: dựng lại từ các vector còn lại
+                vectors = reconstruct_all(self.db.index)[keep]
+                self.db.index = rebuild_index(self.db.index, vectors, self.index_type, **self.index_options)
+            removed = [self.db.index_to_docstore_id[position] for position in positions]
+            self.db.docstore.delete(removed)
+            self.bm25.remove(removed)
+            remaining = [self.db.index_to_docstore_id[i] for i in np.flatnonzero(keep)]
+            self.db.index_to_docstore_id = dict(enumerate(remaining))
+            self.doc_codes = self.doc_codes[keep]
+            self.position_of = None
+            return len(positions)
+
+    def delete_doc_vectors(self, doc_id, save=True):
+        chunk_ids = self.dedup.alias_ids_of_doc(doc_id)
+        code = self.doc_id_to_code.get(doc_id)
+        if self.db is not None and code is not None:
+            positions = np.flatnonzero(self.doc_codes == code)
+            chunk_ids += [self.db.index_to_docstore_id[int(i)] for i in positions]
+        if chunk_ids:
+            self.delete_chunks(chunk_ids, save)
+
+    def update_chunk_metadata(self, chunk_ids, **values):
+        with self.lock:
+            self.db.docstore.update_metadata(chunk_ids, **values)
+            self.dedup.update_alias_metadata(chunk_ids, **values)
+
+    def list_doc_ids(self):
+        present = set(np.unique(self.doc_codes).tolist())
+        doc_ids = [doc_id for doc_id, code in self.doc_id_to_code.items() if code in present]
+        return doc_ids + [doc_id for doc_id in self.dedup.alias_doc_ids() if doc_id not in doc_ids]
+
+    def has_document(self, doc_id):
+        code = self.doc_id_to_code.get(doc_id)
+        return (code is not None and bool(np.any(self.doc_codes == code))) or self.dedup.alias_count(doc_id) > 0
+
+    def positions_of(self, chunk_ids):
+        if self.position_of is None:
+            self.position_of = {docstore_id: position for position, docstore_id in self.db.index_to_docstore_id.items()}
+        return np.array([self.position_of[chunk_id] for chunk_id in chunk_ids if chunk_id in self.position_of],
+                        dtype=np.int64)
+
+    def resolve_hits(self, results, doc_ids):
+        '''
+        Chunk tìm được thuộc tài liệu không được chọn là bản giữ lại của một alias trong doc_ids:
+        trả về text của nó với metadata của alias (doc_id, trang, offset của tài liệu được chọn).
+        '''
+        docs = []
+        for docstore_id, score in results:
+            doc = self.db.docstore.search(docstore_id)
+            if doc_ids is not None and doc.metadata.get("doc_id") not in doc_ids:
+                metadata = self.dedup.resolve(docstore_id, doc_ids)
+                if metadata is not None:
+                    doc = Document(page_content=doc.page_content, metadata=dict(metadata))
+            docs.append((doc, score))
+        return docs
+
+    def similarity_search_with_score(self, query, doc_ids=None, k=2, nprobe=None, ef_search=None):
+        results = self.dense_search(query, doc_ids, k, nprobe, ef_search)
+        with self.lock:
+            return self.resolve_hits(results, doc_ids)
+
+    def dense_search(self, query, doc_ids=None, k=2, nprobe=None, ef_search=None):
+        '''
+        Một lần search trên index chung, lọc theo cột doc_id ngay trong faiss
+        (IDSelector) thay vì search lần lượt từng PDF.
+        nprobe (IVF) / ef_search (HNSW): đổi độ chính xác lấy tốc độ cho riêng query này.
+        :return: list (docstore_id, khoảng cách L2)
+        '''
+        if self.db is None:
+            return []
+        vector = np.array([self.db.embedding_function.embed_query(query)], dtype=np.float32)
+        # bộ lọc dựng cùng lock với search: job nền xóa vector sẽ đánh số lại vị trí trong index
+        with self.lock, tracing.span("vector_search", k=k) as span:
+            if self.db is None:
+                return []
+            selector = None
+            if doc_ids is not None:
+                codes = [self.doc_id_to_code[d] for d in doc_ids if d in self.doc_id_to_code]
+                positions = np.flatnonzero(np.isin(self.doc_codes, codes)).astype(np.int64)
+                # chunk trùng của các tài liệu này chỉ có bản giữ lại ở tài liệu khác
+                targets = self.dedup.targets_for(doc_ids)
+                if targets:
+                    positions = np.union1d(positions, self.positions_of(targets))
+                if len(positions) == 0:
+                    return []
+                if len(positions) < len(self.doc_codes):
+                    selector = faiss.IDSelectorBatch(positions)
+            span.set(filtered=selector is not None)
+            params = search_parameters(self.db.index, selector, nprobe or self.nprobe, ef_search or self.ef_search)
+            scores, indices = self.db.index.search(vector, k, params=params)
+            return [(self.db.index_to_docstore_id[position], float(score))
+                    for score, position in zip(scores[0], indices[0]) if position != -1]
+
+    def hybrid_search(self, query, doc_ids=None, k=2, rrf_k=60, nprobe=None, ef_search=None):
+        '''
+        Lấy top hybrid_candidates từ vector và từ BM25 rồi gộp bằng reciprocal rank fusion:
+        điểm = tổng 1 / (rrf_k + thứ hạng) trên hai danh sách, điểm càng cao càng liên quan.
+        '''
+        if not self.hybrid_search_enabled:
+            return self.similarity_search_with_score(query, doc_ids, k, nprobe, ef_search)
+        if self.db is None:
+            return []
+        start = time.perf_counter()
+        dense = self.dense_search(query, doc_ids, max(k, self.hybrid_candidates), nprobe, ef_search)
+        dense_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        with self.lock:
+            extra_ids = self.dedup.targets_for(doc_ids) if doc_ids is not None else ()
+            lexical = self.bm25.search(query, doc_ids, max(k, self.hybrid_candidates), extra_ids)
+        lexical_seconds = time.perf_counter() - start
+        tracing.record_span("bm25_search", lexical_seconds, hits=len(lexical))
+
+        fused = {}
+        for results in (dense, lexical):
+            for rank, (docstore_id, _) in enumerate(results):
+                fused[docstore_id] = fused.get(docstore_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+        top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+        self.last_search_stats = {"dense_seconds": dense_seconds, "lexical_seconds": lexical_seconds,
+                                  "dense_hits": len(dense), "lexical_hits": len(lexical)}
+        print(f"Hybrid search: dense {dense_seconds * 1000:.1f} ms ({len(dense)} hits), "
+              f"BM25 {lexical_seconds * 1000:.1f} ms ({len(lexical)} hits)")
+        with self.lock:
+            return self.resolve_hits(top, doc_ids)
+
+    def migrate_legacy_dbs(self):
+        '''
+        Gộp các thư mục FAISS cũ (mỗi PDF một thư mục trong vectorstores/db_faiss)
+        vào index chung, gắn doc_id = tên thư mục.
+        '''
+        if not os.path.isdir(self.vector_db_path):
+            return
+        legacy_dirs = [name for name in sorted(os.listdir(self.vector_db_path))
+                       if name != self.collection_name
+                       and os.path.exists(os.path.join(self.vector_db_path, name, "index.faiss"))]
+        if not legacy_dirs:
+            return
+        collection = self.load_collection(use_mmap=False)
+        for name in legacy_dirs:
+            legacy_path = os.path.join(self.vector_db_path, name)
             try:
-                return FAISS.load_local(db_path, custom_embeddings, allow_dangerous_deserialization=True)
+                legacy_db = FAISS.load_local(legacy_path, custom_embeddings, allow_dangerous_deserialization=True)
             except Exception as e:
-                print(f"Error loading database for {file_name}: {e}")
+                print(f"Error migrating database {legacy_path}: {e}")
+                continue
+            docstore = ColumnarDocstore()
+            for docstore_id in legacy_db.index_to_docstore_id.values():
+                doc = legacy_db.docstore.search(docstore_id)
+                doc.metadata["doc_id"] = name
+                docstore.add({docstore_id: doc})
+            legacy_db.docstore = docstore
+            if collection is None:
+                collection = legacy_db
+            else:
+                collection.merge_from(legacy_db)
+            self.write_collection(collection)
+            shutil.rmtree(legacy_path)
+            print(f"Migrated {legacy_path} into {self.collection_path}")
+
+    def load_existing_db(self, file_name):
+        doc_id = self.get_doc_id(file_name)
+        if self.has_document(doc_id):
+            return doc_id
         return None
 
     def is_pdf_exists(self, file_path):
         if not os.path.exists(file_path):
             return False
-        file_hash = self.calculate_file_hash(file_path)
-        existing_hashes = self.load_existing_hashes()
-        return file_hash in existing_hashes
+        return self.catalog.has_hash(self.calculate_file_hash(file_path))
 
-    def update_db(self, file_path):
-        if not os.path.exists(file_path):
-            print(f"File not found: {file_path}")
-            return None
+    def update_db(self, file_path, progress_callback=None):
+        return self.update_many([file_path], progress_callback=progress_callback).get(file_path)
 
-        file_hash = self.calculate_file_hash(file_path)
-        existing_hashes = self.load_existing_hashes()
+    def update_many(self, file_paths, backend=None, workers=None, progress_callback=None):
+        '''
+        Thêm nhiều PDF một lần: đọc/chia chunk song song rồi embed chung một batch.
+        File lớn (từ streaming_pages trang) đi theo ingest_streaming để giới hạn bộ nhớ.
+        :param progress_callback: gọi với (file_path, số trang đã đọc, tổng số trang, số chunk đã embed)
+        :return: dict file_path -> doc_id của các file đã được thêm
+        '''
+        backend = backend or self.text_backend
+        new_files = {}
+        for file_path in file_paths:
+            if not os.path.exists(file_path):
+                print(f"File not found: {file_path}")
+                continue
+            file_hash = self.calculate_file_hash(file_path)
+            if self.catalog.has_hash(file_hash) or file_hash in new_files.values():
+                print(f"File {file_path} already exists in the database.")
+                continue
+            new_files[file_path] = file_hash
+        if not new_files:
+            return {}
 
-        if file_hash in existing_hashes:
-            print(f"File {file_path} already exists in the database.")
-            return None
+        page_counts = {file_path: count_pages(file_path, backend) for file_path in new_files}
+        # Cùng doc_id đã có trong catalog: bản sửa đổi, chỉ ingest lại các trang thay đổi
+        revisions = {file_path for file_path in new_files
+                     if self.catalog.get_document(self.get_doc_id(file_path)) is not None}
+        small_files = [file_path for file_path in new_files
+                       if file_path not in revisions and page_counts[file_path] < self.streaming_pages]
+        large_files = [file_path for file_path in new_files
+                       if file_path in revisions or page_counts[file_path] >= self.streaming_pages]
+
+        start = time.perf_counter()
+        parsed = self.parse_pdfs(small_files, backend, workers) if small_files else {}
+        parse_seconds = time.perf_counter() - start
+        num_pages = sum(len(pages) for pages in parsed.values())
+        self.last_ingest_stats = {
+            "files": len(new_files),
+            "pages": num_pages,
+            "parse_seconds": parse_seconds,
+            "pages_per_sec": num_pages / parse_seconds if parse_seconds else 0.0,
+        }
+        if parsed:
+            print(f"Parsed {num_pages} pages from {len(parsed)} files in {parse_seconds:.2f}s")
+
+        chunks = []
+        doc_ids = {}
+        page_rows = {}
+        for file_path, pages in parsed.items():
+            doc_id = self.get_doc_id(file_path)
+            result = self.save_original_text(doc_id, file_path, pages)
+            if result is None:
+                continue
+            file_chunks, page_rows[doc_id] = result
+            if not file_chunks:
+                print(f"No new documents to add to the database from {file_path}.")
+                continue
+            chunks.extend(file_chunks)
+            doc_ids[file_path] = doc_id
+            if progress_callback:
+                progress_callback(file_path, len(pages), len(pages), 0)
+
+        if chunks:
+            self.add_chunks(chunks)
+            for doc_id in doc_ids.values():
+                self.catalog.set_pages(doc_id, page_rows[doc_id])
+            if progress_callback:
+                for file_path, doc_id in doc_ids.items():
+                    progress_callback(file_path, len(parsed[file_path]), len(parsed[file_path]),
+                                      self.count_chunks(doc_id))
+
+        for file_path in large_files:
+            old_pages = None
+            if file_path in revisions:
+                old_pages = self.catalog.get_pages(self.get_doc_id(file_path))
+            doc_id = self.ingest_streaming(file_path, page_counts[file_path], backend, progress_callback,
+                                           old_pages=old_pages)
+            if doc_id is not None:
+                doc_ids[file_path] = doc_id
 
-        loader = PyPDFLoader(file_path)
-        documents = loader.load()
+        for file_path, doc_id in doc_ids.items():
+            answer_cache.invalidate(doc_id)
+            self.catalog.add_document(doc_id, new_files[file_path], file_path, page_counts[file_path],
+                                      self.count_chunks(doc_id), self.collection_path, model_name)
+        self.report_dedup()
+        return doc_ids
 
+    def ingest_streaming(self, file_path, total_pages, backend=None, progress_callback=None, batch_size=None,
+                         old_pages=None):
+        '''
+        Ingest từng trang: text ghi nối vào file original_text, chunk được embed và
+        thêm vào index theo batch cố định, nên bộ nhớ phụ thuộc batch_size chứ không
+        phụ thuộc độ dài tài liệu.
+        Với bản sửa đổi (old_pages là các trang đã lưu trong catalog), tài liệu được chia chunk
+        như lần ingest đầu; chunk có text trùng với một chunk cũ của tài liệu giữ nguyên vector
+        cũ (chỉ đổi trang / offset), chỉ chunk mới được embed, chunk cũ không còn thì bị xóa.
+        Dùng lại theo chunk chứ không theo trang vì chunk có thể vắt qua hai trang.
+        Lỗi giữa chừng (kể cả progress_callback raise để hủy) thì bỏ các chunk vừa thêm
+        và giữ nguyên file text cũ, tài liệu trở về trạng thái trước khi ingest.
+        '''
+        backend = backend or self.text_backend
+        batch_size = batch_size or self.streaming_batch_size
+        doc_id = self.get_doc_id(file_path)
         output_dir = 'original_text'
         os.makedirs(output_dir, exist_ok=True)
-        file_name = os.path.basename(file_path)
 
-        # bỏ dấu đi, vì faiss không nhận có dấu tviet
-        file_name_without_ext = text_processor.remove_accents(os.path.splitext(file_name)[0])
-        output_file_name = f"{file_name_without_ext}.txt"
-
-        output_file_path = os.path.join(output_dir, output_file_name)
+        old_ids = set()
+        old_by_text = {}
+        if old_pages is not None:
+            if not old_pages:
+                # tài liệu cũ chưa có danh sách chunk từng trang: ingest lại toàn bộ
+                self.delete_doc_vectors(doc_id, save=False)
+            old_ids = {chunk_id for row in old_pages for chunk_id in row["chunk_ids"]}
+            old_by_text = self.chunks_by_text(old_ids)
 
-        all_text = "\n".join(doc.page_content for doc in documents)
+        text_splitter = make_text_splitter()
+        pending = []
+        # chunk_id theo trang đầu của chunk; chunk vắt qua trang có thể được trả về ở trang sau
+        page_chunk_ids = {}
+        added_ids = []
+        # (chunk_id cũ, metadata mới) của các chunk dùng lại
+        reused = []
+        num_chunks = 0
+        num_pages = 0
+        split_seconds = 0.0
+        start = time.perf_counter()
         try:
-            with open(output_file_path, 'w', encoding='utf-8') as file:
-                file.write(all_text)
+            writer = TextIndexWriter(ContextRetriever(output_dir), f"{doc_id}.txt")
         except IOError as e:
-            print(f"Error writing to file {output_file_path}: {e}")
+            print(f"Error writing original text for {file_path}: {e}")
             return None
+        try:
+            page_texts = tracing.timed_iter(iter_page_texts(file_path, backend), "pdf_load",
+                                            file=os.path.basename(file_path), backend=backend)
+            for page, text in enumerate(page_texts):
+                writer.add_page(text)
+                split_start = time.perf_counter()
+                pending.extend(self.make_chunks(doc_id, file_path, total_pages, text_splitter.feed(text),
+                                                page_chunk_ids, old_by_text, reused))
+                split_seconds += time.perf_counter() - split_start
+                if len(pending) >= batch_size:
+                    added_ids.extend(chunk.metadata["chunk_id"] for chunk in pending)
+                    # chunk cũ của chính tài liệu sắp bị thay, không làm bản giữ lại cho chunk trùng
+                    self.add_chunks(pending, save=False, exclude=old_ids)
+                    num_chunks += len(pending)
+                    pending = []
+                num_pages = page + 1
+                if progress_callback:
+                    progress_callback(file_path, num_pages, total_pages, num_chunks)
+            pending.extend(self.make_chunks(doc_id, file_path, total_pages, text_splitter.finish(),
+                                            page_chunk_ids, old_by_text, reused))
+            if pending:
+                added_ids.extend(chunk.metadata["chunk_id"] for chunk in pending)
+                self.add_chunks(pending, save=False, exclude=old_ids)
+                num_chunks += len(pending)
+            if progress_callback:
+                progress_callback(file_path, num_pages, total_pages, num_chunks)
+            # đổi trang / offset của chunk cũ sau cùng, để hủy giữa chừng vẫn khớp với file text cũ
+            for chunk_id, values in reused:
+                self.update_chunk_metadata([chunk_id], **values)
+            self.delete_chunks(old_ids - {chunk_id for chunk_id, _ in reused}, save=False)
+            self.catalog.set_pages(doc_id, [(page, page_chunk_ids.get(page, [])) for page in range(num_pages)])
+        except BaseException:
+            writer.abort()
+            self.delete_chunks(added_ids, save=False)
+            raise
+        finally:
+            writer.close()
+            self.save_collection()
+
+        tracing.record_span("pdf_split", split_seconds, file=os.path.basename(file_path),
+                            pages=num_pages, chunks=num_chunks, reused_chunks=len(reused))
+        stats = self.last_ingest_stats
+        stats["pages"] += num_pages
+        stats["reused_chunks"] = stats.get("reused_chunks", 0) + len(reused)
+        stats["parse_seconds"] += time.perf_counter() - start
+        stats["pages_per_sec"] = stats["pages"] / stats["parse_seconds"]
+        print(f"Streamed {num_pages} pages, {num_chunks} new chunks ({len(reused)} unchanged) from {file_path}")
+        return doc_id if self.count_chunks(doc_id) else None
 
+    def make_chunk(self, doc_id, file_path, total_pages, page, content, offset_start, offset_end, end_page=None):
+        metadata = {
+            "source": file_path,
+            "total_pages": total_pages,
+            "page": page,
+            "doc_id": doc_id,
+            "offset_start": offset_start,
+            "offset_end": offset_end,
+            "chunk_id": uuid.uuid4().hex,
+        }
+        # chỉ ghi end_page cho chunk vắt qua trang, chunk trong một trang không cần
+        if end_page is not None and end_page != page:
+            metadata["end_page"] = end_page
+        return Document(page_content=content, metadata=metadata)
+
+    def make_chunks(self, doc_id, file_path, total_pages, split_chunks, page_chunk_ids, old_by_text=None,
+                    reused=None):
+        '''
+        :param split_chunks: các tuple (text, page, end_page, offset_start, offset_end) của SentenceSplitter
+        :param old_by_text: hash text -> chunk_id cũ; chunk có text trùng dùng lại chunk_id cũ, được ghi
+                            vào reused kèm metadata mới thay vì trả về
+        :return: các chunk Document mới
+        '''
         chunks = []
-        for doc in documents:
-            page_chunks = self.process_document(doc)
-            chunks.extend(page_chunks)
+        for content, page, end_page, offset_start, offset_end in split_chunks:
+            old_ids = old_by_text.get(hash_text(content)) if old_by_text else None
+            if old_ids:
+                chunk_id = old_ids.pop()
+                reused.append((chunk_id, {"page": page, "end_page": end_page, "total_pages": total_pages,
+                                          "offset_start": offset_start, "offset_end": offset_end}))
+            else:
+                chunk = self.make_chunk(doc_id, file_path, total_pages, page, content, offset_start, offset_end,
+                                        end_page)
+                chunk_id = chunk.metadata["chunk_id"]
+                chunks.append(chunk)
+            page_chunk_ids.setdefault(page, []).append(chunk_id)
+        return chunks
 
-        if chunks:
-            embedding_model = custom_embeddings
-            db = FAISS.from_documents(chunks, embedding_model)
-            db_path = os.path.join(self.vector_db_path, file_name_without_ext)
-            db.save_local(db_path)
-            existing_hashes[file_hash] = file_path
-            self.save_hashes(existing_hashes)
-            return db
-        else:
-            print("No new documents to add to the database.")
+    def chunks_by_text(self, chunk_ids):
+        ''':return: hash text -> list chunk_id (chunk trong index hoặc alias)'''
+        by_text = {}
+        with self.lock:
+            for chunk_id in chunk_ids:
+                alias = self.dedup.aliases.get(chunk_id)
+                if alias is not None and alias["text"]:
+                    text = alias["text"]
+                else:
+                    source_id = alias["target"] if alias is not None else chunk_id
+                    if self.db is None or self.db.docstore.locate(source_id) is None:
+                        continue
+                    text = next(self.db.docstore.texts_for([source_id]))
+                by_text.setdefault(hash_text(text), []).append(chunk_id)
+        return by_text
+
+    def save_original_text(self, doc_id, file_path, pages):
+        '''
+        Ghi text của PDF vào original_text/<doc_id>.txt kèm chỉ mục offset rồi chia chunk cả tài liệu,
+        :param pages: list text trang
+        :return: (các chunk Document có vị trí byte trong trang, list (page, chunk_ids))
+        '''
+        output_dir = 'original_text'
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            with TextIndexWriter(ContextRetriever(output_dir), f"{doc_id}.txt") as writer:
+                for text in pages:
+                    writer.add_page(text)
+        except IOError as e:
+            print(f"Error writing original text for {file_path}: {e}")
             return None
 
+        page_chunk_ids = {}
+        with tracing.span("pdf_split", file=os.path.basename(file_path), pages=len(pages)) as span:
+            chunks = self.make_chunks(doc_id, file_path, len(pages), make_text_splitter().split_pages(pages),
+                                      page_chunk_ids)
+            span.set(chunks=len(chunks))
+        page_rows = [(page, page_chunk_ids.get(page, [])) for page in range(len(pages))]
+        return chunks, page_rows
+
+
+class TextIndexWriter:
+    '''
+    Ghi file original_text theo từng trang (các trang nối bằng "\\n"), đồng thời ghi
+    vị trí byte đầu mỗi trang và vị trí (đầu, cuối) của từng từ cho ContextRetriever.
+    Vị trí từ được ghi dần ra file tạm nên không cần giữ cả tài liệu trong bộ nhớ.
+    '''
+    def __init__(self, retriever, file_name):
+        self.retriever = retriever
+        self.file_name = file_name
+        self.pages_path, self.words_path = retriever.index_paths(file_name)
+        self.words_part_path = self.words_path + ".part"
+        self.text_path = os.path.join(retriever.context_dir, file_name)
+        # ghi ra file tạm rồi os.replace, tránh làm hỏng file đang được mmap ở nơi khác
+        self.text_file = open(self.text_path + ".part", 'wb')
+        self.words_file = open(self.words_part_path, 'wb')
+        self.page_starts = []
+        self.position = 0
+        self.num_words = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add_page(self, text):
+        data = text.encode('utf-8')
+        if self.page_starts:
+            self.text_file.write(b"\n")
+            self.position += 1
+        self.page_starts.append(self.position)
+        self.text_file.write(data)
+        words = ContextRetriever.find_words(data) + self.position
+        words.tofile(self.words_file)
+        self.num_words += len(words)
+        self.position += len(data)
+
+    def close(self):
+        if self.text_file.closed:
+            return
+        self.text_file.close()
+        self.words_file.close()
+        with open(self.pages_path + ".part", 'wb') as file:
+            np.save(file, np.asarray(self.page_starts, dtype=np.int64))
+
+        words = np.lib.format.open_memmap(self.words_path + ".tmp", mode='w+', dtype=np.int64,
+                                          shape=(self.num_words, 2))
+        if self.num_words:
+            part = np.memmap(self.words_part_path, dtype=np.int64, mode='r', shape=(self.num_words, 2))
+            for start in range(0, self.num_words, 1 << 20):
+                words[start:start + (1 << 20)] = part[start:start + (1 << 20)]
+            del part
+        words.flush()
+        del words
+        os.remove(self.words_part_path)
+        os.replace(self.text_path + ".part", self.text_path)
+        os.replace(self.pages_path + ".part", self.pages_path)
+        os.replace(self.words_path + ".tmp", self.words_path)
+        self.retriever.forget(self.file_name)
+
+    def abort(self):
+        '''Bỏ các file tạm, file text và chỉ mục cũ (nếu có) giữ nguyên.'''
+        if self.text_file.closed:
+            return
+        self.text_file.close()
+        self.words_file.close()
+        for path in (self.text_path + ".part", self.words_part_path):
+            if os.path.exists(path):
+                os.remove(path)
+
 
 class ContextRetriever:
+    whitespace_bytes = np.frombuffer(b" \t\n\r\x0b\x0c", dtype=np.uint8)
+
     def __init__(self, context_dir='original_text'):
         self.context_dir = context_dir
 
+    def index_paths(self, file_name):
+        base = os.path.join(self.context_dir, os.path.splitext(file_name)[0])
+        return base + ".pages.npy", base + ".words.npy"
+
+    @classmethod
+    def find_words(cls, data):
+        '''
+        :return: mảng (n, 2) vị trí byte (đầu, cuối) của các từ trong data
+        '''
+        data = np.frombuffer(data, dtype=np.uint8)
+        is_word = ~np.isin(data, cls.whitespace_bytes)
+        edges = np.diff(np.concatenate(([False], is_word, [False])).astype(np.int8))
+        return np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1).astype(np.int64)
+
+    def registry_key(self, file_name):
+        return ("text", os.path.abspath(os.path.join(self.context_dir, file_name)))
+
+    def forget(self, file_name):
+        index_registry.invalidate(self.registry_key(file_name))
+
+    def acquire_index(self, file_name):
+        '''
+        Index offset của file, dùng chung mọi ContextRetriever trong process qua index_registry.
+        :return: IndexHandle (release sau khi dùng xong) hoặc None
+        '''
+        file_path = os.path.join(self.context_dir, file_name)
+        pages_path, words_path = self.index_paths(file_name)
+        try:
+            mtime = os.path.getmtime(words_path)
+        except OSError:
+            return None
+
+        def load():
+            try:
+                with open(file_path, 'rb') as file:
+                    text = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                print(f"Error mapping file {file_path}: {e}")
+                return None
+            index = {
+                "text": text,
+                "pages": np.load(pages_path),
+                "words": np.load(words_path, mmap_mode='r'),
+            }
+            return index, file_sizes((file_path, pages_path, words_path))
+
+        return index_registry.acquire(self.registry_key(file_name), load, version=mtime)
+
+    def load_index(self, file_name):
+        handle = self.acquire_index(file_name)
+        if handle is None:
+            return None
+        # mmap vẫn đọc được sau khi registry bỏ index, chỉ không còn được dùng chung
+        handle.release()
+        return handle.value
+
+    def expand_by_offsets(self, index, metadata, context, num_words_before, num_words_after):
+        page_start = int(index["pages"][metadata["page"]])
+        start = page_start + metadata["offset_start"]
+        end = page_start + metadata["offset_end"]
+        words = index["words"]
+        if len(words) == 0:
+            return context
+
+        # từ đầu tiên kết thúc sau start, và từ đầu tiên bắt đầu từ end trở đi
+        first = int(np.searchsorted(words[:, 1], start, side='right'))
+        last = int(np.searchsorted(words[:, 0], end, side='left'))
+        lo = max(0, first - num_words_before)
+        hi = min(len(words), last + num_words_after)
+
+        text = index["text"]
+        before_context = text[int(words[lo, 0]):start].decode('utf-8', errors='ignore') if lo < first else ""
+        after_context = text[end:int(words[hi - 1, 1])].decode('utf-8', errors='ignore') if hi > last else ""
+        return " ".join(before_context.split()) + " " + context + " " + " ".join(after_context.split())
+
+    def chunk_words(self, index, metadata):
+        ''':return: (từ đầu, từ cuối + 1) của chunk trong mảng words của file'''
+        page_start = int(index["pages"][metadata["page"]])
+        words = index["words"]
+        first = int(np.searchsorted(words[:, 1], page_start + metadata["offset_start"], side='right'))
+        last = int(np.searchsorted(words[:, 0], page_start + metadata["offset_end"], side='left'))
+        return first, max(first, last)
+
+    def words_text(self, index, lo, hi):
+        '''Text từ từ thứ lo đến hết từ thứ hi - 1, khoảng trắng gộp thành một dấu cách.'''
+        if hi <= lo:
+            return ""
+        words = index["words"]
+        data = index["text"][int(words[lo, 0]):int(words[hi - 1, 1])]
+        return " ".join(data.decode('utf-8', errors='ignore').split())
+
     def read_text_file(self, file_name):
         file_path = os.path.join(self.context_dir, file_name)
         try:
@@ -135,7 +1107,13 @@ class ContextRetriever:
             print(f"Error reading file {file_path}: {e}")
             return ""
 
-    def expand_context(self, file_name, context, num_words_before=200, num_words_after=200):
+    def expand_context(self, file_name, context, num_words_before=200, num_words_after=200, metadata=None):
+        if metadata is not None and "offset_start" in metadata:
+            index = self.load_index(file_name)
+            if index is not None:
+                return self.expand_by_offsets(index, metadata, context, num_words_before, num_words_after)
+
+        # Chunk cũ không có offset: tìm lại trong toàn bộ file
         all_text = self.read_text_file(file_name)
         if not all_text:
             return "Context not found"
@@ -0,0 +1,33 @@
+from langchain_core.prompts import PromptTemplate
+
+# Prompt cho chế độ hỏi đáp PDF, tách khỏi chat.py để import không cần secrets của Gemini
+custom_prompt_template = """
+Yêu cầu cụ thể là tổng hợp thông tin trong các đoạn Context để trả lời câu hỏi. 
+Các chỉ mục đánh số dưới đây là các mô tả nhiệm vụ:
+
+1. Nếu câu trả lời không có trong Context hoặc bạn không chắc chắn, hãy trả lời: 
+   "Tôi không có đủ thông tin để trả lời câu hỏi này. Vui lòng cung cấp thêm thông tin liên quan đến câu hỏi."
+
+2. Không suy đoán và bịa đặt nội dung ngoài.
+
+3. Chỉ trả lời thông tin theo Context tìm được. Trả lời đầy đủ thông tin liên quan đến câu hỏi, 
+   bao gồm cả việc liệt kê các ý nhỏ nếu cần.
+
+4. Thông tin thường chỉ nằm trong một đoạn context. Các đoạn context được chia cách bởi chuỗi "SEPARATED".
+
+5. Chỉ sử dụng History khi người dùng hỏi về câu hỏi trước đó:
+
+History: {history_global}
+
+Context: {context}
+
+Question: {question}
+
+Câu trả lời:
+"""
+
+
+def set_custom_prompt():
+    prompt = PromptTemplate(template=custom_prompt_template,
+                            input_variables=['history_global', 'context', 'question'])
+    return prompt
@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+import tracing
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# cross-encoder đa ngôn ngữ nhỏ, chạy được trên CPU và hiểu tiếng Việt
+rerank_model_name = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+
+
+class Reranker:
+    '''
+    Chấm lại top-N ứng viên bằng cross-encoder trong một lần forward theo batch.
+    Quá budget_seconds thì giữ nguyên thứ tự ban đầu (câu trả lời không phải chờ model).
+    '''
+    def __init__(self, model_name=rerank_model_name, budget_seconds=0.5, batch_size=32, max_length=512):
+        self.model_name = model_name
+        self.budget_seconds = budget_seconds
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._model = None
+        self.model_lock = threading.Lock()
+        # một worker: lần chấm quá budget vẫn chạy nốt ở nền, không chiếm thêm CPU;
+        # pending là việc đang chạy (tải model / chấm điểm), còn chạy thì câu hỏi sau không xếp hàng sau nó
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        # kiểm tra busy và submit trong cùng một khóa: các thread server không cùng thấy "rảnh" rồi xếp hàng
+        self.submit_lock = threading.Lock()
+        self.last_stats = {}
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self.model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+        return self._model
+
+    def busy(self):
+        return self.pending is not None and not self.pending.done()
+
+    def try_submit(self, fn, *args):
+        ''':return: future, hoặc None nếu việc trước còn chạy'''
+        with self.submit_lock:
+            if self.busy():
+                return None
+            self.pending = self.executor.submit(fn, *args)
+            return self.pending
+
+    def load_async(self):
+        '''Tải model ở nền (lúc khởi động), không tính vào budget của câu hỏi.'''
+        if self._model is None:
+            self.try_submit(lambda: self.model)
+
+    def score(self, query, texts):
+        return self.model.predict([(query, text) for text in texts], batch_size=self.batch_size)
+
+    def skip(self, docs_scores, k, reason, elapsed=0.0):
+        self.last_stats = {"seconds": elapsed, "candidates": len(docs_scores), "timed_out": reason == "timeout",
+                           "skipped": reason}
+        tracing.record_span("rerank", elapsed, candidates=len(docs_scores), timed_out=reason == "timeout",
+                            skipped=reason)
+        print(f"Rerank skipped ({reason}), keeping retrieval order")
+        return docs_scores[:k]
+
+    def rerank(self, query, docs_scores, k=2):
+        '''
+        :param docs_scores: list (Document, điểm) theo thứ tự của bước retrieval
+        :return: k phần tử đầu sau khi chấm lại, điểm là điểm của cross-encoder
+        '''
+        if len(docs_scores) <= 1:
+            return docs_scores[:k]
+        if self._model is None:
+            self.load_async()
+            return self.skip(docs_scores, k, "loading")
+        start = time.perf_counter()
+        future = self.try_submit(self.score, query, [doc.page_content for doc, _ in docs_scores])
+        if future is None:
+            # lần chấm trước còn chạy: xếp hàng sau nó chắc chắn quá budget
+            return self.skip(docs_scores, k, "busy")
+        try:
+            scores = future.result(timeout=self.budget_seconds)
+        except TimeoutError:
+            future.cancel()
+            elapsed = time.perf_counter() - start
+            print(f"Rerank exceeded budget ({elapsed * 1000:.0f} ms > {self.budget_seconds * 1000:.0f} ms)")
+            return self.skip(docs_scores, k, "timeout", elapsed)
+
+        elapsed = time.perf_counter() - start
+        self.last_stats = {"seconds": elapsed, "candidates": len(docs_scores), "timed_out": False}
+        tracing.record_span("rerank", elapsed, candidates=len(docs_scores), timed_out=False)
+        print(f"Reranked {len(docs_scores)} candidates in {elapsed * 1000:.0f} ms")
+        order = sorted(range(len(docs_scores)), key=lambda i: scores[i], reverse=True)
+        return [(docs_scores[i][0], float(scores[i])) for i in order[:k]]
+
+    def warm_up(self):
+        self.score("khởi động", ["khởi động"])
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    '''Chỉ tạo Reranker khi bật RERANK=1; model được tải ở nền (load_async / warm_up).'''
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = Reranker(budget_seconds=float(os.getenv("RERANK_BUDGET_MS", "500")) / 1000)
+    return _reranker
@@ -0,0 +1,183 @@
+import bisect
+import re
+from collections import deque
+
+from text_processor import TextProcessor
+
+DEFAULT_END_TOKENS = {".", "!", "?", "...", "…"}
+# dấu đóng ngoặc / nháy có thể đứng sau dấu kết câu: Anh ấy nói: "Xong rồi."
+CLOSING_CHARS = "\"'”’»)]}"
+
+
+class SentenceSplitter:
+    '''
+    Chia chunk cho cả tài liệu trong một lần duyệt, thay cho RecursiveCharacterTextSplitter
+    chạy riêng từng trang. Các trang được nối bằng "\\n" như file original_text nên câu nằm
+    vắt qua hai trang vẫn nguyên vẹn. Text được tách thành câu theo các dấu kết câu trong
+    end_tokens.txt (câu dài hơn chunk_size thì tách theo từ), chunk gồm các câu liền nhau
+    dài tối đa chunk_size ký tự, chunk sau lặp lại các câu cuối của chunk trước trong
+    giới hạn chunk_overlap ký tự.
+
+    Mỗi chunk là tuple (text, page, end_page, offset_start, offset_end): trang đầu, trang cuối
+    và vị trí byte UTF-8 tính từ đầu trang page (offset_end có thể vượt qua cuối trang đó).
+
+        splitter = SentenceSplitter()
+        for text in pages:
+            chunks = splitter.feed(text)   # các chunk đã đủ, có thể bắt đầu ở trang trước
+        chunks = splitter.finish()
+    '''
+    def __init__(self, chunk_size=512, chunk_overlap=256, end_tokens=None):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        end_tokens = end_tokens or TextProcessor().get_end_tokens() or DEFAULT_END_TOKENS
+        # cuối câu: chuỗi ký tự của các end token ("...", "?!", "。。。"), có thể kèm dấu đóng, rồi đến khoảng trắng;
+        # hoặc dòng trống. Regex bắt đầu bằng một tập ký tự để re tìm nhanh vị trí ứng viên
+        chars = re.escape("".join(sorted(set("".join(end_tokens)) - set(" \t\r\n"))))
+        closing = re.escape(CLOSING_CHARS)
+        self.boundary = re.compile(rf"[{chars}\n](?:(?<=\n)[ \t\r]*\n|(?<!\n)[{chars}]*[{closing}]*(?=\s))")
+        self.word = re.compile(r"\S+")
+        self.reset()
+
+    def reset(self):
+        self.page_chars = []
+        self.page_bytes = []
+        # text tài liệu từ vị trí base (ký tự) / base_byte đến hết trang đã nạp
+        self.text = ""
+        self.base = 0
+        self.base_byte = 0
+        self.end_byte = 0
+        # vị trí (ký tự, byte) đầu chunk vừa trả về, để tính byte của chunk sau không phải mã hóa lại từ base
+        self.cursor = 0
+        self.cursor_byte = 0
+        # text trước scan đã được tách câu
+        self.scan = 0
+        # các câu (ký tự đầu, ký tự cuối) của chunk đang gom, liền nhau, tính cả khoảng trắng trước câu
+        self.window = deque()
+        self.emitted_end = 0
+        self.ready = []
+
+    def split_pages(self, pages):
+        ''':return: list chunk của các trang'''
+        self.reset()
+        chunks = []
+        for text in pages:
+            chunks.extend(self.feed(text))
+        chunks.extend(self.finish())
+        return chunks
+
+    def start_page(self, text):
+        separator = "\n" if self.page_chars else ""
+        end = self.base + len(self.text)
+        self.page_chars.append(end + len(separator))
+        self.page_bytes.append(self.end_byte + len(separator))
+        self.end_byte += len(separator) + len(text.encode("utf-8"))
+        # bỏ phần text không còn cần: trước câu đầu của chunk đang gom và trước scan
+        keep = min(self.window[0][0] if self.window else self.scan, self.scan)
+        if keep > self.base:
+            self.base_byte = self.byte_at(keep)
+            self.text = self.text[keep - self.base:]
+            self.base = keep
+        self.text += separator + text
+
+    def feed(self, text):
+        self.start_page(text)
+        self.consume(final=False)
+        return self.take()
+
+    def finish(self):
+        self.consume(final=True)
+        self.flush()
+        return self.take()
+
+    def take(self):
+        ready, self.ready = self.ready, []
+        return ready
+
+    def consume(self, final):
+        '''Tách câu từ scan đến dấu kết câu cuối cùng (hoặc đến hết text nếu final).'''
+        text, base = self.text, self.base
+        start = self.scan - base
+        ends = [match.end() for match in self.boundary.finditer(text, start)]
+        end = len(text)
+        if not final:
+            end = ends[-1] if ends else start
+            if end == start and len(text) - start > 4 * self.chunk_size:
+                # trang không có dấu câu: không giữ text mãi, cắt ở khoảng trắng cuối
+                end = max(text.rfind(" ", start), text.rfind("\n", start), start)
+            if end == start:
+                return
+        for boundary in ends:
+            if boundary > end:
+                break
+            if boundary - start <= self.chunk_size:
+                self.add_segment(base + start, base + boundary)
+            else:
+                self.add_sentence(start, boundary)
+            start = boundary
+        if start < end:
+            self.add_sentence(start, end)
+        self.scan = base + end
+
+    def add_sentence(self, start, end):
+        '''start, end: vị trí trong self.text'''
+        if end - start <= self.chunk_size:
+            self.add_segment(self.base + start, self.base + end)
+            return
+        # câu quá dài: cắt trước từ làm đoạn (tính từ từ đầu tiên) vượt chunk_size
+        piece_start = start
+        first_word = None
+        for match in self.word.finditer(self.text, start, end):
+            word_start, word_end = match.span()
+            if first_word is not None and word_end - first_word > self.chunk_size:
+                self.add_segment(self.base + piece_start, self.base + word_start)
+                piece_start = word_start
+                first_word = None
+            if first_word is None:
+                first_word = word_start
+                # một từ dài hơn chunk_size: cắt cứng theo ký tự
+                while word_end - first_word > self.chunk_size:
+                    self.add_segment(self.base + piece_start, self.base + first_word + self.chunk_size)
+                    piece_start = first_word = first_word + self.chunk_size
+        if piece_start < end:
+            self.add_segment(self.base + piece_start, self.base + end)
+
+    def add_segment(self, start, end):
+        window = self.window
+        if window and end - window[0][0] > self.chunk_size:
+            self.emit()
+            # giữ lại các câu cuối làm phần lặp, miễn chunk kế tiếp vẫn vừa chunk_size
+            while window and (window[-1][1] - window[0][0] > self.chunk_overlap or end - window[0][0] > self.chunk_size):
+                window.popleft()
+        window.append((start, end))
+
+    def emit(self):
+        window = self.window
+        if not window or window[-1][1] <= self.emitted_end:
+            return
+        self.emitted_end = window[-1][1]
+        raw = self.text[window[0][0] - self.base:window[-1][1] - self.base]
+        content = raw.strip()
+        if not content:
+            return
+        start = window[0][0] + len(raw) - len(raw.lstrip())
+        end = start + len(content)
+        page = bisect.bisect_right(self.page_chars, start) - 1
+        end_page = bisect.bisect_right(self.page_chars, end - 1) - 1
+        offset_start = self.byte_at(start) - self.page_bytes[page]
+        self.ready.append((content, page, end_page, offset_start, offset_start + len(content.encode("utf-8"))))
+
+    def byte_at(self, position):
+        '''Vị trí byte UTF-8 của ký tự position (>= base) trong tài liệu.'''
+        if position >= self.cursor >= self.base:
+            char, byte = self.cursor, self.cursor_byte
+        else:
+            char, byte = self.base, self.base_byte
+        byte += len(self.text[char - self.base:position - self.base].encode("utf-8"))
+        self.cursor, self.cursor_byte = position, byte
+        return byte
+
+    def flush(self):
+        self.emit()
+        self.window.clear()
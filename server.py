@@ -0,0 +1,262 @@
+"""
+Service HTTP chạy độc lập với Streamlit, dùng chung một model và một index cho mọi người dùng.
+
+    LLM_BACKEND=stub python server.py [--host 127.0.0.1] [--port 8000]
+
+Import server.py không đọc st.secrets; chỉ backend gemini cần GOOGLE_API_KEY / MODEL_NAME.
+
+    POST   /ingest             body JSON {"paths": [...]} (file trên máy chủ)
+                               hoặc body PDF với Content-Type: application/pdf và ?filename=abc.pdf
+    GET    /documents
+    DELETE /documents/<doc_id>
+    POST   /query              {"question": "...", "documents": [doc_id, ...], "session_id": "...",
+                                "mode": "pdf_query" | "chat", "stream": false}
+    GET    /health, GET /metrics
+
+Câu hỏi đến cùng lúc được encode theo micro-batch (EMBEDDING_BATCH_WAIT_MS).
+Gọi LLM qua LLMClient: LLM_MAX_CONCURRENCY, LLM_RATE_PER_SEC, LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_HEDGE_AFTER_MS;
+backend stub giả lập độ trễ / lỗi bằng STUB_LLM_LATENCY_MS, STUB_LLM_TAIL_MS, STUB_LLM_TAIL_RATE, STUB_LLM_ERROR_RATE.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, unquote, urlparse
+
+import tracing
+from botMode import chatBotMode
+from embedding import custom_embeddings
+from index_registry import index_registry
+from llm_backend import LLM_BACKENDS, get_llm
+from pdf_processor import PDFDatabaseManager
+
+
+class RAGService:
+    def __init__(self, manager, llm, upload_dir="uploads", max_sessions=1000):
+        self.manager = manager
+        self.llm = llm
+        self.upload_dir = upload_dir
+        self.max_sessions = max_sessions
+        # lịch sử hội thoại theo session_id, bỏ session lâu không dùng khi quá max_sessions
+        self.sessions = OrderedDict()
+        self.sessions_lock = threading.Lock()
+        # ingest ghi vào catalog và index chung nên chạy lần lượt
+        self.ingest_lock = threading.Lock()
+
+    def save_upload(self, file_name, data):
+        file_name = os.path.basename(file_name or "")
+        if not file_name.lower().endswith(".pdf"):
+            raise ValueError("filename must end with .pdf")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        path = os.path.join(self.upload_dir, file_name)
+        with open(path + ".part", "wb") as f:
+            f.write(data)
+        os.replace(path + ".part", path)
+        return path
+
+    def ingest(self, paths):
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            raise ValueError(f"files not found: {missing}")
+        with self.ingest_lock:
+            results = self.manager.update_many(paths)
+            stats = dict(self.manager.last_ingest_stats)
+        # file đã có trong catalog không nằm trong results
+        documents = {path: results.get(path) or self.manager.get_doc_id(path) for path in paths}
+        return {"documents": documents, "stats": stats}
+
+    def list_documents(self):
+        return [dict(document, chunks=self.manager.count_chunks(document["doc_id"]))
+                for document in self.manager.list_documents()]
+
+    def remove_document(self, doc_id):
+        with self.ingest_lock:
+            return self.manager.remove_document(doc_id)
+
+    def get_session(self, session_id):
+        with self.sessions_lock:
+            session = self.sessions.pop(session_id, None) or SimpleNamespace(history_global=[])
+            self.sessions[session_id] = session
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return session
+
+    def make_bot(self, mode, documents, session_id):
+        '''chatBotMode nhẹ cho từng request; model, index và LLM dùng chung.'''
+        names = {document["file_name"]: document["doc_id"] for document in self.manager.list_documents()
+                 if documents is None or document["doc_id"] in documents}
+        session = self.get_session(session_id) if session_id else SimpleNamespace(history_global=[])
+        session.selected_pdfs = list(names)
+        bot = chatBotMode(llm=self.llm, session_state=session)
+        bot.manager = self.manager
+        bot.vector_db = names
+        bot.set_mode(mode)
+        return bot
+
+    def query(self, question, mode="pdf_query", documents=None, session_id=None):
+        '''
+        :return: (generator các đoạn câu trả lời, context, bot) — gọi xong generator thì bot.last_timings có số liệu
+        '''
+        if mode not in ("pdf_query", "chat"):
+            raise ValueError("mode must be pdf_query or chat")
+        bot = self.make_bot(mode, documents, session_id)
+        if mode == "chat":
+            return bot.process_question_stream(question), "", bot
+        stream, context = bot.process_question_stream(question)
+        return stream, context, bot
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service = None
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def read_json(self):
+        body = self.read_body()
+        return json.loads(body.decode("utf-8")) if body else {}
+
+    def handle_errors(self, handler):
+        try:
+            handler()
+        except (ValueError, KeyError, json.JSONDecodeError) as e:
+            self.send_json(400, {"error": str(e)})
+        except Exception as e:
+            print(f"Error handling {self.command} {self.path}: {e}")
+            self.send_json(500, {"error": str(e)})
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self.send_json(200, {"status": "ok", "chunks": self.service.manager.db.index.ntotal
+                                 if self.service.manager.db is not None else 0,
+                                 "index_registry": index_registry.stats()})
+        elif path == "/documents":
+            self.handle_errors(lambda: self.send_json(200, {"documents": self.service.list_documents()}))
+        elif path == "/metrics":
+            body = tracing.registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        match = re.fullmatch(r"/documents/([^/]+)", urlparse(self.path).path)
+        if match is None:
+            self.send_json(404, {"error": "not found"})
+            return
+        # doc_id có dấu cách / tiếng Việt đến dưới dạng percent-encoded
+        doc_id = unquote(match.group(1))
+        self.handle_errors(lambda: self.send_json(200, {"removed": self.service.remove_document(doc_id)}))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/ingest":
+            self.handle_errors(lambda: self.ingest(url))
+        elif url.path == "/query":
+            self.handle_errors(self.query)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def ingest(self, url):
+        if self.headers.get("Content-Type", "").startswith("application/pdf"):
+            file_name = parse_qs(url.query).get("filename", [None])[0]
+            paths = [self.service.save_upload(file_name, self.read_body())]
+        else:
+            paths = self.read_json().get("paths") or []
+            if not paths:
+                raise ValueError("paths is required")
+        self.send_json(200, self.service.ingest(paths))
+
+    def query(self):
+        request = self.read_json()
+        question = (request.get("question") or "").strip()
+        if not question:
+            raise ValueError("question is required")
+        start = time.perf_counter()
+        stream, context, bot = self.service.query(question, request.get("mode", "pdf_query"),
+                                                  request.get("documents"), request.get("session_id"))
+        request_id = tracing.current_request_id()
+        if not request.get("stream"):
+            answer = "".join(stream)
+            self.send_json(200, {"answer": answer, "context": context, "request_id": request_id,
+                                 "timings": dict(bot.last_timings, wall=time.perf_counter() - start)})
+            return
+
+        # stream câu trả lời bằng chunked transfer, mỗi đoạn text là một chunk
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        if request_id:
+            self.send_header("X-Request-ID", request_id)
+        self.end_headers()
+        for delta in stream:
+            data = delta.encode("utf-8")
+            if data:
+                self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # mặc định chỉ 5 kết nối chờ, nhiều client đồng thời sẽ bị reset
+    request_queue_size = 128
+
+
+def make_server(service, host="127.0.0.1", port=8000):
+    handler = type("BoundServiceHandler", (ServiceHandler,), {"service": service})
+    return ServiceServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--llm", choices=LLM_BACKENDS, default=os.getenv("LLM_BACKEND", "gemini"))
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("EMBEDDING_QUERY_BATCH", "32")))
+    parser.add_argument("--batch-wait-ms", type=float, default=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5")))
+    parser.add_argument("--upload-dir", default="uploads")
+    args = parser.parse_args()
+
+    # tạo LLM trước khi mở index: thiếu secrets của Gemini thì báo ngay, không phải chờ đến câu hỏi đầu tiên
+    try:
+        llm = get_llm(args.llm)
+    except Exception as e:
+        parser.error(f"cannot create LLM backend '{args.llm}': {e} (--llm stub runs without Gemini secrets)")
+    manager = PDFDatabaseManager.open("", "vectorstores/db_faiss", "vectorstores/catalog.sqlite3").value
+    custom_embeddings.enable_batching(args.batch_size, args.batch_wait_ms / 1000)
+    service = RAGService(manager, llm, args.upload_dir)
+    server = make_server(service, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port} (LLM backend: {args.llm})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
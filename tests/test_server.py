@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+import threading
+import unittest
+from http.client import HTTPConnection
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import make_server
+
+
+class FakeService:
+    '''Chỉ ghi lại doc_id được xóa, không cần model hay index.'''
+    def __init__(self):
+        self.removed = []
+
+    def remove_document(self, doc_id):
+        self.removed.append(doc_id)
+        return doc_id == "Chat with PDF"
+
+
+class DeleteDocumentTest(unittest.TestCase):
+    def setUp(self):
+        self.service = FakeService()
+        self.server = make_server(self.service, port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def delete(self, doc_id):
+        conn = HTTPConnection(*self.server.server_address)
+        try:
+            conn.request("DELETE", f"/documents/{quote(doc_id)}")
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    def test_delete_doc_id_with_space(self):
+        self.assertEqual(self.delete("Chat with PDF"), (200, {"removed": True}))
+        self.assertEqual(self.service.removed, ["Chat with PDF"])
+
+    def test_delete_non_ascii_doc_id(self):
+        self.assertEqual(self.delete("Tài liệu"), (200, {"removed": False}))
+        self.assertEqual(self.service.removed, ["Tài liệu"])
+
+
+if __name__ == "__main__":
+    unittest.main()
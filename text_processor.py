@@ -1,6 +1,20 @@
+import os
 import re
 import unicodedata
 
+WORD_PATTERN = re.compile(r'\w+')
+# đọc theo vị trí module, không phụ thuộc thư mục đang chạy (server.py, benchmarks)
+END_TOKENS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'end_tokens.txt')
+
+# từ để hỏi / từ đệm trong câu hỏi, cụm dài đặt trước để bị xóa trước
+QUESTION_WORDS = [
+    "như thế nào", "thế nào", "ra sao", "là gì", "là ai", "bao nhiêu", "bao giờ", "khi nào",
+    "tại sao", "vì sao", "ở đâu", "có phải", "phải không", "cho tôi biết", "cho biết",
+    "hãy", "vui lòng", "giúp tôi", "xin", "gì", "nào",
+]
+STOPWORDS_PATTERN = re.compile(
+    r'(?<!\w)(?:' + '|'.join(map(re.escape, QUESTION_WORDS)) + r')(?!\w)', re.IGNORECASE)
+
 class TextProcessor:
     def remove_markdown(self, text):
         '''
@@ -29,7 +43,7 @@ class TextProcessor:
 
     def get_end_tokens(self):
         try:
-            with open('end_tokens.txt', 'r', encoding='utf-8') as file:
+            with open(END_TOKENS_PATH, 'r', encoding='utf-8') as file:
                 end_tokens = set(token.strip() for token in file if token.strip())
             return end_tokens
         except FileNotFoundError:
@@ -43,12 +57,37 @@ class TextProcessor:
         :return: query sau khi đã loại bỏ các từ để hỏi như là gì, thế nào...
         mục đích: Dễ tìm kiếm tương đồng hơn cho RAG
         '''
-        return query
+        cleaned = STOPWORDS_PATTERN.sub(' ', unicodedata.normalize('NFC', query))
+        cleaned = re.sub(r'\s+', ' ', cleaned).strip(' ?.!,')
+        # câu hỏi toàn từ để hỏi thì giữ nguyên
+        return cleaned or query
 
     def remove_accents(self, input_str):
         nfkd_form = unicodedata.normalize('NFKD', input_str)
         return ''.join([c for c in nfkd_form if not unicodedata.combining(c)])
 
+    def fold_accents(self, word):
+        # NFKD không tách được đ thành d
+        return self.remove_accents(word).replace('đ', 'd').replace('Đ', 'D')
+
+    def tokenize(self, text, query=False):
+        '''
+        :param text:
+        :param query: True khi tách từ câu hỏi
+        :return: list term cho BM25: các âm tiết viết thường và cặp âm tiết liền nhau (bỏ dấu)
+        Văn bản được index cả dạng có dấu lẫn bỏ dấu; trong câu hỏi, âm tiết có dấu
+        chỉ khớp đúng dấu, âm tiết gõ không dấu khớp mọi cách bỏ dấu.
+        '''
+        words = WORD_PATTERN.findall(unicodedata.normalize('NFC', text).lower())
+        folded = [self.fold_accents(word) for word in words]
+        terms = []
+        for word, plain in zip(words, folded):
+            terms.append(word)
+            if not query and word != plain:
+                terms.append(plain)
+        terms.extend(f"{first}_{second}" for first, second in zip(folded, folded[1:]))
+        return terms
+
     def format_context(self, context):
         parts = context.split("SEPARATED")
         if len(parts) != 2:
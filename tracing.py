@@ -0,0 +1,245 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# TRACING=1 mới ghi span; tắt thì span() trả về một đối tượng rỗng dùng chung
+enabled = os.getenv("TRACING", "0") == "1"
+trace_log_path = os.getenv("TRACE_LOG", "logs/trace.jsonl")
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# thuộc tính số của span được cộng dồn thành counter theo stage
+COUNTED_ATTRIBUTES = ("pages", "chunks", "chars", "prompt_chars", "output_chars", "prompt_tokens", "output_tokens")
+
+
+class MetricsRegistry:
+    '''Counter và histogram trong process, xuất ra định dạng text của Prometheus.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.descriptions = {}
+
+    def inc(self, name, value=1, description=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            if description:
+                self.descriptions[name] = description
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, description=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets),
+                                                    "sum": 0.0, "count": 0}
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+                    break
+            histogram["sum"] += value
+            histogram["count"] += 1
+            if description:
+                self.descriptions[name] = description
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for kind, metrics in (("counter", self.counters), ("histogram", self.histograms)):
+                for name in sorted({name for name, _ in metrics}):
+                    if name in self.descriptions:
+                        lines.append(f"# HELP {name} {self.descriptions[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric_name, labels), value in sorted(metrics.items()):
+                        if metric_name != name:
+                            continue
+                        if kind == "counter":
+                            lines.append(f"{name}{self.format_labels(labels)} {value}")
+                            continue
+                        cumulative = 0
+                        for bound, count in zip(value["buckets"], value["counts"]):
+                            cumulative += count
+                            lines.append(f"{name}_bucket{self.format_labels(labels, [('le', bound)])} {cumulative}")
+                        lines.append(f"{name}_bucket{self.format_labels(labels, [('le', '+Inf')])} {value['count']}")
+                        lines.append(f"{name}_sum{self.format_labels(labels)} {value['sum']}")
+                        lines.append(f"{name}_count{self.format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def get_logger():
+    '''Log JSON-lines xoay vòng theo kích thước, chỉ mở file khi có span đầu tiên.'''
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                os.makedirs(os.path.dirname(trace_log_path) or ".", exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    trace_log_path, maxBytes=int(os.getenv("TRACE_LOG_MAX_BYTES", str(10 * 2 ** 20))),
+                    backupCount=int(os.getenv("TRACE_LOG_BACKUPS", "5")), encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger = logging.getLogger("rag.trace")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                logger.addHandler(handler)
+                _logger = logger
+    return _logger
+
+
+def set_enabled(value):
+    global enabled
+    enabled = value
+
+
+def new_request(request_id=None):
+    '''Gắn request ID cho các span tiếp theo trong context hiện tại (thread / task).'''
+    request_id = request_id or uuid.uuid4().hex[:16]
+    request_id_var.set(request_id)
+    return request_id
+
+
+def current_request_id():
+    return request_id_var.get()
+
+
+def record_span(name, seconds, start_time=None, **attributes):
+    '''Ghi một span đã đo sẵn thời gian (vd. đo trong process con hoặc cộng dồn nhiều lần).'''
+    if not enabled:
+        return
+    registry.observe("rag_stage_seconds", seconds, description="Duration of RAG pipeline stages", stage=name)
+    for key in COUNTED_ATTRIBUTES:
+        value = attributes.get(key)
+        if isinstance(value, (int, float)):
+            registry.inc(f"rag_{key}_total", value, stage=name)
+    if "error" in attributes:
+        registry.inc("rag_stage_errors_total", stage=name)
+    record = {
+        "ts": start_time if start_time is not None else time.time() - seconds,
+        "request_id": request_id_var.get(),
+        "span": name,
+        "duration_ms": round(seconds * 1000, 3),
+    }
+    record.update(attributes)
+    get_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+class Span:
+    __slots__ = ("name", "attributes", "start", "start_time")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        record_span(self.name, time.perf_counter() - self.start, self.start_time, **self.attributes)
+        return False
+
+
+class NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def span(name, **attributes):
+    '''
+    with span("embed", chunks=len(texts)) as s:
+        ...
+        s.set(chars=...)
+    '''
+    return Span(name, attributes) if enabled else NOOP_SPAN
+
+
+def timed_iter(iterable, name, **attributes):
+    '''Cộng dồn thời gian lấy từng phần tử của iterable (vd. đọc từng trang PDF), ghi một span khi hết.'''
+    if not enabled:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    seconds = 0.0
+    count = 0
+    start_time = time.time()
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            seconds += time.perf_counter() - start
+            break
+        seconds += time.perf_counter() - start
+        count += 1
+        yield item
+    record_span(name, seconds, start_time, items=count, **attributes)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    '''
+    Mở endpoint /metrics cho Prometheus scrape, chạy trong thread nền.
+    Mặc định chỉ nghe trên localhost; muốn Prometheus ở máy khác scrape thì truyền host="0.0.0.0".
+    '''
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics: serving Prometheus metrics on http://{host}:{port}/metrics")
+    return server
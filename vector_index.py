@@ -0,0 +1,85 @@
+import math
+import faiss
+import numpy as np
+
+# flat: tìm chính xác; hnsw: đồ thị, nhanh và không cần train;
+# ivfpq: nén vector bằng product quantization, cần train codebook, dùng cho collection lớn
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+
+
+def pq_subquantizers(dim, pq_m):
+    '''Số sub-quantizer phải chia hết số chiều, lấy ước lớn nhất không vượt quá pq_m.'''
+    for m in range(min(pq_m, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def make_index(index_type, dim, train_vectors=None, hnsw_m=32, ef_construction=80, nlist=None, pq_m=64,
+               min_train=10000):
+    '''
+    Tạo index rỗng. Với ivfpq cần ít nhất min_train vector để train,
+    chưa đủ thì trả về index flat (collection nhỏ tìm chính xác vẫn đủ nhanh).
+    '''
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}. Choose one of {INDEX_TYPES}")
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    # PQ 8 bit: mỗi sub-quantizer có 256 centroid nên cần ít nhất 256 vector
+    if index_type == "ivfpq" and train_vectors is not None and len(train_vectors) >= max(min_train, 256):
+        # khoảng 4*sqrt(n) cụm, mỗi cụm cần >= 39 vector để k-means không cảnh báo
+        nlist = nlist or max(1, min(int(4 * math.sqrt(len(train_vectors))), len(train_vectors) // 39))
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_subquantizers(dim, pq_m), 8)
+        index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+        return index
+    return faiss.IndexFlatL2(dim)
+
+
+def read_index(path, use_mmap=True):
+    '''
+    Mở index bằng mmap (read-only) để mở nhanh và các process dùng chung page cache;
+    loại index không hỗ trợ mmap thì đọc cả vào RAM.
+    :return: (index, có phải mmap không)
+    '''
+    if use_mmap:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY), True
+        except RuntimeError as e:
+            print(f"Cannot mmap {path}, loading into memory: {e}")
+    return faiss.read_index(path), False
+
+
+def reconstruct_all(index):
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def rebuild_index(index, vectors, index_type, **options):
+    '''
+    Dựng lại index từ vectors: ivfpq đã train thì giữ codebook cũ,
+    còn lại tạo index mới (ivfpq sẽ được train nếu đủ vector).
+    '''
+    if isinstance(index, faiss.IndexIVF) and index.is_trained and index_type == "ivfpq":
+        new_index = faiss.clone_index(index)
+        new_index.reset()
+    else:
+        new_index = make_index(index_type, index.d, vectors, **options)
+    if len(vectors):
+        new_index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    return new_index
+
+
+def search_parameters(index, selector=None, nprobe=None, ef_search=None):
+    '''Tham số search theo từng query: nprobe cho IVF, efSearch cho HNSW.'''
+    kwargs = {"sel": selector} if selector is not None else {}
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe or index.nprobe, **kwargs)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or index.hnsw.efSearch, **kwargs)
+    return faiss.SearchParameters(**kwargs) if kwargs else None